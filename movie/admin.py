@@ -0,0 +1,66 @@
+"""
+Admin interface. Mounted by api.py on ``/admin`` (if ``ADMIN`` is on) and
+only built, importing starlette-admin, on its first request. To run it as a
+separate app run uvicorn --factory admin:create_admin.
+"""
+from typing import Callable, Optional
+
+from sqlalchemy.engine import Engine
+from starlette.applications import Starlette
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from db import ENGINE
+from models import Movie
+
+__all__ = (
+    "LazyAdmin",
+    "create_admin",
+)
+
+
+def create_admin(engine: Engine = ENGINE) -> Starlette:
+    """App serving the admin on ``/admin``, with the engine of the API."""
+    from starlette_admin import TagsField
+    from starlette_admin.contrib.sqla import Admin, ModelView
+    from starlette_admin.contrib.sqla.converters import ModelConverter
+    from starlette_admin.converters import converts
+
+    class MovieConverter(ModelConverter):
+        # Genres stored as a bitmask (compact storage) are edited as a list
+        @converts("models.GenreMask")
+        def conv_genre_mask(self, *args, **kwargs):
+            return TagsField(**self._field_common(*args, **kwargs))
+
+    admin = Admin(engine, title="Admin")
+    admin.add_view(ModelView(Movie, converter=MovieConverter()))
+    app = Starlette()
+    admin.mount_to(app)
+    return app
+
+
+class LazyAdmin:
+    """ASGI app building the admin (see ``create_admin``) on first use.
+
+    To be mounted on ``/admin`` with the name ``admin``, as the admin pages
+    link to each other with ``url_for("admin:...")``.
+    """
+
+    def __init__(self, factory: Callable[[], Starlette] = create_admin):
+        self.factory = factory
+        self._app: Optional[ASGIApp] = None
+
+    @property
+    def app(self) -> ASGIApp:
+        if self._app is None:
+            # The admin app mounted on /admin by the factory
+            (mount,) = self.factory().routes
+            self._app = mount.app
+        return self._app
+
+    @property
+    def routes(self):
+        """Routes of the admin, looked up by ``url_for``."""
+        return self.app.routes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.app(scope, receive, send)
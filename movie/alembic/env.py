@@ -1,8 +1,11 @@
 from logging.config import fileConfig
 
-from sqlalchemy import engine_from_config, pool
-
 from alembic import context
+from sqlmodel import SQLModel
+
+import models  # noqa
+from db import make_engine
+from settings import DATABASE_URL
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -11,16 +14,13 @@ config = context.config
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
 if config.config_file_name is not None:
-    fileConfig(config.config_file_name)
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
 
-# add your model's MetaData object here
-# for 'autogenerate' support
-# from myapp import mymodel
-# target_metadata = mymodel.Base.metadata
-# target_metadata = None
-from models import Post  # noqa
+# Metadata of all the models, for 'autogenerate' support
+target_metadata = SQLModel.metadata
 
-target_metadata = Post.metadata
+# ``FORANA_DATABASE_URL`` unless ``sqlalchemy.url`` is set
+url = config.get_main_option("sqlalchemy.url") or DATABASE_URL
 
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
@@ -28,6 +28,25 @@ target_metadata = Post.metadata
 # ... etc.
 
 
+def include_object(object, name, type_, reflected, compare_to) -> bool:
+    """Leave tables the models know nothing about (the full-text search
+    index and its shadow tables) alone."""
+    return not (type_ == "table" and reflected and compare_to is None)
+
+
+# Options of both modes. Operations SQLite cannot do in place are rendered
+# as batch operations, which copy the whole table: on large tables, prefer
+# plain ADD COLUMN and CREATE INDEX (see the revisions in ``versions``).
+# Every revision runs in a transaction of its own, so that the write lock
+# is held for one step at a time.
+options = {
+    "target_metadata": target_metadata,
+    "include_object": include_object,
+    "render_as_batch": True,
+    "transaction_per_migration": True,
+}
+
+
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
 
@@ -40,12 +59,11 @@ def run_migrations_offline() -> None:
     script output.
 
     """
-    url = config.get_main_option("sqlalchemy.url")
     context.configure(
         url=url,
-        target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        **options,
     )
 
     with context.begin_transaction():
@@ -59,17 +77,15 @@ def run_migrations_online() -> None:
     and associate a connection with the context.
 
     """
-    connectable = engine_from_config(
-        config.get_section(config.config_ini_section, {}),
-        prefix="sqlalchemy.",
-        poolclass=pool.NullPool,
-    )
+    # Connections get the SQLite pragmas (WAL, busy timeout) of the API
+    connectable = make_engine(url)
 
     with connectable.connect() as connection:
-        context.configure(connection=connection, target_metadata=target_metadata)
+        context.configure(connection=connection, **options)
 
         with context.begin_transaction():
             context.run_migrations()
+    connectable.dispose()
 
 
 if context.is_offline_mode():
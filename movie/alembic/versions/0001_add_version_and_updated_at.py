@@ -0,0 +1,41 @@
+"""Add version and updated_at columns to movie
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 12:00:00.000000
+
+ADD COLUMN only changes the schema in SQLite (rows are not rewritten), so
+it is instant regardless of the size of the table. SQLite cannot add a
+column with a non-constant default: ``updated_at`` of existing rows stays
+NULL until they are updated, new rows get it from the insert (see
+``models``).
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Tables created by ``create_tables()`` already have the columns
+    columns = {
+        column["name"] for column in sa.inspect(op.get_bind()).get_columns("movie")
+    }
+    if "version" not in columns:
+        op.add_column(
+            "movie",
+            sa.Column("version", sa.Integer(), server_default="1", nullable=False),
+        )
+    if "updated_at" not in columns:
+        op.add_column("movie", sa.Column("updated_at", sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("movie", "updated_at")
+    op.drop_column("movie", "version")
@@ -1,19 +1,84 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from typing import Any, Callable, List
+
+from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi_crudrouter import SQLAlchemyCRUDRouter as CRUDRouter
-from sqlmodel import create_engine
-from starlette_admin.contrib.sqla import Admin, ModelView
+from fastapi.responses import PlainTextResponse
 
-from db import DATABASE_URL, get_db
-from models import Movie, MovieCreate, MovieUpdate
+from admin import LazyAdmin
+from batching import WriteBatcher
+from cache import LRUCache
+from crud import NEXT_CURSOR_HEADER, AsyncCRUDRouter, CRUDRouter, async_endpoint
+from db import ENGINE, dispose_engines, get_async_db, get_db
+from filters import movie_filters
+from metrics import (
+    PROMETHEUS_MEDIA_TYPE,
+    InstrumentedRoute,
+    Metrics,
+    MetricsMiddleware,
+    instrument_engines,
+)
+from middleware import CompressionMiddleware, ConditionalGetMiddleware
+from models import (
+    Movie,
+    MovieChange,
+    MovieCountResult,
+    MovieCreate,
+    MoviePatch,
+    MovieSearchResult,
+    MovieStatsResult,
+    MovieUpdate,
+    MovieYearResult,
+    check_storage,
+)
+from search import search
+from settings import (
+    ADMIN,
+    ASYNC,
+    BATCH_INTERVAL,
+    BATCH_MAX_SIZE,
+    BATCH_SYNCHRONOUS,
+    BATCH_WRITES,
+    BROTLI_LEVEL,
+    CACHE,
+    CACHE_CONTROL,
+    CACHE_MAX_SIZE,
+    CACHE_TTL,
+    CHANGES_POLL_INTERVAL,
+    CHANGES_STREAM_TIMEOUT,
+    COMPRESSION,
+    COMPRESSION_MIN_SIZE,
+    DEBUG,
+    DOCS,
+    FAST_JSON,
+    GZIP_LEVEL,
+    METRICS,
+    N_PLUS_ONE_THRESHOLD,
+)
+from stats import stats, stats_directors, stats_genres, stats_years
 
 __all__ = ("app",)
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Check the storage of the database on startup (see
+    ``models.check_storage``), write queued rows and close pooled
+    connections on (graceful) shutdown."""
+    await run_in_threadpool(check_storage, ENGINE)
+    yield
+    if BATCHER is not None:
+        await run_in_threadpool(BATCHER.close)
+    await dispose_engines()
+
+
 app = FastAPI(
-    docs_url="/api/docs",
-    redoc_url="/api/redoc",
-    debug=True,
+    docs_url="/api/docs" if DOCS else None,
+    redoc_url="/api/redoc" if DOCS else None,
+    openapi_url="/openapi.json" if DOCS else None,
+    debug=DEBUG,
+    lifespan=lifespan,
 )
 app.add_middleware(
     CORSMiddleware,
@@ -21,32 +86,120 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    # Expose 'Content-Disposition' header
-    expose_headers=["Content-Disposition"],
+    # Expose 'Content-Disposition', pagination cursor, cache and timing headers
+    expose_headers=[
+        "Content-Disposition",
+        NEXT_CURSOR_HEADER,
+        "ETag",
+        "Server-Timing",
+    ],
+)
+app.add_middleware(ConditionalGetMiddleware)
+if COMPRESSION:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=COMPRESSION_MIN_SIZE,
+        gzip_level=GZIP_LEVEL,
+        brotli_level=BROTLI_LEVEL,
+    )
+
+# Per request query count and timings
+METRICS_REGISTRY = Metrics(N_PLUS_ONE_THRESHOLD) if METRICS else None
+if METRICS_REGISTRY is not None:
+    instrument_engines()
+    app.router.route_class = InstrumentedRoute
+    app.add_middleware(MetricsMiddleware, metrics=METRICS_REGISTRY)
+
+# Group commit of creates
+BATCHER = (
+    WriteBatcher(
+        ENGINE,
+        Movie.__table__,
+        max_size=BATCH_MAX_SIZE,
+        interval=BATCH_INTERVAL / 1000,
+        synchronous=BATCH_SYNCHRONOUS,
+    )
+    if BATCH_WRITES
+    else None
 )
 
-app.include_router(
-    CRUDRouter(
-        schema=Movie,
-        create_schema=MovieCreate,
-        update_schema=MovieUpdate,
-        db_model=Movie,
-        db=get_db,
-    ),
-    prefix="/api",
+CACHE_BACKEND = LRUCache(max_size=CACHE_MAX_SIZE, ttl=CACHE_TTL) if CACHE else None
+
+# CRUD, search and stats routes run on the async engine when the async
+# mode is on
+router_class, router_db = (
+    (AsyncCRUDRouter, get_async_db) if ASYNC else (CRUDRouter, get_db)
+)
+router = router_class(
+    schema=Movie,
+    create_schema=MovieCreate,
+    update_schema=MovieUpdate,
+    db_model=Movie,
+    db=router_db,
+    filters=movie_filters,
+    upsert_key="title",
+    patch_schema=MoviePatch,
+    version_key="version",
+    modified_key="updated_at",
+    cache_control=CACHE_CONTROL,
+    cache=CACHE_BACKEND,
+    batcher=BATCHER,
+    change_model=MovieChange,
+    changes_poll_interval=CHANGES_POLL_INTERVAL,
+    changes_stream_timeout=CHANGES_STREAM_TIMEOUT,
+    fast_json=FAST_JSON,
+    route_class=app.router.route_class,
 )
 
-# Create admin
-ENGINE = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-admin = Admin(ENGINE, title="Admin")
 
-# Add view
-admin.add_view(ModelView(Movie))
+def read_endpoint(endpoint: Callable[..., Any]) -> Callable[..., Any]:
+    """Search and stats endpoints, on the async engine too in async mode."""
+    return async_endpoint(endpoint, get_async_db) if ASYNC else endpoint
+
+
+router.add_api_route(
+    "/search",
+    read_endpoint(search),
+    methods=["GET"],
+    response_model=List[MovieSearchResult],
+    summary="Search",
+)
+for path, endpoint, response_model, summary in (
+    ("/stats", stats, MovieStatsResult, "Stats"),
+    ("/stats/genres", stats_genres, List[MovieCountResult], "Stats per genre"),
+    ("/stats/directors", stats_directors, List[MovieCountResult], "Stats per director"),
+    ("/stats/years", stats_years, List[MovieYearResult], "Stats per year"),
+):
+    router.add_api_route(
+        path,
+        read_endpoint(endpoint),
+        methods=["GET"],
+        response_model=response_model,
+        summary=summary,
+    )
+app.include_router(router, prefix="/api")
 
-# Mount admin to your app
-admin.mount_to(app)
+# Admin, built on its first request
+if ADMIN:
+    app.mount("/admin", LazyAdmin(), name="admin")
 
 
 @app.get("/")
 def read_root():
     return {"status": "OK"}
+
+
+@app.get("/api/cache")
+def read_cache_stats():
+    if CACHE_BACKEND is None:
+        raise HTTPException(404, "Cache is disabled")
+    return CACHE_BACKEND.stats
+
+
+@app.get("/metrics", include_in_schema=False)
+def read_metrics():
+    if METRICS_REGISTRY is None:
+        raise HTTPException(404, "Metrics are disabled")
+    return PlainTextResponse(
+        METRICS_REGISTRY.render(), media_type=PROMETHEUS_MEDIA_TYPE
+    )
@@ -0,0 +1,175 @@
+"""
+Write-behind batching of inserts. See ``WriteBatcher``.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql.schema import Table
+
+__all__ = ("WriteBatcher",)
+
+logger = logging.getLogger(__name__)
+
+Pending = Tuple[Dict[str, Any], Future]
+
+
+class WriteBatcher:
+    """Group commit of single row inserts into ``table``.
+
+    Rows are submitted to an in-process queue. A single writer thread, on
+    a connection of its own, inserts them in one transaction as soon as
+    ``max_size`` rows are queued or ``interval`` seconds after the first,
+    so that a burst of inserts costs a single commit (and fsync). The
+    future of every submitted row resolves with the inserted row once that
+    commit lands.
+
+    If the transaction fails on a constraint, the rows of the batch are
+    inserted again one transaction each, so that only the offending rows
+    fail (with the ``IntegrityError``).
+
+    ``synchronous`` sets the ``synchronous`` pragma of the writer
+    connection on SQLite: ``FULL`` makes every commit durable before the
+    rows resolve, ``NORMAL`` (in WAL mode) may lose the last commits on a
+    power loss, but not on a crash of the process.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        table: Table,
+        max_size: int = 500,
+        interval: float = 0.005,
+        synchronous: Optional[str] = None,
+    ):
+        self.engine = engine
+        self.table = table
+        self.max_size = max_size
+        self.interval = interval
+        self.synchronous = synchronous
+        self.batches = 0
+        self.rows = 0
+        self._queue: "queue.Queue[Optional[Pending]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        # Connection of the writer thread
+        self._connection: Optional[Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "rows": self.rows,
+            "queued": self._queue.qsize(),
+        }
+
+    def submit(self, values: Dict[str, Any]) -> Future:
+        """Queue a row for insertion. The future resolves with the inserted
+        row (a dict)."""
+        future: Future = Future()
+        with self._lock:
+            if self._thread is None:
+                # Started on first use, after forking workers
+                self._thread = threading.Thread(
+                    target=self._run, name="write-batcher", daemon=True
+                )
+                self._thread.start()
+            self._queue.put((values, future))
+        return future
+
+    def close(self) -> None:
+        """Write the queued rows and stop the writer thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is not None:
+                self._queue.put(None)
+        if thread is not None:
+            thread.join()
+
+    def _connect(self) -> Connection:
+        if self._connection is None:
+            self._connection = self.engine.connect()
+            if self.synchronous and self.engine.dialect.name == "sqlite":
+                with self._connection.begin():
+                    self._connection.exec_driver_sql(
+                        f"PRAGMA synchronous = {self.synchronous}"
+                    )
+        return self._connection
+
+    def _run(self) -> None:
+        closed = False
+        try:
+            while not closed:
+                pending = self._queue.get()
+                if pending is None:
+                    break
+                batch = [pending]
+                deadline = time.monotonic() + self.interval
+                while len(batch) < self.max_size:
+                    try:
+                        pending = self._queue.get(
+                            timeout=max(deadline - time.monotonic(), 0)
+                        )
+                    except queue.Empty:
+                        break
+                    if pending is None:
+                        closed = True
+                        break
+                    batch.append(pending)
+                self._write(batch)
+        finally:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _write(self, batch: List[Pending]) -> None:
+        # Skip rows whose request went away (the future was cancelled)
+        batch = [
+            (values, future)
+            for values, future in batch
+            if future.set_running_or_notify_cancel()
+        ]
+        if not batch:
+            return
+        try:
+            rows = self._insert([values for values, _ in batch])
+        except IntegrityError:
+            # Find out which rows fail, one transaction per row
+            for values, future in batch:
+                try:
+                    future.set_result(self._insert([values])[0])
+                except Exception as e:
+                    future.set_exception(e)
+            return
+        except Exception as e:
+            logger.exception("Batch of %d rows failed", len(batch))
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), row in zip(batch, rows):
+            future.set_result(row)
+
+    def _insert(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Insert ``records`` in a single transaction and return the rows."""
+        connection = self._connect()
+        table = self.table
+        (pk,) = table.primary_key.columns
+        with connection.begin():
+            # One statement per row, to get the ids: still a single commit
+            ids = [
+                connection.execute(table.insert(), record).inserted_primary_key[0]
+                for record in records
+            ]
+            rows = {
+                row._mapping[pk]: dict(row._mapping)
+                for row in connection.execute(select(table).where(pk.in_(ids)))
+            }
+        self.batches += 1
+        self.rows += len(records)
+        return [rows[pk_value] for pk_value in ids]
@@ -0,0 +1,1435 @@
+"""
+CRUD router. Extends the ``fastapi_crudrouter`` SQLAlchemy router.
+"""
+import asyncio
+import base64
+import inspect
+import json
+import time
+from functools import update_wrapper
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Type,
+)
+
+from fastapi import Body, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi_crudrouter import SQLAlchemyCRUDRouter
+from fastapi_crudrouter.core import NOT_FOUND
+from fastapi_crudrouter.core._types import PAGINATION
+from pydantic import ValidationError, create_model, parse_obj_as
+from sqlalchemy import bindparam, delete, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, configure_mappers
+from sqlmodel import SQLModel
+
+from batching import WriteBatcher
+from cache import (
+    CacheBackend,
+    CacheEntry,
+    ResourceCache,
+    etag_matches,
+    http_date,
+    make_etag,
+)
+from metrics import chunked
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+__all__ = (
+    "AsyncCRUDRouter",
+    "BulkChunk",
+    "BulkResult",
+    "CRUDRouter",
+    "Change",
+    "NDJSON_MEDIA_TYPE",
+    "NEXT_CURSOR_HEADER",
+    "SSE_MEDIA_TYPE",
+    "async_endpoint",
+    "decode_cursor",
+    "dumps",
+    "encode_cursor",
+    "json_default",
+    "no_filters",
+)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+SSE_MEDIA_TYPE = "text/event-stream"
+# Seconds of silence after which a change stream sends a comment, so that
+# proxies do not drop the connection
+SSE_KEEPALIVE_INTERVAL = 15.0
+
+
+def json_default(value: Any) -> Any:
+    """Encode values the ``json`` module does not know about."""
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def dumps(value: Any) -> bytes:
+    """Serialize to compact JSON bytes, with ``orjson`` if installed."""
+    if orjson is not None:
+        return orjson.dumps(value, default=json_default)
+    return json.dumps(value, default=json_default, separators=(",", ":")).encode()
+
+
+class BulkChunk(SQLModel, table=False):
+    """Statistics of a single bulk write chunk."""
+
+    size: int
+    created: int
+    updated: int
+    deleted: int = 0
+    seconds: float
+    rows_per_second: float
+
+
+class BulkResult(SQLModel, table=False):
+    """Result of a bulk write."""
+
+    created: int
+    updated: int
+    deleted: int = 0
+    seconds: float
+    chunks: List[BulkChunk]
+
+
+class Change(SQLModel, table=False):
+    """Entry of a change log: the last change of a row, with the current row
+    (``None`` once deleted)."""
+
+    seq: int
+    op: str
+    id: Any
+
+
+async def iter_json_array(request: Request) -> AsyncIterator[Any]:
+    """Iterate over the records of a JSON array request body."""
+    try:
+        data = await request.json()
+    except ValueError:
+        raise HTTPException(400, "Invalid JSON") from None
+    if not isinstance(data, list):
+        raise HTTPException(400, "Expected a JSON array")
+    for record in data:
+        yield record
+
+
+async def iter_ndjson(request: Request) -> AsyncIterator[Any]:
+    """Iterate over the records of an NDJSON request body as it arrives."""
+    buffer = b""
+    async for data in request.stream():
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield parse_ndjson_line(line)
+    if buffer.strip():
+        yield parse_ndjson_line(buffer)
+
+
+def parse_ndjson_line(line: bytes) -> Any:
+    """Parse a single NDJSON line."""
+    try:
+        return json.loads(line)
+    except ValueError:
+        raise HTTPException(400, "Invalid NDJSON") from None
+
+
+def no_filters() -> List[Any]:
+    """Default list filters dependency: no filtering at all."""
+    return []
+
+
+def encode_cursor(pk: Any) -> str:
+    """Encode primary key value into an opaque cursor."""
+    data = json.dumps({"pk": pk}).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, pk_type: Any = None) -> Any:
+    """Decode an opaque cursor into a primary key value, of ``pk_type``
+    if given (an int or a string otherwise)."""
+    padding = "=" * (-len(cursor) % 4)
+    try:
+        pk = json.loads(base64.urlsafe_b64decode(cursor + padding))["pk"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(400, "Invalid cursor") from None
+    types = pk_type if pk_type in (int, str) else (int, str)
+    # Crafted cursors: any other JSON value, or an int SQLite cannot bind
+    if isinstance(pk, bool) or not isinstance(pk, types):
+        raise HTTPException(400, "Invalid cursor")
+    if isinstance(pk, int) and not -(2**63) <= pk < 2**63:
+        raise HTTPException(400, "Invalid cursor")
+    return pk
+
+
+def async_endpoint(
+    endpoint: Callable[..., Any], db: Callable[..., Any]
+) -> Callable[..., Any]:
+    """Coroutine version of a sync ``endpoint`` reading from its ``db``
+    session: the session is an ``AsyncSession`` of the ``db`` dependency,
+    and ``endpoint`` runs on it through ``run_sync``, as the routes of
+    ``AsyncCRUDRouter`` do."""
+
+    async def wrapper(**kwargs: Any) -> Any:
+        session: AsyncSession = kwargs.pop("db")
+        return await session.run_sync(
+            lambda sync_session: endpoint(db=sync_session, **kwargs)
+        )
+
+    update_wrapper(wrapper, endpoint)
+    signature = inspect.signature(endpoint)
+    wrapper.__signature__ = signature.replace(  # type: ignore
+        parameters=[
+            parameter.replace(default=Depends(db), annotation=AsyncSession)
+            if name == "db"
+            else parameter
+            for name, parameter in signature.parameters.items()
+        ]
+    )
+    return wrapper
+
+
+class CRUDRouter(SQLAlchemyCRUDRouter):
+    """CRUD router with keyset pagination and streaming export.
+
+    Offset pagination (``skip``/``limit``) keeps working as before. When
+    the ``cursor`` query parameter is given, the page is selected with
+    ``WHERE pk > :cursor ORDER BY pk LIMIT :limit`` instead, so every page
+    costs the same regardless of how deep it is. Whenever a page is full,
+    the cursor of the next page is returned in the ``X-Next-Cursor``
+    response header.
+
+    The ``filters`` dependency returns a list of SQL clauses, which narrow
+    down the list, export and bulk delete and patch routes.
+
+    The ``/export.ndjson`` route streams the whole table as newline
+    delimited JSON, fetching ``export_batch_size`` rows at a time.
+
+    The ``/bulk`` route accepts a JSON array or an NDJSON stream of create
+    schemas and inserts them with executemany in chunks of ``chunk_size``
+    rows, one transaction per chunk. With ``upsert=true``, rows matching an
+    existing ``upsert_key`` value are updated instead of inserted. Records
+    are validated as they are read, so a record failing validation gets a
+    422 after the chunks before it are committed: the error gives its
+    ``index`` and the number of records ``committed`` (the first ones).
+
+    ``DELETE /bulk`` deletes, and ``PATCH /bulk`` updates (with a patch
+    schema), the rows matching the ``filters`` (at least one is required).
+    Matching rows are handled in chunks of ``chunk_size``, in primary key
+    order, with one set-based statement and one transaction per chunk, so
+    that the write lock is only held for a chunk at a time.
+
+    When a ``cache`` backend is given, responses of the list and detail
+    routes are cached (serialized) and served with an ``ETag``; a matching
+    ``If-None-Match`` gets a 304. Writes invalidate the affected entries.
+
+    With ``fast_json``, the list and detail routes select plain rows and
+    serialize them straight to JSON (see ``dumps``), skipping the response
+    model validation of every row. Database rows are trusted to match the
+    (unchanged) response model.
+
+    The list and detail routes take a ``fields`` query parameter (comma
+    separated field names). When given, only those columns are selected
+    and returned, the same way as with ``fast_json``.
+
+    With a ``version_key`` column, every update increments the version.
+    With a ``patch_schema`` (all fields optional), ``PATCH /{item_id}``
+    updates only the given fields in a single ``UPDATE``. If the version
+    is given too, the update only happens if it is still current (``WHERE
+    version = :version``), otherwise a 412 is returned.
+
+    List and detail responses get a ``cache_control`` header, if given.
+    With a ``modified_key`` column (the last modification time of a row),
+    detail responses get a ``Last-Modified`` header, for conditional
+    requests (see ``middleware.ConditionalGetMiddleware``). List pages do
+    not: the greatest modification time of the rows misses deletes and
+    rows leaving a filter. With a ``change_model`` (and no ``cache``), they
+    get an ``ETag`` of the sequence number of the last change instead,
+    which any write moves, and a matching ``If-None-Match`` gets a 304
+    without running the query.
+
+    With a ``batcher`` (see ``batching.WriteBatcher``), the create route
+    queues the new row and responds once the batch it is part of has been
+    committed, instead of committing it on its own.
+
+    With a ``change_model`` (a change log table with ``seq``, ``op`` and
+    ``<table>_id`` columns, kept up to date by the database, see
+    ``models``), ``GET /changes?since=`` returns the changes after sequence
+    number ``since``, in order, with the current rows. Clients sync by
+    passing the ``seq`` of the last change they have seen, which costs an
+    index range scan of the changes since. ``GET /changes/stream`` pushes
+    them as server-sent events, polling the log every
+    ``changes_poll_interval`` seconds. Streams end after
+    ``changes_stream_timeout`` seconds, and clients reconnect with the
+    ``Last-Event-ID`` header to resume.
+
+    ``GET /batch?ids=`` (comma separated ids) and ``POST /batch`` (with
+    ``{"ids": [...]}``, for long lists) return the rows of up to
+    ``batch_max_ids`` ids with a single ``WHERE pk IN (...)`` query, in the
+    order of the ids, and the ids not found. With a ``cache``, ids with a
+    cached detail response are served from it and the others are cached.
+    """
+
+    def __init__(
+        self,
+        *args: Any,
+        filters: Callable[..., List[Any]] = no_filters,
+        export_batch_size: int = 1000,
+        bulk_chunk_size: int = 1000,
+        upsert_key: Optional[str] = None,
+        cache: Optional[CacheBackend] = None,
+        fast_json: bool = False,
+        patch_schema: Optional[Type[SQLModel]] = None,
+        version_key: Optional[str] = None,
+        modified_key: Optional[str] = None,
+        cache_control: Optional[str] = None,
+        batcher: Optional[WriteBatcher] = None,
+        change_model: Optional[Type[SQLModel]] = None,
+        changes_poll_interval: float = 1.0,
+        changes_stream_timeout: float = 300.0,
+        batch_max_ids: int = 1000,
+        **kwargs: Any,
+    ):
+        self.batch_max_ids = batch_max_ids
+        self.batcher = batcher
+        self.change_model = change_model
+        self.changes_poll_interval = changes_poll_interval
+        self.changes_stream_timeout = changes_stream_timeout
+        self.cache = ResourceCache(cache) if cache is not None else None
+        self.fast_json = fast_json
+        self.patch_schema = patch_schema
+        self.version_key = version_key
+        self.modified_key = modified_key
+        self.cache_control = cache_control
+        self.filters = filters
+        self.export_batch_size = export_batch_size
+        self.bulk_chunk_size = bulk_chunk_size
+        self.upsert_key = upsert_key
+        super().__init__(*args, **kwargs)
+        # Routes returning plain rows (dicts) build the table model from them
+        # for the response, which needs instrumented (configured) mappers
+        configure_mappers()
+        if self.cache is not None:
+            self.cache.namespace = self.prefix
+
+        self.add_api_route(
+            "/bulk",
+            self._bulk_create(),
+            methods=["POST"],
+            response_model=BulkResult,
+            summary="Create Many",
+            openapi_extra=self._bulk_openapi_extra(),
+        )
+
+        self.add_api_route(
+            "/export.ndjson",
+            self._export(),
+            methods=["GET"],
+            response_class=StreamingResponse,
+            summary="Export All",
+            responses={200: {"content": {NDJSON_MEDIA_TYPE: {}}}},
+        )
+
+        batch_schema = create_model(
+            f"{self.schema.__name__}Batch",
+            records=(List[self.schema], ...),
+            missing=(List[self._pk_type], ...),
+        )
+        for method, endpoint in (
+            ("GET", self._get_batch()),
+            ("POST", self._post_batch()),
+        ):
+            self.add_api_route(
+                "/batch",
+                endpoint,
+                methods=[method],
+                response_model=batch_schema,
+                summary="Get Many",
+            )
+
+        self.add_api_route(
+            "/bulk",
+            self._bulk_delete(),
+            methods=["DELETE"],
+            response_model=BulkResult,
+            summary="Delete Many",
+        )
+
+        if patch_schema is not None:
+            self.add_api_route(
+                "/bulk",
+                self._bulk_patch(),
+                methods=["PATCH"],
+                response_model=BulkResult,
+                summary="Patch Many",
+            )
+            self._add_api_route(
+                "/{item_id}",
+                self._patch(),
+                methods=["PATCH"],
+                response_model=self.schema,
+                summary="Patch One",
+                dependencies=True,
+                error_responses=[NOT_FOUND],
+            )
+
+        if change_model is not None:
+            change_schema = create_model(
+                f"{self.schema.__name__}Change",
+                __base__=Change,
+                record=(Optional[self.schema], None),
+            )
+            self.add_api_route(
+                "/changes",
+                self._get_changes(),
+                methods=["GET"],
+                response_model=List[change_schema],
+                summary="Get Changes",
+            )
+            self.add_api_route(
+                "/changes/stream",
+                self._stream_changes(),
+                methods=["GET"],
+                response_class=StreamingResponse,
+                summary="Stream Changes",
+                responses={200: {"content": {SSE_MEDIA_TYPE: {}}}},
+            )
+
+    def add_api_route(self, path: str, endpoint: Callable[..., Any], **kwargs: Any):
+        super().add_api_route(path, endpoint, **kwargs)
+        # Static paths (``/bulk`` etc.) must be matched before ``/{item_id}``
+        self.routes.sort(key=lambda route: "{" in route.path)
+
+    def _add_api_route(
+        self, path: str, endpoint: Callable[..., Any], **kwargs: Any
+    ) -> None:
+        # All the standard CRUD routes are registered here
+        methods = kwargs["methods"]
+        if methods == ["GET"]:
+            if path != "":
+                endpoint = self._get_one_route()
+            else:
+                endpoint = self._conditional_list(endpoint)
+            endpoint = self._cached(path, endpoint)
+        else:
+            if path == "" and methods == ["POST"] and self.batcher is not None:
+                endpoint = self._batched_create()
+            delete_all = path == "" and methods == ["DELETE"]
+            endpoint = self._invalidating(endpoint, delete_all)
+        super()._add_api_route(path, endpoint, **kwargs)
+
+    def _cache_entry(self, result: Any, response: Optional[Response]) -> CacheEntry:
+        """Serialize a route result into a cache entry."""
+        if isinstance(result, Response):
+            # Already serialized (fast JSON)
+            body, response = result.body, result
+        else:
+            body = JSONResponse(jsonable_encoder(result)).body
+        headers = {}
+        if response is not None:
+            headers = {
+                name: value
+                for name, value in response.headers.items()
+                if name not in ("content-length", "content-type")
+            }
+        return CacheEntry(body=body, etag=make_etag(body), headers=headers)
+
+    def _cached_response(self, request: Request, entry: CacheEntry) -> Response:
+        headers = {"ETag": entry.etag, **entry.headers}
+        if etag_matches(entry.etag, request.headers.get("if-none-match")):
+            return Response(status_code=304, headers=headers)
+        return Response(entry.body, media_type="application/json", headers=headers)
+
+    @staticmethod
+    def _cacheable(path: str, request: Request) -> bool:
+        # Detail entries are invalidated by key, so there is one per item
+        return path == "" or "fields" not in request.query_params
+
+    def _cache_key(self, path: str, request: Request, kwargs: Dict[str, Any]) -> str:
+        if path == "":
+            return self.cache.list_key(str(sorted(request.query_params.multi_items())))
+        return self.cache.one_key(kwargs["item_id"])
+
+    def _cached(self, path: str, route: Callable[..., Any]) -> Callable[..., Any]:
+        """Serve a GET route through the response cache."""
+        if self.cache is None:
+            return route
+
+        if asyncio.iscoroutinefunction(route):
+
+            async def wrapper(request: Request, **kwargs: Any) -> Response:
+                if not self._cacheable(path, request):
+                    return await route(**kwargs)
+                key = self._cache_key(path, request, kwargs)
+                entry = self.cache.get(key)
+                if entry is None:
+                    result = await route(**kwargs)
+                    entry = self._cache_entry(result, kwargs.get("response"))
+                    self.cache.set(key, entry)
+                return self._cached_response(request, entry)
+
+        else:
+
+            def wrapper(request: Request, **kwargs: Any) -> Response:
+                if not self._cacheable(path, request):
+                    return route(**kwargs)
+                key = self._cache_key(path, request, kwargs)
+                entry = self.cache.get(key)
+                if entry is None:
+                    result = route(**kwargs)
+                    entry = self._cache_entry(result, kwargs.get("response"))
+                    self.cache.set(key, entry)
+                return self._cached_response(request, entry)
+
+        return self._with_request(wrapper, route)
+
+    @staticmethod
+    def _with_request(
+        wrapper: Callable[..., Any], route: Callable[..., Any]
+    ) -> Callable[..., Any]:
+        """Give ``wrapper`` the parameters of ``route``, and the request."""
+        update_wrapper(wrapper, route)
+        signature = inspect.signature(route)
+        wrapper.__signature__ = signature.replace(  # type: ignore
+            parameters=[
+                inspect.Parameter(
+                    "request", inspect.Parameter.KEYWORD_ONLY, annotation=Request
+                ),
+                *(
+                    parameter.replace(kind=inspect.Parameter.KEYWORD_ONLY)
+                    for parameter in signature.parameters.values()
+                ),
+            ]
+        )
+        return wrapper
+
+    def _last_seq(self, db: Session) -> int:
+        """Sequence number of the last change (0 if none)."""
+        change = self.change_model.__table__
+        return db.execute(select(func.max(change.c.seq))).scalar() or 0
+
+    def _not_modified(self, request: Request, etag: str) -> Optional[Response]:
+        """304 response if ``If-None-Match`` matches ``etag``."""
+        if not etag_matches(etag, request.headers.get("if-none-match")):
+            return None
+        response = Response(status_code=304, headers={"ETag": etag})
+        self._set_http_headers(response)
+        return response
+
+    @staticmethod
+    def _tagged(result: Any, kwargs: Dict[str, Any], etag: str) -> Any:
+        target = result if isinstance(result, Response) else kwargs["response"]
+        target.headers["ETag"] = etag
+        return result
+
+    def _conditional_list(self, route: Callable[..., Any]) -> Callable[..., Any]:
+        """Serve the list route with an ETag of the last change."""
+        if self.change_model is None or self.cache is not None:
+            return route
+
+        # The change is read before the page: a write in between makes the
+        # ETag older than the page, never newer
+        if asyncio.iscoroutinefunction(route):
+
+            async def wrapper(request: Request, **kwargs: Any) -> Any:
+                seq = await self._run(kwargs["db"], self._last_seq)
+                etag = f'"changes-{seq}"'
+                response = self._not_modified(request, etag)
+                if response is not None:
+                    return response
+                return self._tagged(await route(**kwargs), kwargs, etag)
+
+        else:
+
+            def wrapper(request: Request, **kwargs: Any) -> Any:
+                etag = f'"changes-{self._last_seq(kwargs["db"])}"'
+                response = self._not_modified(request, etag)
+                if response is not None:
+                    return response
+                return self._tagged(route(**kwargs), kwargs, etag)
+
+        return self._with_request(wrapper, route)
+
+    def _invalidate(self, kwargs: Dict[str, Any], delete_all: bool) -> None:
+        if delete_all:
+            self.cache.invalidate_all()
+        elif "item_id" in kwargs:
+            self.cache.invalidate(kwargs["item_id"])
+        else:
+            self.cache.invalidate()
+
+    def _invalidating(
+        self, route: Callable[..., Any], delete_all: bool
+    ) -> Callable[..., Any]:
+        """Invalidate cached responses after a write route succeeds."""
+        if self.cache is None:
+            return route
+
+        if asyncio.iscoroutinefunction(route):
+
+            async def wrapper(**kwargs: Any) -> Any:
+                result = await route(**kwargs)
+                self._invalidate(kwargs, delete_all)
+                return result
+
+        else:
+
+            def wrapper(**kwargs: Any) -> Any:
+                result = route(**kwargs)
+                self._invalidate(kwargs, delete_all)
+                return result
+
+        return update_wrapper(wrapper, route)
+
+    async def _run(self, db: Session, func: Callable[..., Any], *args: Any) -> Any:
+        """Run sync ``func(db, *args)`` without blocking the event loop."""
+        return await run_in_threadpool(func, db, *args)
+
+    def _list_statement(
+        self,
+        clauses: List[Any],
+        pagination: Dict[str, Optional[int]],
+        cursor: Optional[str],
+        columns: Optional[List[Any]] = None,
+    ) -> Any:
+        """Select statement of a list page, of models or of plain rows of
+        the given ``columns``."""
+        skip, limit = pagination.get("skip"), pagination.get("limit")
+        pk = getattr(self.db_model, self._pk)
+        entities = columns or [self.db_model]
+
+        statement = select(*entities).where(*clauses).order_by(pk).limit(limit)
+        if cursor is not None:
+            statement = statement.where(pk > decode_cursor(cursor, self._pk_type))
+        elif skip:
+            statement = statement.offset(skip)
+        return statement
+
+    def _set_next_cursor(
+        self,
+        response: Response,
+        db_models: List[Any],
+        pagination: Dict[str, Optional[int]],
+    ) -> None:
+        """Return the cursor of the next page if the page is full."""
+        limit = pagination.get("limit")
+        if limit and len(db_models) == limit:
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(
+                getattr(db_models[-1], self._pk)
+            )
+
+    def _fields(
+        self,
+        fields: Optional[str] = Query(
+            None, description="Comma separated fields to return (default: all)"
+        ),
+    ) -> Optional[List[str]]:
+        """Sparse fields dependency: the requested field names, in table
+        order, or ``None`` for all fields."""
+        if fields is None:
+            return None
+        requested = {field.strip() for field in fields.split(",") if field.strip()}
+        table = self.db_model.__table__
+        unknown = requested.difference(table.c.keys())
+        if unknown:
+            raise HTTPException(400, f"Unknown fields: {', '.join(sorted(unknown))}")
+        if not requested:
+            raise HTTPException(400, "No fields given")
+        return [name for name in table.c.keys() if name in requested]
+
+    def _columns(self, fields: Optional[List[str]]) -> List[Any]:
+        """Columns to select for the given fields (the primary key always,
+        for pagination, and the modification time, for headers)."""
+        table = self.db_model.__table__
+        if fields is None:
+            return list(table.c)
+        names = [self._pk, self.modified_key, *fields]
+        return [table.c[name] for name in dict.fromkeys(names) if name is not None]
+
+    def _rows(self, fields: Optional[List[str]]) -> bool:
+        """Whether to serve plain rows rather than models."""
+        return self.fast_json or fields is not None
+
+    def _get_all(self, *args: Any, **kwargs: Any) -> Callable[..., List[Any]]:
+        def route(
+            response: Response,
+            db: Session = Depends(self.db_func),
+            pagination: PAGINATION = self.pagination,
+            cursor: Optional[str] = None,
+            clauses: List[Any] = Depends(self.filters),
+            fields: Optional[List[str]] = Depends(self._fields),
+        ) -> List[Any]:
+            if self._rows(fields):
+                statement = self._list_statement(
+                    clauses, pagination, cursor, self._columns(fields)
+                )
+                return self._rows_response(
+                    db.execute(statement).all(), pagination, fields
+                )
+
+            statement = self._list_statement(clauses, pagination, cursor)
+            db_models = db.execute(statement).scalars().all()
+            self._set_next_cursor(response, db_models, pagination)
+            self._set_http_headers(response)
+            return db_models
+
+        return route
+
+    def _get_one_route(self) -> Callable[..., Any]:
+        """Detail route. ``_get_one`` is also used by the update and delete
+        routes and so is kept as it is."""
+
+        def route(
+            response: Response,
+            item_id: self._pk_type,  # type: ignore
+            db: Session = Depends(self.db_func),
+            fields: Optional[List[str]] = Depends(self._fields),
+        ) -> Any:
+            if self._rows(fields):
+                statement = self._one_statement(item_id, self._columns(fields))
+                return self._row_response(db.execute(statement).first(), fields)
+            db_model = self._get_one()(item_id, db)
+            self._set_http_headers(response, db_model)
+            return db_model
+
+        return route
+
+    def _one_statement(self, item_id: Any, columns: List[Any]) -> Any:
+        """Select statement of a single plain row."""
+        pk = getattr(self.db_model, self._pk)
+        return select(*columns).where(pk == item_id)
+
+    @staticmethod
+    def _row_dict(row: Any, fields: Optional[List[str]]) -> Dict[str, Any]:
+        mapping = row._mapping
+        if fields is None:
+            return dict(mapping)
+        return {name: mapping[name] for name in fields}
+
+    def _rows_response(
+        self,
+        rows: List[Any],
+        pagination: Dict[str, Optional[int]],
+        fields: Optional[List[str]],
+    ) -> Response:
+        """JSON response of a list page of plain rows."""
+        response = Response(
+            dumps([self._row_dict(row, fields) for row in rows]),
+            media_type="application/json",
+        )
+        self._set_next_cursor(response, rows, pagination)
+        self._set_http_headers(response)
+        return response
+
+    def _row_response(self, row: Any, fields: Optional[List[str]]) -> Response:
+        """JSON response of a single plain row."""
+        if row is None:
+            raise NOT_FOUND from None
+        response = Response(
+            dumps(self._row_dict(row, fields)), media_type="application/json"
+        )
+        self._set_http_headers(response, row)
+        return response
+
+    def _set_http_headers(self, response: Response, item: Any = None) -> None:
+        """Set the ``Cache-Control`` header and, of a single model or row
+        ``item``, the ``Last-Modified`` header."""
+        if self.cache_control is not None:
+            response.headers["Cache-Control"] = self.cache_control
+        if item is not None and self.modified_key is not None:
+            modified = getattr(item, self.modified_key)
+            if modified is not None:
+                response.headers["Last-Modified"] = http_date(modified)
+
+    def _bump_version(self, db_model: Any) -> None:
+        """Increment the version of a model (in SQL, on flush)."""
+        if self.version_key is not None:
+            version = getattr(self.db_model, self.version_key)
+            setattr(db_model, self.version_key, version + 1)
+
+    def _update(self, *args: Any, **kwargs: Any) -> Callable[..., Any]:
+        def route(
+            item_id: self._pk_type,  # type: ignore
+            model: self.update_schema,  # type: ignore
+            db: Session = Depends(self.db_func),
+        ) -> Any:
+            try:
+                db_model = self._get_one()(item_id, db)
+                exclude = {self._pk, self.version_key}
+                for key, value in model.dict(exclude=exclude).items():
+                    if hasattr(db_model, key):
+                        setattr(db_model, key, value)
+                self._bump_version(db_model)
+                db.commit()
+                db.refresh(db_model)
+                return db_model
+            except IntegrityError as e:
+                db.rollback()
+                self._raise(e)
+
+        return route
+
+    def _patch_write(
+        self,
+        db: Session,
+        item_id: Any,
+        values: Dict[str, Any],
+        version: Optional[int],
+    ) -> Any:
+        """Update the given values of a row, if at ``version`` (when given),
+        and return the updated row."""
+        table = self.db_model.__table__
+        pk = table.c[self._pk]
+        statement = table.update().where(pk == item_id).values(values)
+        if self.version_key is not None:
+            version_column = table.c[self.version_key]
+            statement = statement.values({version_column: version_column + 1})
+            if version is not None:
+                statement = statement.where(version_column == version)
+        try:
+            result = db.execute(statement)
+        except IntegrityError as e:
+            db.rollback()
+            self._raise(e)
+        if result.rowcount == 0:
+            db.rollback()
+            if db.execute(select(pk).where(pk == item_id)).first() is None:
+                raise NOT_FOUND from None
+            raise HTTPException(412, "Version mismatch")
+        # Read back within the same transaction
+        row = db.execute(select(table).where(pk == item_id)).one()
+        db.commit()
+        return dict(row._mapping)
+
+    def _patch(self, *args: Any, **kwargs: Any) -> Callable[..., Any]:
+        async def route(
+            item_id: self._pk_type,  # type: ignore
+            model: self.patch_schema,  # type: ignore
+            db: Session = Depends(self.db_func),
+        ) -> Any:
+            values = model.dict(exclude_unset=True, exclude={self._pk})
+            version = values.pop(self.version_key, None) if self.version_key else None
+            if not values:
+                raise HTTPException(400, "No fields to update")
+            return await self._run(db, self._patch_write, item_id, values, version)
+
+        return route
+
+    def _batched_create(self) -> Callable[..., Any]:
+        async def route(
+            model: self.create_schema,  # type: ignore
+        ) -> Any:
+            future = self.batcher.submit(model.dict())
+            try:
+                return await asyncio.wrap_future(future)
+            except IntegrityError:
+                raise HTTPException(422, "Key already exists") from None
+
+        return route
+
+    def _delete_all(self, *args: Any, **kwargs: Any) -> Callable[..., List[Any]]:
+        def route(db: Session = Depends(self.db_func)) -> List[Any]:
+            db.query(self.db_model).delete()
+            db.commit()
+
+            return db.query(self.db_model).all()
+
+        return route
+
+    def _export_statement(self, clauses: List[Any]) -> Any:
+        """Select statement of the export."""
+        table = self.db_model.__table__
+        return select(table).where(*clauses).order_by(table.c[self._pk])
+
+    @staticmethod
+    def _export_lines(rows: List[Any]) -> str:
+        """NDJSON lines of a batch of exported rows."""
+        return "".join(
+            json.dumps(dict(row._mapping), default=json_default) + "\n" for row in rows
+        )
+
+    def _export(self, *args: Any, **kwargs: Any) -> Callable[..., StreamingResponse]:
+        def route(
+            db: Session = Depends(self.db_func),
+            clauses: List[Any] = Depends(self.filters),
+        ) -> StreamingResponse:
+            result = (
+                db.connection()
+                .execution_options(stream_results=True)
+                .execute(self._export_statement(clauses))
+            )
+
+            def iter_lines():
+                for rows in result.partitions(self.export_batch_size):
+                    yield self._export_lines(rows)
+
+            return StreamingResponse(iter_lines(), media_type=NDJSON_MEDIA_TYPE)
+
+        return route
+
+    def _bulk_openapi_extra(self) -> Dict[str, Any]:
+        schema = {"$ref": f"#/components/schemas/{self.create_schema.__name__}"}
+        return {
+            "requestBody": {
+                "required": True,
+                "content": {
+                    "application/json": {"schema": {"type": "array", "items": schema}},
+                    NDJSON_MEDIA_TYPE: {"schema": schema},
+                },
+            }
+        }
+
+    def _bulk_write(
+        self, db: Session, records: List[Dict[str, Any]], upsert: bool
+    ) -> BulkChunk:
+        """Write a chunk of validated records in a single transaction."""
+        start = time.perf_counter()
+        table = self.db_model.__table__
+        size = len(records)
+        updates = []
+
+        if upsert:
+            key = self.upsert_key
+            # The last record wins when a key is repeated within the chunk
+            records = list({record[key]: record for record in records}.values())
+            existing = dict(
+                db.execute(
+                    select(table.c[key], table.c[self._pk]).where(
+                        table.c[key].in_([record[key] for record in records])
+                    )
+                ).all()
+            )
+            updates = [
+                dict(record, _pk=existing[record[key]])
+                for record in records
+                if record[key] in existing
+            ]
+            records = [record for record in records if record[key] not in existing]
+
+        if updates:
+            statement = table.update().where(table.c[self._pk] == bindparam("_pk"))
+            if self.version_key is not None:
+                version = table.c[self.version_key]
+                statement = statement.values({version: version + 1})
+            db.execute(statement, updates)
+        if records:
+            db.execute(table.insert(), records)
+        db.commit()
+        if self.cache is not None:
+            self.cache.invalidate(*(update["_pk"] for update in updates))
+
+        seconds = time.perf_counter() - start
+        return BulkChunk(
+            size=size,
+            created=len(records),
+            updated=len(updates),
+            seconds=round(seconds, 6),
+            rows_per_second=round(size / seconds, 1) if seconds else 0.0,
+        )
+
+    def _bulk_create(self, *args: Any, **kwargs: Any) -> Callable[..., Any]:
+        async def route(
+            request: Request,
+            chunk_size: int = Query(self.bulk_chunk_size, gt=0, le=10_000),
+            upsert: bool = False,
+            db: Session = Depends(self.db_func),
+        ) -> BulkResult:
+            if upsert and not self.upsert_key:
+                raise HTTPException(400, "Upsert is not supported")
+
+            content_type = request.headers.get("content-type", "")
+            if content_type.startswith(NDJSON_MEDIA_TYPE):
+                records = iter_ndjson(request)
+            else:
+                records = iter_json_array(request)
+
+            start = time.perf_counter()
+            chunks: List[BulkChunk] = []
+            chunk: List[Dict[str, Any]] = []
+            index = 0
+
+            with chunked():
+                async for record in records:
+                    try:
+                        model = self.create_schema.parse_obj(record)
+                    except ValidationError as e:
+                        committed = sum(chunk.size for chunk in chunks)
+                        raise HTTPException(
+                            422,
+                            [
+                                {
+                                    "index": index,
+                                    "committed": committed,
+                                    "errors": e.errors(),
+                                }
+                            ],
+                        ) from None
+                    chunk.append(model.dict())
+                    index += 1
+                    if len(chunk) == chunk_size:
+                        chunks.append(
+                            await self._run(db, self._bulk_write, chunk, upsert)
+                        )
+                        chunk = []
+                if chunk:
+                    chunks.append(await self._run(db, self._bulk_write, chunk, upsert))
+
+            return BulkResult(
+                created=sum(chunk.created for chunk in chunks),
+                updated=sum(chunk.updated for chunk in chunks),
+                seconds=round(time.perf_counter() - start, 6),
+                chunks=chunks,
+            )
+
+        return route
+
+    def _change_write(
+        self,
+        db: Session,
+        clauses: List[Any],
+        values: Optional[Dict[str, Any]],
+        after: Any,
+        chunk_size: int,
+    ) -> Tuple[BulkChunk, Any]:
+        """Delete (or, with ``values``, update) the next chunk of rows
+        matching ``clauses`` after primary key ``after``, and return the
+        chunk statistics and the last primary key of the chunk."""
+        start = time.perf_counter()
+        table = self.db_model.__table__
+        pk = table.c[self._pk]
+        statement = select(pk).where(*clauses).order_by(pk).limit(chunk_size)
+        if after is not None:
+            statement = statement.where(pk > after)
+        pks = db.execute(statement).scalars().all()
+        # The read transaction ends here: the write below starts with the
+        # write lock and rechecks the filters
+        db.rollback()
+
+        deleted = updated = 0
+        if pks:
+            if values is None:
+                statement = table.delete()
+            else:
+                statement = table.update().values(values)
+                if self.version_key is not None:
+                    version = table.c[self.version_key]
+                    statement = statement.values({version: version + 1})
+            rowcount = db.execute(statement.where(pk.in_(pks), *clauses)).rowcount
+            db.commit()
+            if values is None:
+                deleted = rowcount
+            else:
+                updated = rowcount
+            if self.cache is not None:
+                self.cache.invalidate(*pks)
+
+        seconds = time.perf_counter() - start
+        chunk = BulkChunk(
+            size=len(pks),
+            created=0,
+            updated=updated,
+            deleted=deleted,
+            seconds=round(seconds, 6),
+            rows_per_second=round(len(pks) / seconds, 1) if seconds else 0.0,
+        )
+        return chunk, pks[-1] if pks else after
+
+    async def _bulk_change(
+        self,
+        db: Session,
+        clauses: List[Any],
+        values: Optional[Dict[str, Any]],
+        chunk_size: int,
+    ) -> BulkResult:
+        """Delete (or, with ``values``, update) all the rows matching
+        ``clauses``, a chunk at a time."""
+        if not clauses:
+            raise HTTPException(400, "At least one filter is required")
+        start = time.perf_counter()
+        chunks: List[BulkChunk] = []
+        after = None
+        with chunked():
+            while True:
+                chunk, after = await self._run(
+                    db, self._change_write, clauses, values, after, chunk_size
+                )
+                if chunk.size:
+                    chunks.append(chunk)
+                if chunk.size < chunk_size:
+                    break
+        return BulkResult(
+            created=0,
+            updated=sum(chunk.updated for chunk in chunks),
+            deleted=sum(chunk.deleted for chunk in chunks),
+            seconds=round(time.perf_counter() - start, 6),
+            chunks=chunks,
+        )
+
+    def _read_changes(
+        self, db: Session, since: int, limit: int
+    ) -> List[Dict[str, Any]]:
+        """Changes after sequence number ``since``, with the current rows."""
+        change = self.change_model.__table__
+        table = self.db_model.__table__
+        key = change.c[f"{table.name}_id"]
+        pk = table.c[self._pk]
+        statement = (
+            select(change.c.seq, change.c.op, key, *table.c)
+            .select_from(change.outerjoin(table, pk == key))
+            .where(change.c.seq > since)
+            .order_by(change.c.seq)
+            .limit(limit)
+        )
+        rows = db.execute(statement).all()
+        # End the read transaction: the session of a stream would otherwise
+        # keep its connection and see the same snapshot on every poll
+        db.rollback()
+        return [
+            {
+                "seq": row._mapping[change.c.seq],
+                "op": row._mapping[change.c.op],
+                "id": row._mapping[key],
+                "record": (
+                    {column.name: row._mapping[column] for column in table.c}
+                    if row._mapping[pk] is not None
+                    else None
+                ),
+            }
+            for row in rows
+        ]
+
+    def _get_changes(self) -> Callable[..., Any]:
+        async def route(
+            since: int = Query(
+                0, ge=0, description="Sequence number of the last change seen"
+            ),
+            limit: int = Query(1000, ge=1, le=10000),
+            db: Session = Depends(self.db_func),
+        ) -> Any:
+            changes = await self._run(db, self._read_changes, since, limit)
+            if self.fast_json:
+                return Response(dumps(changes), media_type="application/json")
+            return changes
+
+        return route
+
+    @staticmethod
+    def _change_event(change: Dict[str, Any]) -> bytes:
+        """Server-sent event of a change."""
+        return (
+            f"id: {change['seq']}\nevent: {change['op']}\n".encode()
+            + b"data: "
+            + dumps(change)
+            + b"\n\n"
+        )
+
+    def _stream_changes(self) -> Callable[..., Any]:
+        async def route(
+            request: Request,
+            since: int = Query(
+                0, ge=0, description="Sequence number of the last change seen"
+            ),
+            db: Session = Depends(self.db_func),
+        ) -> StreamingResponse:
+            last_event_id = request.headers.get("last-event-id")
+            if last_event_id is not None:
+                try:
+                    since = int(last_event_id)
+                except ValueError:
+                    raise HTTPException(400, "Invalid Last-Event-ID") from None
+
+            async def iter_events() -> AsyncIterator[bytes]:
+                position = since
+                loop = asyncio.get_running_loop()
+                deadline = loop.time() + self.changes_stream_timeout
+                # Reconnection delay of the client, in milliseconds
+                yield f"retry: {int(self.changes_poll_interval * 1000)}\n\n".encode()
+                sent = loop.time()
+                while True:
+                    changes = await self._run(
+                        db, self._read_changes, position, self.export_batch_size
+                    )
+                    if changes:
+                        position = changes[-1]["seq"]
+                        yield b"".join(self._change_event(c) for c in changes)
+                        sent = loop.time()
+                        if len(changes) == self.export_batch_size:
+                            continue
+                    if loop.time() >= deadline:
+                        return
+                    if loop.time() - sent >= SSE_KEEPALIVE_INTERVAL:
+                        yield b": keepalive\n\n"
+                        sent = loop.time()
+                    await asyncio.sleep(self.changes_poll_interval)
+
+            return StreamingResponse(
+                iter_events(),
+                media_type=SSE_MEDIA_TYPE,
+                headers={"Cache-Control": "no-cache"},
+            )
+
+        return route
+
+    def _batch_ids(
+        self,
+        ids: str = Query(..., description="Comma separated ids"),
+    ) -> List[Any]:
+        """Batch ids dependency: the ids of a ``GET /batch``."""
+        values = [value.strip() for value in ids.split(",") if value.strip()]
+        try:
+            return parse_obj_as(List[self._pk_type], values)  # type: ignore
+        except ValidationError:
+            raise HTTPException(400, "Invalid ids") from None
+
+    def _read_batch(self, db: Session, ids: List[Any]) -> Dict[Any, Any]:
+        """Rows of the given ids, by id."""
+        table = self.db_model.__table__
+        pk = table.c[self._pk]
+        rows = db.execute(select(table).where(pk.in_(ids))).all()
+        return {row._mapping[pk]: row for row in rows}
+
+    def _detail_response(self, row: Any) -> Response:
+        """Detail response of a row, as served (and cached) by the detail
+        route."""
+        if self.fast_json:
+            return self._row_response(row, None)
+        response = JSONResponse(jsonable_encoder(dict(row._mapping)))
+        self._set_http_headers(response, row)
+        return response
+
+    async def _batch(self, db: Session, ids: List[Any]) -> Response:
+        """Response of a batch read of ``ids``."""
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            raise HTTPException(400, "No ids given")
+        if len(ids) > self.batch_max_ids:
+            raise HTTPException(400, f"At most {self.batch_max_ids} ids are allowed")
+
+        bodies: Dict[Any, bytes] = {}
+        keys: Dict[Any, str] = {}
+        if self.cache is not None:
+            # Taken before the read (see ``ResourceCache``)
+            keys = {pk: self.cache.one_key(pk) for pk in ids}
+            for pk in ids:
+                entry = self.cache.get(keys[pk])
+                if entry is not None:
+                    bodies[pk] = entry.body
+        uncached = [pk for pk in ids if pk not in bodies]
+        if uncached:
+            rows = await self._run(db, self._read_batch, uncached)
+            for pk, row in rows.items():
+                response = self._detail_response(row)
+                if self.cache is not None:
+                    self.cache.set(keys[pk], self._cache_entry(response, response))
+                bodies[pk] = response.body
+
+        # Detail bodies are JSON already: join them rather than parse them
+        records = b",".join(bodies[pk] for pk in ids if pk in bodies)
+        missing = [pk for pk in ids if pk not in bodies]
+        response = Response(
+            b'{"records":[' + records + b'],"missing":' + dumps(missing) + b"}",
+            media_type="application/json",
+        )
+        self._set_http_headers(response)
+        return response
+
+    def _get_batch(self) -> Callable[..., Any]:
+        async def route(
+            ids: List[Any] = Depends(self._batch_ids),
+            db: Session = Depends(self.db_func),
+        ) -> Response:
+            return await self._batch(db, ids)
+
+        return route
+
+    def _post_batch(self) -> Callable[..., Any]:
+        async def route(
+            ids: List[self._pk_type] = Body(..., embed=True),  # type: ignore
+            db: Session = Depends(self.db_func),
+        ) -> Response:
+            return await self._batch(db, ids)
+
+        return route
+
+    def _bulk_delete(self, *args: Any, **kwargs: Any) -> Callable[..., Any]:
+        async def route(
+            chunk_size: int = Query(self.bulk_chunk_size, gt=0, le=10_000),
+            clauses: List[Any] = Depends(self.filters),
+            db: Session = Depends(self.db_func),
+        ) -> BulkResult:
+            return await self._bulk_change(db, clauses, None, chunk_size)
+
+        return route
+
+    def _bulk_patch(self, *args: Any, **kwargs: Any) -> Callable[..., Any]:
+        async def route(
+            model: self.patch_schema,  # type: ignore
+            chunk_size: int = Query(self.bulk_chunk_size, gt=0, le=10_000),
+            clauses: List[Any] = Depends(self.filters),
+            db: Session = Depends(self.db_func),
+        ) -> BulkResult:
+            values = model.dict(
+                exclude_unset=True, exclude={self._pk, self.version_key}
+            )
+            if not values:
+                raise HTTPException(400, "No fields to update")
+            return await self._bulk_change(db, clauses, values, chunk_size)
+
+        return route
+
+
+class AsyncCRUDRouter(CRUDRouter):
+    """CRUD router running on an ``AsyncSession``, which ``db`` must yield.
+
+    Routes are coroutines, so waiting for the database does not hold a
+    threadpool thread. Bulk writes reuse the sync code through
+    ``AsyncSession.run_sync``.
+    """
+
+    async def _run(self, db: AsyncSession, func: Callable[..., Any], *args: Any) -> Any:
+        return await db.run_sync(func, *args)
+
+    async def _get_or_404(self, db: AsyncSession, item_id: Any) -> Any:
+        db_model = await db.get(self.db_model, item_id)
+        if db_model is None:
+            raise NOT_FOUND from None
+        return db_model
+
+    def _get_all(self, *args: Any, **kwargs: Any) -> Callable[..., Any]:
+        async def route(
+            response: Response,
+            db: AsyncSession = Depends(self.db_func),
+            pagination: PAGINATION = self.pagination,
+            cursor: Optional[str] = None,
+            clauses: List[Any] = Depends(self.filters),
+            fields: Optional[List[str]] = Depends(self._fields),
+        ) -> List[Any]:
+            if self._rows(fields):
+                statement = self._list_statement(
+                    clauses, pagination, cursor, self._columns(fields)
+                )
+                rows = (await db.execute(statement)).all()
+                return self._rows_response(rows, pagination, fields)
+
+            statement = self._list_statement(clauses, pagination, cursor)
+            db_models = (await db.execute(statement)).scalars().all()
+            self._set_next_cursor(response, db_models, pagination)
+            self._set_http_headers(response)
+            return db_models
+
+        return route
+
+    def _get_one(self, *args: Any, **kwargs: Any) -> Callable[..., Any]:
+        async def route(
+            item_id: self._pk_type,  # type: ignore
+            db: AsyncSession = Depends(self.db_func),
+        ) -> Any:
+            return await self._get_or_404(db, item_id)
+
+        return route
+
+    def _get_one_route(self) -> Callable[..., Any]:
+        async def route(
+            response: Response,
+            item_id: self._pk_type,  # type: ignore
+            db: AsyncSession = Depends(self.db_func),
+            fields: Optional[List[str]] = Depends(self._fields),
+        ) -> Any:
+            if self._rows(fields):
+                statement = self._one_statement(item_id, self._columns(fields))
+                return self._row_response((await db.execute(statement)).first(), fields)
+            db_model = await self._get_or_404(db, item_id)
+            self._set_http_headers(response, db_model)
+            return db_model
+
+        return route
+
+    def _create(self, *args: Any, **kwargs: Any) -> Callable[..., Any]:
+        async def route(
+            model: self.create_schema,  # type: ignore
+            db: AsyncSession = Depends(self.db_func),
+        ) -> Any:
+            db_model = self.db_model(**model.dict())
+            db.add(db_model)
+            try:
+                await db.commit()
+            except IntegrityError:
+                await db.rollback()
+                raise HTTPException(422, "Key already exists") from None
+            await db.refresh(db_model)
+            return db_model
+
+        return route
+
+    def _update(self, *args: Any, **kwargs: Any) -> Callable[..., Any]:
+        async def route(
+            item_id: self._pk_type,  # type: ignore
+            model: self.update_schema,  # type: ignore
+            db: AsyncSession = Depends(self.db_func),
+        ) -> Any:
+            db_model = await self._get_or_404(db, item_id)
+            exclude = {self._pk, self.version_key}
+            for key, value in model.dict(exclude=exclude).items():
+                if hasattr(db_model, key):
+                    setattr(db_model, key, value)
+            self._bump_version(db_model)
+            try:
+                await db.commit()
+            except IntegrityError as e:
+                await db.rollback()
+                self._raise(e)
+            await db.refresh(db_model)
+            return db_model
+
+        return route
+
+    def _delete_one(self, *args: Any, **kwargs: Any) -> Callable[..., Any]:
+        async def route(
+            item_id: self._pk_type,  # type: ignore
+            db: AsyncSession = Depends(self.db_func),
+        ) -> Any:
+            db_model = await self._get_or_404(db, item_id)
+            await db.delete(db_model)
+            await db.commit()
+            return db_model
+
+        return route
+
+    def _delete_all(self, *args: Any, **kwargs: Any) -> Callable[..., Any]:
+        async def route(db: AsyncSession = Depends(self.db_func)) -> List[Any]:
+            await db.execute(delete(self.db_model))
+            await db.commit()
+            return []
+
+        return route
+
+    def _export(self, *args: Any, **kwargs: Any) -> Callable[..., Any]:
+        async def route(
+            db: AsyncSession = Depends(self.db_func),
+            clauses: List[Any] = Depends(self.filters),
+        ) -> StreamingResponse:
+            result = await db.stream(self._export_statement(clauses))
+
+            async def iter_lines():
+                async for rows in result.partitions(self.export_batch_size):
+                    yield self._export_lines(rows)
+
+            return StreamingResponse(iter_lines(), media_type=NDJSON_MEDIA_TYPE)
+
+        return route
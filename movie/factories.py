@@ -1,40 +1,49 @@
+import argparse
+import json
+import os
 import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
 from fake import FACTORY, FAKER, PreSave, SQLAlchemyModelFactory
 
-from db import SessionLocal
-from models import Movie
+from db import DATABASE_URL, SessionLocal, make_engine
+from models import (
+    GENRES,
+    MOVIE_CHANGES_DDL,
+    MOVIE_FTS_DDL,
+    MOVIE_LIST_DDL,
+    MOVIE_STATS_DDL,
+    Movie,
+    check_storage,
+    decode_genres,
+    encode_genres,
+)
+from settings import COMPACT_STORAGE
 
 __all__ = (
     "GENRES",
     "MovieFactory",
+    "generate",
+    "generate_chunk",
     "get_session",
     "pick_actors",
     "pick_directors",
     "pick_genres",
 )
 
-GENRES = (
-    "Action",
-    "Adventure",
-    "Animation",
-    "Biography",
-    "Comedy",
-    "Crime",
-    "Drama",
-    "Family",
-    "Fantasy",
-    "Film-Noir",
-    "History",
-    "Horror",
-    "Music",
-    "Musical",
-    "Mystery",
-    "Romance",
-    "Sci-Fi",
-    "Sport",
-    "Thriller",
-    "War",
-    "Western",
+CHUNK_SIZE = 10_000
+MOVIE_COLUMNS = (
+    "id",
+    "title",
+    "year",
+    "runtime",
+    "genres",
+    "directors",
+    "actors",
+    "plot",
+    "poster_url",
 )
 
 
@@ -78,5 +87,225 @@ class MovieFactory(SQLAlchemyModelFactory):
         get_session = get_session
 
 
+def generate_chunk(
+    seed: int, chunk: int, chunk_size: int, id_offset: int = 0
+) -> List[Tuple]:
+    """Generate rows ``chunk * chunk_size`` to ``(chunk + 1) * chunk_size``.
+
+    Rows are made with the same providers as ``MovieFactory``, but straight
+    as tuples of ``MOVIE_COLUMNS`` (list columns encoded), ready for an
+    ``executemany``. The faker is reseeded per chunk, so a chunk is the
+    same whichever process, shard or run generates it. Ids start at
+    ``id_offset + 1``.
+    """
+    FAKER.seed(seed * 1_000_003 + chunk)
+    rng = FAKER.random
+    encode = encode_genres if COMPACT_STORAGE else json.dumps
+    rows = []
+    start = id_offset + chunk * chunk_size + 1
+    for pk in range(start, start + chunk_size):
+        rows.append(
+            (
+                pk,
+                FAKER.sentence(),
+                rng.randint(1900, 2024),
+                rng.randint(15, 360),
+                encode(rng.sample(GENRES, 2)),
+                json.dumps([FAKER.name() for _ in range(rng.randint(1, 2))]),
+                json.dumps([FAKER.name() for _ in range(5)]),
+                FAKER.text(),
+                FAKER.image_url(),
+            )
+        )
+    return rows
+
+
+def _generate_dump_chunk(
+    seed: int, chunk: int, chunk_size: int, id_offset: int = 0
+) -> bytes:
+    """Generate a chunk as NDJSON lines (see ``generate_chunk``)."""
+    decode = decode_genres if COMPACT_STORAGE else json.loads
+    lines = []
+    for row in generate_chunk(seed, chunk, chunk_size, id_offset):
+        record = dict(zip(MOVIE_COLUMNS, row))
+        record["genres"] = decode(record["genres"])
+        for column in ("directors", "actors"):
+            record[column] = json.loads(record[column])
+        lines.append(json.dumps(record))
+    return ("\n".join(lines) + "\n").encode()
+
+
+def generate(
+    size: int,
+    seed: int = 0,
+    workers: Optional[int] = None,
+    chunk_size: int = CHUNK_SIZE,
+    shards: int = 1,
+    shard: int = 0,
+    database_url: str = DATABASE_URL,
+    dump: Optional[str] = None,
+    id_offset: Optional[int] = None,
+) -> int:
+    """Generate ``size`` movies in a process pool and return the row count.
+
+    Rows are split in chunks of ``chunk_size`` and chunks are dealt out
+    over ``shards``; only the chunks of ``shard`` are generated, so several
+    machines (or runs) can each load a disjoint part of the same data set.
+    Output is deterministic for a given ``seed`` and ``chunk_size``.
+
+    Rows are written, bypassing the ORM, by a single writer: into the
+    database (plain ``executemany``, one transaction per chunk) or, if
+    ``dump`` is given, to that file as NDJSON, as accepted by
+    ``POST /api/movie/bulk``.
+
+    Ids start after ``id_offset``: by default the greatest id in the
+    database (0 for a dump), so that data is added to existing rows. Pass
+    the same ``id_offset`` to every shard loaded into one database. If an
+    id to generate is taken, ``ValueError`` is raised before anything is
+    written.
+
+    Row by row triggers are several times slower than the inserts, so the
+    movie triggers are dropped during the load and recreated afterwards,
+    which backfills the normalized tables and rebuilds the search index
+    and the count tables in bulk. Do not load into a database that is
+    being written to.
+    """
+    chunks = range(shard, -(-size // chunk_size), shards)
+    # The last chunk may be partial
+    last = size // chunk_size
+
+    def sizes() -> Iterator[int]:
+        for chunk in chunks:
+            yield size - chunk * chunk_size if chunk == last else chunk_size
+
+    count = 0
+    if dump:
+        with ProcessPoolExecutor(workers) as executor:
+            results = executor.map(
+                _generate_dump_chunk,
+                [seed] * len(chunks),
+                chunks,
+                [chunk_size] * len(chunks),
+                [id_offset or 0] * len(chunks),
+            )
+            with open(dump, "wb") as file:
+                for chunk, chunk_rows, data in zip(chunks, sizes(), results):
+                    if chunk == last:
+                        data = b"".join(data.splitlines(True)[:chunk_rows])
+                    file.write(data)
+                    count += chunk_rows
+        return count
+
+    engine = make_engine(database_url)
+    check_storage(engine)
+    Movie.metadata.create_all(engine)
+    insert = (
+        f"INSERT INTO movie ({', '.join(MOVIE_COLUMNS)}) "
+        f"VALUES ({', '.join('?' * len(MOVIE_COLUMNS))})"
+    )
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    try:
+        if id_offset is None:
+            (id_offset,) = cursor.execute("SELECT max(id) FROM movie").fetchone()
+            id_offset = id_offset or 0
+        # Checked before the triggers are dropped
+        for chunk, chunk_rows in zip(chunks, sizes()):
+            start = id_offset + chunk * chunk_size + 1
+            (taken,) = cursor.execute(
+                "SELECT min(id) FROM movie WHERE id BETWEEN ? AND ?",
+                (start, start + chunk_rows - 1),
+            ).fetchone()
+            if taken is not None:
+                raise ValueError(
+                    f"Movie id {taken} is taken: pass an id_offset of at least "
+                    "the greatest id in the database"
+                )
+
+        with ProcessPoolExecutor(workers) as executor:
+            results = executor.map(
+                generate_chunk,
+                [seed] * len(chunks),
+                chunks,
+                [chunk_size] * len(chunks),
+                [id_offset] * len(chunks),
+            )
+            triggers = cursor.execute(
+                "SELECT name FROM sqlite_master "
+                "WHERE type = 'trigger' AND tbl_name = ?",
+                (Movie.__tablename__,),
+            ).fetchall()
+            for (name,) in triggers:
+                cursor.execute(f"DROP TRIGGER {name}")
+            connection.commit()
+            try:
+                for chunk_rows, rows in zip(sizes(), results):
+                    cursor.executemany(insert, rows[:chunk_rows])
+                    connection.commit()
+                    count += chunk_rows
+            finally:
+                for statement in (
+                    MOVIE_LIST_DDL + MOVIE_FTS_DDL + MOVIE_STATS_DDL + MOVIE_CHANGES_DDL
+                ):
+                    cursor.execute(statement)
+                connection.commit()
+    finally:
+        connection.close()
+        engine.dispose()
+    return count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Populate the database with movies. Without --size, 100 movies are "
+            "created through MovieFactory; with --size, rows are generated in "
+            "a process pool and bulk inserted."
+        )
+    )
+    parser.add_argument("--size", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--shard", type=int, default=0)
+    parser.add_argument("--database-url", default=DATABASE_URL)
+    parser.add_argument("--dump", help="write NDJSON to this file instead")
+    parser.add_argument(
+        "--id-offset",
+        type=int,
+        help="ids start after this one (default: the greatest in the database)",
+    )
+    args = parser.parse_args()
+    if args.size is None:
+        MovieFactory.create_batch(100)
+        return
+    if not 0 <= args.shard < args.shards:
+        parser.error("--shard must be between 0 and --shards - 1")
+
+    start = time.perf_counter()
+    count = generate(
+        args.size,
+        seed=args.seed,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        shards=args.shards,
+        shard=args.shard,
+        database_url=args.database_url,
+        dump=args.dump,
+        id_offset=args.id_offset,
+    )
+    seconds = time.perf_counter() - start
+    print(
+        json.dumps(
+            {
+                "rows": count,
+                "seconds": round(seconds, 3),
+                "rows_per_minute": round(count / seconds * 60),
+            }
+        )
+    )
+
+
 if __name__ == "__main__":
-    MovieFactory.create_batch(100)
+    main()
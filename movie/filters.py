@@ -0,0 +1,72 @@
+"""
+List filters. Backed by indexes, see ``models.MovieGenre`` and friends, or
+with compact storage by the genres bitmask and interned names.
+"""
+from typing import Any, List, Optional
+
+from fastapi import Query
+from sqlalchemy import Integer, false, select, type_coerce
+
+from models import (
+    Movie,
+    MovieActor,
+    MovieDirector,
+    MovieGenre,
+    MovieName,
+    encode_genres,
+)
+from settings import COMPACT_STORAGE
+
+__all__ = ("movie_filters",)
+
+
+def movie_ids(model, name: str) -> Any:
+    """Ids of the movies with ``name`` in normalized table ``model``."""
+    if COMPACT_STORAGE:
+        return (
+            select(model.movie_id)
+            .join(MovieName, MovieName.id == model.name_id)
+            .where(MovieName.name == name)
+        )
+    return select(model.movie_id).where(model.name == name)
+
+
+def genres_clause(genres: List[str]) -> Any:
+    """Movies with all of ``genres``, on the bitmask (compact storage)."""
+    try:
+        mask = encode_genres(genres)
+    except ValueError:
+        return false()
+    return type_coerce(Movie.genres, Integer).op("&")(mask) == mask
+
+
+def movie_filters(
+    genre: Optional[List[str]] = Query(None),
+    actor: Optional[List[str]] = Query(None),
+    director: Optional[List[str]] = Query(None),
+    year_min: Optional[int] = None,
+    year_max: Optional[int] = None,
+    runtime_min: Optional[int] = None,
+    runtime_max: Optional[int] = None,
+) -> List[Any]:
+    """Movie filters. Repeated genre, actor or director must all match."""
+    clauses = []
+    if COMPACT_STORAGE and genre:
+        clauses.append(genres_clause(genre))
+        genre = None
+    for model, names in (
+        (MovieGenre, genre),
+        (MovieActor, actor),
+        (MovieDirector, director),
+    ):
+        for name in names or ():
+            clauses.append(Movie.id.in_(movie_ids(model, name)))
+    if year_min is not None:
+        clauses.append(Movie.year >= year_min)
+    if year_max is not None:
+        clauses.append(Movie.year <= year_max)
+    if runtime_min is not None:
+        clauses.append(Movie.runtime >= runtime_min)
+    if runtime_max is not None:
+        clauses.append(Movie.runtime <= runtime_max)
+    return clauses
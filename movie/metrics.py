@@ -0,0 +1,395 @@
+"""
+Request instrumentation. See ``MetricsMiddleware`` for per request query
+count, DB, handler and serialization time (as ``Server-Timing`` headers)
+and ``Metrics`` for exposing them in the Prometheus text format.
+"""
+import asyncio
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+
+__all__ = (
+    "Counter",
+    "Histogram",
+    "InstrumentedRoute",
+    "Metrics",
+    "MetricsMiddleware",
+    "PROMETHEUS_MEDIA_TYPE",
+    "RequestStats",
+    "chunked",
+    "current_stats",
+    "instrument_engines",
+)
+
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 25, 50, 100)
+
+logger = logging.getLogger(__name__)
+
+
+class RequestStats:
+    """Timings (in seconds) and queries of a single request."""
+
+    def __init__(self, n_plus_one_threshold: int = 10):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.route = "<unmatched>"
+        self.queries = 0
+        self.db_time = 0.0
+        self.handler_time = 0.0
+        self.route_time = 0.0
+        self.statements: Dict[str, int] = {}
+        # Depth of ``chunked`` blocks
+        self.chunked = 0
+
+    def add_query(self, statement: str, seconds: float) -> None:
+        self.queries += 1
+        self.db_time += seconds
+        if not self.chunked:
+            self.statements[statement] = self.statements.get(statement, 0) + 1
+
+    @property
+    def serialization_time(self) -> float:
+        """Route time not spent in the endpoint: validation, dependencies
+        and serialization."""
+        return max(self.route_time - self.handler_time, 0.0)
+
+    @property
+    def n_plus_one(self) -> List[Tuple[str, int]]:
+        """Statements repeated at least ``n_plus_one_threshold`` times.
+
+        A statement run once per row of a previous result (the N+1 query
+        pattern) shows up here, with its count.
+        """
+        return [
+            (statement, count)
+            for statement, count in self.statements.items()
+            if count >= self.n_plus_one_threshold
+        ]
+
+    def server_timing(self, total: float) -> str:
+        """Format as a ``Server-Timing`` header value."""
+        metrics = [
+            f'db;dur={self.db_time * 1000:.3f};desc="{self.queries} queries"',
+            f"handler;dur={self.handler_time * 1000:.3f}",
+            f"serialize;dur={self.serialization_time * 1000:.3f}",
+            f"total;dur={total * 1000:.3f}",
+        ]
+        if self.n_plus_one:
+            metrics.append(f'n-plus-one;desc="{len(self.n_plus_one)} statements"')
+        return ", ".join(metrics)
+
+
+_current_stats: ContextVar[Optional[RequestStats]] = ContextVar(
+    "request_stats", default=None
+)
+
+
+def current_stats() -> Optional[RequestStats]:
+    """Stats of the request being handled, if instrumented."""
+    return _current_stats.get()
+
+
+@contextmanager
+def chunked() -> Iterator[None]:
+    """Run statements repeated once per chunk by design (chunked bulk
+    writes): they are counted and timed, but not taken for N+1 queries."""
+    stats = _current_stats.get()
+    if stats is None:
+        yield
+        return
+    stats.chunked += 1
+    try:
+        yield
+    finally:
+        stats.chunked -= 1
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, many):
+    if _current_stats.get() is not None:
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, many):
+    stats = _current_stats.get()
+    if stats is not None and conn.info.get("query_start_time"):
+        start = conn.info["query_start_time"].pop()
+        stats.add_query(statement, time.perf_counter() - start)
+
+
+def instrument_engines() -> None:
+    """Count and time the queries of instrumented requests on all engines
+    (async ones included)."""
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _timed(endpoint: Callable) -> Callable:
+    """Wrap an endpoint to add its run time to the request handler time."""
+    if getattr(endpoint, "timed", False):
+        # Already wrapped, for instance by a router included into the app
+        return endpoint
+    if asyncio.iscoroutinefunction(endpoint):
+
+        @functools.wraps(endpoint)
+        async def timed_endpoint(*args: Any, **kwargs: Any) -> Any:
+            stats = _current_stats.get()
+            start = time.perf_counter()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                if stats is not None:
+                    stats.handler_time += time.perf_counter() - start
+
+    else:
+
+        @functools.wraps(endpoint)
+        def timed_endpoint(*args: Any, **kwargs: Any) -> Any:
+            stats = _current_stats.get()
+            start = time.perf_counter()
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                if stats is not None:
+                    stats.handler_time += time.perf_counter() - start
+
+    timed_endpoint.timed = True
+    return timed_endpoint
+
+
+class InstrumentedRoute(APIRoute):
+    """API route recording its path, endpoint (handler) time and total
+    time into the stats of the current request."""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs: Any):
+        super().__init__(path, _timed(endpoint), **kwargs)
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def instrumented_handler(request):
+            stats = _current_stats.get()
+            if stats is None:
+                return await handler(request)
+            stats.route = self.path
+            start = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                stats.route_time += time.perf_counter() - start
+
+        return instrumented_handler
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    formatted = ",".join(f'{name}="{value}"' for name, value in escaped)
+    return f"{{{formatted}}}" if formatted else ""
+
+
+class Counter:
+    """Prometheus counter."""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        for labels, value in sorted(self.values.items()):
+            lines.append(
+                f"{self.name}{_format_labels(zip(self.labels, labels))} {value}"
+            )
+        return lines
+
+
+class Histogram:
+    """Prometheus histogram."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Per label values: count per bucket (not cumulative), sum and count
+        self.values: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        counts, total, count = self.values.get(labels) or (
+            [0] * len(self.buckets),
+            0.0,
+            0,
+        )
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        self.values[labels] = (counts, total + value, count + 1)
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for labels, (counts, total, count) in sorted(self.values.items()):
+            named = list(zip(self.labels, labels))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = _format_labels(named + [("le", str(bound))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(named + [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{le} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(named)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(named)} {count}")
+        return lines
+
+
+class Metrics:
+    """Request metrics, aggregated per method and route."""
+
+    def __init__(self, n_plus_one_threshold: int = 10):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self._lock = threading.Lock()
+        labels = ("method", "route")
+        self.requests = Counter(
+            "http_requests_total", "Requests.", ("method", "route", "status")
+        )
+        self.duration = Histogram(
+            "http_request_duration_seconds", "Request latency.", labels
+        )
+        self.db_time = Histogram(
+            "http_request_db_seconds", "Time spent in SQL per request.", labels
+        )
+        self.serialization_time = Histogram(
+            "http_request_serialization_seconds",
+            "Time spent in validation and serialization per request.",
+            labels,
+        )
+        self.queries = Histogram(
+            "http_request_queries",
+            "Queries per request.",
+            labels,
+            buckets=QUERY_BUCKETS,
+        )
+        self.n_plus_one = Counter(
+            "http_request_n_plus_one_total",
+            "Requests repeating a statement (N+1 query pattern).",
+            labels,
+        )
+
+    def observe(
+        self, method: str, status: int, stats: RequestStats, total: float
+    ) -> None:
+        labels = (method, stats.route)
+        with self._lock:
+            self.requests.inc(*labels, str(status))
+            self.duration.observe(total, *labels)
+            self.db_time.observe(stats.db_time, *labels)
+            self.serialization_time.observe(stats.serialization_time, *labels)
+            self.queries.observe(stats.queries, *labels)
+            if stats.n_plus_one:
+                self.n_plus_one.inc(*labels)
+
+    def render(self) -> str:
+        """Render in the Prometheus text format."""
+        with self._lock:
+            lines = []
+            for metric in (
+                self.requests,
+                self.duration,
+                self.db_time,
+                self.serialization_time,
+                self.queries,
+                self.n_plus_one,
+            ):
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """ASGI middleware collecting ``RequestStats`` of every HTTP request.
+
+    Stats are returned in a ``Server-Timing`` header (``db`` with the
+    query count, ``handler``, ``serialize`` and ``total``) and aggregated
+    into ``metrics``. Statements repeated within a request are logged as
+    likely N+1 queries. Time spent streaming a body after the headers are
+    sent is not accounted for.
+    """
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(self.metrics.n_plus_one_threshold)
+        token = _current_stats.set(stats)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Server-Timing", stats.server_timing(time.perf_counter() - start)
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_stats.reset(token)
+            self.metrics.observe(
+                scope["method"], status, stats, time.perf_counter() - start
+            )
+            for statement, count in stats.n_plus_one:
+                logger.warning(
+                    "Possible N+1 query on %s %s, repeated %d times: %s",
+                    scope["method"],
+                    stats.route,
+                    count,
+                    statement,
+                )
@@ -1,26 +1,168 @@
-from typing import List, Optional
+import json
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, List, Optional, Tuple
 
+from pydantic import validator
+from sqlalchemy import DDL, Integer, event, func, inspect
+from sqlalchemy.types import TypeDecorator
 from sqlmodel import Column, Field, JSON, SQLModel
 
+from settings import COMPACT_STORAGE
+
 __all__ = (
+    "GENRES",
+    "GenreMask",
     "Movie",
+    "MovieActor",
+    "MovieChange",
+    "MovieCountResult",
     "MovieCreate",
+    "MovieDirector",
+    "MovieDirectorCount",
+    "MovieGenre",
+    "MovieGenreCount",
+    "MovieName",
+    "MoviePatch",
+    "MovieSearchResult",
+    "MovieStatsResult",
     "MovieUpdate",
+    "MovieYearCount",
+    "MovieYearResult",
+    "MOVIE_CHANGES_DDL",
+    "MOVIE_FTS_DDL",
+    "MOVIE_LIST_DDL",
+    "MOVIE_STATS_DDL",
+    "check_storage",
+    "decode_genres",
+    "encode_genres",
+)
+
+GENRES = (
+    "Action",
+    "Adventure",
+    "Animation",
+    "Biography",
+    "Comedy",
+    "Crime",
+    "Drama",
+    "Family",
+    "Fantasy",
+    "Film-Noir",
+    "History",
+    "Horror",
+    "Music",
+    "Musical",
+    "Mystery",
+    "Romance",
+    "Sci-Fi",
+    "Sport",
+    "Thriller",
+    "War",
+    "Western",
 )
+GENRE_BITS = {genre: 1 << bit for bit, genre in enumerate(GENRES)}
+
+
+def encode_genres(genres: List[str]) -> int:
+    """Bitmask of genres: bit ``i`` is set for ``GENRES[i]``."""
+    mask = 0
+    for genre in genres:
+        try:
+            mask |= GENRE_BITS[genre]
+        except KeyError:
+            raise ValueError(f"Unknown genre: {genre}") from None
+    return mask
+
+
+@lru_cache(maxsize=4096)
+def _genres(mask: int) -> Tuple[str, ...]:
+    return tuple(genre for genre, bit in GENRE_BITS.items() if mask & bit)
+
+
+def decode_genres(mask: int) -> List[str]:
+    """Genres of a bitmask, in ``GENRES`` order."""
+    return list(_genres(mask))
+
+
+class GenreMask(TypeDecorator):
+    """List of genres stored as a bitmask integer (see ``encode_genres``).
+
+    Genres come back in ``GENRES`` order, without duplicates.
+    """
+
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value: Any, dialect: Any) -> Optional[int]:
+        return None if value is None else encode_genres(value)
+
+    def process_result_value(self, value: Any, dialect: Any) -> Optional[List[str]]:
+        return None if value is None else decode_genres(value)
+
+
+def check_storage(bind: Any, compact: bool = COMPACT_STORAGE) -> None:
+    """Check that the movie table of the database (engine or connection),
+    if created, is stored as set by ``COMPACT_STORAGE``.
+
+    The setting decides the schema, so it cannot be changed on an existing
+    database: the columns would be read and filtered as the wrong type.
+    """
+    inspector = inspect(bind)
+    if not inspector.has_table("movie"):
+        return
+    columns = {
+        column["name"]: column["type"] for column in inspector.get_columns("movie")
+    }
+    created_compact = isinstance(columns["genres"], Integer)
+    if created_compact != compact:
+        raise RuntimeError(
+            "The movie table was created with compact storage "
+            f"{'on' if created_compact else 'off'}: set FORANA_COMPACT_STORAGE="
+            f"{int(created_compact)}, or export the records and load them into "
+            "a new database"
+        )
+
+
+def check_not_null(cls, value: Any) -> Any:
+    """Validator of fields optional in a patch, but not nullable."""
+    if value is None:
+        raise ValueError("none is not an allowed value")
+    return value
+
+
+def check_genres(cls, genres: Optional[List[str]]) -> Optional[List[str]]:
+    """Validator of genres: with compact storage, only ``GENRES``."""
+    if COMPACT_STORAGE and genres is not None:
+        encode_genres(genres)
+    return genres
 
 
 class Movie(SQLModel, table=True):
     """This is the model connected to the database."""
 
     id: Optional[int] = Field(default=None, primary_key=True)
-    title: str
-    year: int
-    runtime: int
-    genres: List[str] = Field(sa_column=Column(JSON))
+    title: str = Field(index=True)
+    year: int = Field(index=True)
+    runtime: int = Field(index=True)
+    genres: List[str] = Field(sa_column=Column(GenreMask if COMPACT_STORAGE else JSON))
     directors: List[str] = Field(sa_column=Column(JSON))
     actors: List[str] = Field(sa_column=Column(JSON))
     plot: str
     poster_url: str
+    # Incremented by every update, for optimistic concurrency control
+    version: int = Field(default=1, sa_column_kwargs={"server_default": "1"})
+    # Last modification time (UTC), for Last-Modified headers
+    updated_at: Optional[datetime] = Field(
+        default=None,
+        sa_column_kwargs={
+            # Set by inserts too, as SQLite cannot add the column with this
+            # server default to existing tables (see the migrations)
+            "default": func.current_timestamp(),
+            "server_default": func.current_timestamp(),
+            "onupdate": func.current_timestamp(),
+        },
+    )
 
 
 class MovieCreate(SQLModel, table=False):
@@ -35,6 +177,439 @@ class MovieCreate(SQLModel, table=False):
     plot: str
     poster_url: str
 
+    _check_genres = validator("genres", allow_reuse=True)(check_genres)
+
 
 class MovieUpdate(MovieCreate):
     """This is the model, used mainly for serialization of inputs on update."""
+
+
+class MoviePatch(SQLModel, table=False):
+    """This is the model, used for serialization of inputs on partial update.
+
+    Only the given fields are updated; if ``version`` is given, only if it
+    is still the current version.
+    """
+
+    title: Optional[str] = None
+    year: Optional[int] = None
+    runtime: Optional[int] = None
+    genres: Optional[List[str]] = None
+    directors: Optional[List[str]] = None
+    actors: Optional[List[str]] = None
+    plot: Optional[str] = None
+    poster_url: Optional[str] = None
+    version: Optional[int] = None
+
+    _check_genres = validator("genres", allow_reuse=True)(check_genres)
+    # Only ``version`` may be null (no version check)
+    _check_not_null = validator(
+        "title",
+        "year",
+        "runtime",
+        "genres",
+        "directors",
+        "actors",
+        "plot",
+        "poster_url",
+        pre=True,
+        allow_reuse=True,
+    )(check_not_null)
+
+
+class MovieSearchResult(MovieCreate):
+    """This is the model, used for serialization of full-text search results."""
+
+    id: int
+    score: float
+    snippet: str
+
+
+class MovieGenre(SQLModel, table=True):
+    """Genres of a movie, normalized for indexed lookups.
+
+    Kept in sync with ``Movie.genres`` by database triggers. Unused with
+    compact storage, where genres are matched on the bitmask.
+    """
+
+    __tablename__ = "movie_genre"
+
+    name: str = Field(primary_key=True)
+    movie_id: int = Field(primary_key=True, foreign_key="movie.id", index=True)
+
+
+class MovieName(SQLModel, table=True):
+    """Names of actors and directors, interned with compact storage: each
+    name is stored once and ``MovieActor`` and ``MovieDirector`` refer to
+    it by id. Names are only ever added (by database triggers).
+    """
+
+    __tablename__ = "movie_name"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    name: str = Field(unique=True)
+
+
+class MovieActor(SQLModel, table=True):
+    """Actors of a movie, normalized for indexed lookups.
+
+    Kept in sync with ``Movie.actors`` by database triggers. With compact
+    storage, names are referred to by id (see ``MovieName``).
+    """
+
+    __tablename__ = "movie_actor"
+
+    if COMPACT_STORAGE:
+        name_id: int = Field(primary_key=True, foreign_key="movie_name.id")
+    else:
+        name: str = Field(primary_key=True)
+    movie_id: int = Field(primary_key=True, foreign_key="movie.id", index=True)
+
+
+class MovieDirector(SQLModel, table=True):
+    """Directors of a movie, normalized for indexed lookups.
+
+    Kept in sync with ``Movie.directors`` by database triggers. With compact
+    storage, names are referred to by id (see ``MovieName``).
+    """
+
+    __tablename__ = "movie_director"
+
+    if COMPACT_STORAGE:
+        name_id: int = Field(primary_key=True, foreign_key="movie_name.id")
+    else:
+        name: str = Field(primary_key=True)
+    movie_id: int = Field(primary_key=True, foreign_key="movie.id", index=True)
+
+
+def list_values(column: str, row: str) -> Tuple[str, str]:
+    """Table-valued function and condition selecting the items (``value``)
+    of list ``column`` of movie ``row``, in triggers and backfills."""
+    if COMPACT_STORAGE and column == "genres":
+        # Bit ``key`` of the mask stands for item ``key`` of GENRES
+        return f"json_each('{json.dumps(GENRES)}')", f"({row}.{column} >> key) & 1"
+    return f"json_each({row}.{column})", "true"
+
+
+def sync_list_table(model, column: str) -> Tuple[str, ...]:
+    """Keep a normalized table in sync with a JSON list column of movie.
+
+    Triggers are created (and existing rows copied over) right after the
+    normalized table is created. The statements are returned.
+    """
+    table = model.__tablename__
+    insert = (
+        f"INSERT OR IGNORE INTO {table} (name, movie_id) "
+        f"SELECT value, new.id FROM json_each(new.{column});"
+    )
+    delete = f"DELETE FROM {table} WHERE movie_id = old.id;"
+    statements = (
+        f"CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON movie "
+        f"BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_au AFTER UPDATE OF {column} ON movie "
+        f"BEGIN {delete} {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON movie "
+        f"BEGIN {delete} END",
+        f"INSERT OR IGNORE INTO {table} (name, movie_id) "
+        f"SELECT value, movie.id FROM movie, json_each(movie.{column})",
+    )
+    for statement in statements:
+        event.listen(
+            model.__table__,
+            "after_create",
+            DDL(statement).execute_if(dialect="sqlite"),
+        )
+    return statements
+
+
+def sync_name_table(model, column: str) -> Tuple[str, ...]:
+    """Keep a normalized table of interned names (see ``MovieName``) in sync
+    with a JSON list column of movie.
+
+    New names are added to the names table first. Triggers are created
+    (and existing rows copied over) right after the normalized table is
+    created. The statements are returned.
+    """
+    table = model.__tablename__
+    names = MovieName.__tablename__
+
+    def insert(source: str, movie_id: str) -> Tuple[str, str]:
+        return (
+            f"INSERT OR IGNORE INTO {names} (name) SELECT value FROM {source}",
+            f"INSERT OR IGNORE INTO {table} (name_id, movie_id) "
+            f"SELECT {names}.id, {movie_id} FROM {source} "
+            f"JOIN {names} ON {names}.name = value",
+        )
+
+    inserts = "".join(
+        f"{statement}; " for statement in insert(f"json_each(new.{column})", "new.id")
+    )
+    delete = f"DELETE FROM {table} WHERE movie_id = old.id;"
+    statements = (
+        f"CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON movie "
+        f"BEGIN {inserts}END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_au AFTER UPDATE OF {column} ON movie "
+        f"BEGIN {delete} {inserts}END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON movie "
+        f"BEGIN {delete} END",
+        *insert(f"movie, json_each(movie.{column})", "movie.id"),
+    )
+    for statement in statements:
+        event.listen(
+            model.__table__,
+            "after_create",
+            DDL(statement).execute_if(dialect="sqlite"),
+        )
+    return statements
+
+
+if COMPACT_STORAGE:
+    # Genres are matched on the bitmask of movie, names are interned
+    MOVIE_LIST_DDL = (
+        *sync_name_table(MovieActor, "actors"),
+        *sync_name_table(MovieDirector, "directors"),
+    )
+else:
+    MOVIE_LIST_DDL = (
+        *sync_list_table(MovieGenre, "genres"),
+        *sync_list_table(MovieActor, "actors"),
+        *sync_list_table(MovieDirector, "directors"),
+    )
+
+
+class MovieGenreCount(SQLModel, table=True):
+    """Number of movies per genre, see ``stats.py``.
+
+    Kept up to date with ``Movie.genres`` by database triggers.
+    """
+
+    __tablename__ = "movie_genre_count"
+
+    name: str = Field(primary_key=True)
+    count: int = Field(index=True)
+
+
+class MovieDirectorCount(SQLModel, table=True):
+    """Number of movies per director, see ``stats.py``.
+
+    Kept up to date with ``Movie.directors`` by database triggers.
+    """
+
+    __tablename__ = "movie_director_count"
+
+    name: str = Field(primary_key=True)
+    count: int = Field(index=True)
+
+
+class MovieYearCount(SQLModel, table=True):
+    """Number of movies and their total runtime per year, see ``stats.py``.
+
+    Kept up to date with ``Movie.year`` and ``Movie.runtime`` by database
+    triggers.
+    """
+
+    __tablename__ = "movie_year_count"
+
+    year: int = Field(primary_key=True)
+    count: int
+    runtime_total: int
+
+
+class MovieCountResult(SQLModel, table=False):
+    """This is the model, used for serialization of counts per name."""
+
+    name: str
+    count: int
+
+
+class MovieYearResult(SQLModel, table=False):
+    """This is the model, used for serialization of counts per year."""
+
+    year: int
+    count: int
+    runtime_avg: float
+
+
+class MovieStatsResult(SQLModel, table=False):
+    """This is the model, used for serialization of overall statistics."""
+
+    count: int
+    runtime_avg: Optional[float]
+    year_min: Optional[int]
+    year_max: Optional[int]
+
+
+def _listen_ddl(model, statements: Tuple[str, ...]) -> None:
+    """Run statements right after the table of model is created.
+
+    The table must be created after movie, which the triggers are on.
+    """
+    model.__table__.add_is_dependent_on(Movie.__table__)
+    for statement in statements:
+        event.listen(
+            model.__table__,
+            "after_create",
+            DDL(statement).execute_if(dialect="sqlite"),
+        )
+
+
+def sync_count_table(model, column: str) -> Tuple[str, ...]:
+    """Keep a table of movie counts per item of a JSON list column of movie
+    up to date, incrementally.
+
+    Triggers are created (and counts computed from existing rows) right
+    after the count table is created. The statements are returned.
+    """
+    table = model.__tablename__
+    new_source, new_condition = list_values(column, "new")
+    old_source, old_condition = list_values(column, "old")
+    source, condition = list_values(column, "movie")
+    increment = (
+        f"INSERT INTO {table} (name, count) "
+        f"SELECT DISTINCT value, 1 FROM {new_source} WHERE {new_condition} "
+        f"ON CONFLICT (name) DO UPDATE SET count = count + 1;"
+    )
+    names = f"SELECT value FROM {old_source} WHERE {old_condition}"
+    decrement = (
+        f"UPDATE {table} SET count = count - 1 WHERE name IN ({names}); "
+        f"DELETE FROM {table} WHERE name IN ({names}) AND count = 0;"
+    )
+    statements = (
+        f"CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON movie "
+        f"BEGIN {increment} END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_au AFTER UPDATE OF {column} ON movie "
+        f"BEGIN {decrement} {increment} END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON movie "
+        f"BEGIN {decrement} END",
+        f"DELETE FROM {table}",
+        f"INSERT INTO {table} (name, count) "
+        f"SELECT value, count(DISTINCT movie.id) "
+        f"FROM movie, {source} WHERE {condition} GROUP BY value",
+    )
+    _listen_ddl(model, statements)
+    return statements
+
+
+def sync_year_table(model) -> Tuple[str, ...]:
+    """Keep a table of movie counts and total runtime per year up to date,
+    incrementally.
+
+    Triggers are created (and totals computed from existing rows) right
+    after the table is created. The statements are returned.
+    """
+    table = model.__tablename__
+    increment = (
+        f"INSERT INTO {table} (year, count, runtime_total) "
+        f"VALUES (new.year, 1, new.runtime) "
+        f"ON CONFLICT (year) DO UPDATE SET count = count + 1, "
+        f"runtime_total = runtime_total + excluded.runtime_total;"
+    )
+    decrement = (
+        f"UPDATE {table} SET count = count - 1, "
+        f"runtime_total = runtime_total - old.runtime WHERE year = old.year; "
+        f"DELETE FROM {table} WHERE year = old.year AND count = 0;"
+    )
+    statements = (
+        f"CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON movie "
+        f"BEGIN {increment} END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_au "
+        f"AFTER UPDATE OF year, runtime ON movie "
+        f"BEGIN {decrement} {increment} END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON movie "
+        f"BEGIN {decrement} END",
+        f"DELETE FROM {table}",
+        f"INSERT INTO {table} (year, count, runtime_total) "
+        f"SELECT year, count(*), sum(runtime) FROM movie GROUP BY year",
+    )
+    _listen_ddl(model, statements)
+    return statements
+
+
+class MovieChange(SQLModel, table=True):
+    """Change log of movie: the last change of every movie (including
+    deleted ones), by sequence number. Maintained by triggers, in the
+    transaction of the change. See ``crud.CRUDRouter``."""
+
+    __tablename__ = "movie_change"
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq: Optional[int] = Field(default=None, primary_key=True)
+    # No foreign key: the entries of deleted movies are kept (tombstones)
+    movie_id: int = Field(unique=True)
+    op: str
+
+
+def sync_change_log(model) -> Tuple[str, ...]:
+    """Log every insert, update and delete of movie in a change log table.
+
+    A change replaces the previous entry of the same movie, with a new
+    (ever increasing) sequence number, so that the log holds one entry per
+    movie. Triggers are created (and existing movies logged as created)
+    right after the table is created. The statements are returned.
+    """
+    table = model.__tablename__
+
+    def log(op: str, row: str) -> str:
+        return f"REPLACE INTO {table} (movie_id, op) VALUES ({row}.id, '{op}');"
+
+    statements = (
+        f"CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON movie "
+        f"BEGIN {log('create', 'new')} END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_au AFTER UPDATE ON movie "
+        f"BEGIN {log('update', 'new')} END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON movie "
+        f"BEGIN {log('delete', 'old')} END",
+        f"INSERT INTO {table} (movie_id, op) SELECT id, 'create' FROM movie "
+        f"WHERE id NOT IN (SELECT movie_id FROM {table}) ORDER BY id",
+    )
+    _listen_ddl(model, statements)
+    return statements
+
+
+# Change log for incremental sync (``/changes`` routes of ``crud.py``)
+MOVIE_CHANGES_DDL = sync_change_log(MovieChange)
+
+# Aggregates for ``stats.py``, maintained by triggers, so that reading them
+# does not scan the movie table
+MOVIE_STATS_DDL = (
+    *sync_count_table(MovieGenreCount, "genres"),
+    *sync_count_table(MovieDirectorCount, "directors"),
+    *sync_year_table(MovieYearCount),
+)
+
+# Full-text search index over movie, see ``search.py``. The index is an
+# external content FTS5 table: it stores no copy of the text and is kept in
+# sync with the movie table by triggers.
+MOVIE_FTS_COLUMNS = "title, plot, actors, directors"
+MOVIE_FTS_VALUES = "{row}.id, {row}.title, {row}.plot, {row}.actors, {row}.directors"
+MOVIE_FTS_INSERT = (
+    f"INSERT INTO movie_fts (rowid, {MOVIE_FTS_COLUMNS}) "
+    f"VALUES ({MOVIE_FTS_VALUES.format(row='new')});"
+)
+MOVIE_FTS_DELETE = (
+    f"INSERT INTO movie_fts (movie_fts, rowid, {MOVIE_FTS_COLUMNS}) "
+    f"VALUES ('delete', {MOVIE_FTS_VALUES.format(row='old')});"
+)
+MOVIE_FTS_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS movie_fts USING fts5("
+    f"{MOVIE_FTS_COLUMNS}, content='movie', content_rowid='id')",
+    f"CREATE TRIGGER IF NOT EXISTS movie_fts_ai AFTER INSERT ON movie "
+    f"BEGIN {MOVIE_FTS_INSERT} END",
+    f"CREATE TRIGGER IF NOT EXISTS movie_fts_au AFTER UPDATE ON movie "
+    f"BEGIN {MOVIE_FTS_DELETE} {MOVIE_FTS_INSERT} END",
+    f"CREATE TRIGGER IF NOT EXISTS movie_fts_ad AFTER DELETE ON movie "
+    f"BEGIN {MOVIE_FTS_DELETE} END",
+    "INSERT INTO movie_fts (movie_fts) VALUES ('rebuild')",
+)
+
+for statement in MOVIE_FTS_DDL:
+    event.listen(
+        Movie.__table__,
+        "after_create",
+        DDL(statement).execute_if(dialect="sqlite"),
+    )
+event.listen(
+    Movie.__table__,
+    "before_drop",
+    DDL("DROP TABLE IF EXISTS movie_fts").execute_if(dialect="sqlite"),
+)
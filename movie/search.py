@@ -0,0 +1,79 @@
+"""
+Full-text search. To rebuild the search index run python search.py.
+"""
+import re
+from typing import Any, List
+
+from fastapi import Depends, Query
+from sqlalchemy import column, func, literal_column, select, table, text
+from sqlalchemy.orm import Session
+
+from db import ENGINE, get_db
+from models import MOVIE_FTS_DDL, Movie
+
+__all__ = (
+    "reindex",
+    "search",
+    "to_fts_query",
+)
+
+# Relative weights of the title, plot, actors and directors columns
+BM25_WEIGHTS = (10.0, 1.0, 5.0, 5.0)
+SNIPPET_TOKENS = 16
+
+MOVIE_FTS = table("movie_fts", column("rowid"))
+
+
+def to_fts_query(q: str) -> str:
+    """Turn free text into an FTS5 query matching all of its words.
+
+    Every word is quoted, so FTS5 operators in user input are matched
+    literally instead of being interpreted.
+    """
+    return " ".join(f'"{word}"' for word in re.findall(r"\w+", q))
+
+
+def search(
+    q: str = Query(..., min_length=1),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, gt=0, le=100),
+    db: Session = Depends(get_db),
+) -> List[Any]:
+    """Search movies by title, plot, actors and directors.
+
+    Results are ranked by relevance (BM25), best match first.
+    """
+    query = to_fts_query(q)
+    if not query:
+        return []
+
+    fts = literal_column("movie_fts")
+    movie = Movie.__table__
+    statement = (
+        select(
+            movie,
+            (-func.bm25(fts, *BM25_WEIGHTS)).label("score"),
+            func.snippet(fts, -1, "<b>", "</b>", "…", SNIPPET_TOKENS).label("snippet"),
+        )
+        .select_from(movie.join(MOVIE_FTS, MOVIE_FTS.c.rowid == movie.c.id))
+        .where(fts.op("MATCH")(query))
+        .order_by(literal_column("score").desc())
+        .offset(skip)
+        .limit(limit)
+    )
+    return [dict(row._mapping) for row in db.execute(statement)]
+
+
+def reindex(engine=ENGINE) -> None:
+    """Create (if missing) and rebuild the search index.
+
+    Databases created before the search index was introduced get the
+    index and its triggers; existing ones are rebuilt from scratch.
+    """
+    with engine.begin() as connection:
+        for statement in MOVIE_FTS_DDL:
+            connection.execute(text(statement))
+
+
+if __name__ == "__main__":
+    reindex()
@@ -0,0 +1,90 @@
+"""
+Aggregates for dashboards. Read from count tables kept up to date by
+database triggers (see ``models.MOVIE_STATS_DDL``), so that no request scans
+the movie table. To recompute them run python stats.py.
+"""
+from typing import Any, Dict, List
+
+from fastapi import Depends, Query
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+
+from db import ENGINE, get_db
+from models import (
+    MOVIE_STATS_DDL,
+    MovieDirectorCount,
+    MovieGenreCount,
+    MovieYearCount,
+)
+
+__all__ = (
+    "recompute",
+    "stats",
+    "stats_directors",
+    "stats_genres",
+    "stats_years",
+)
+
+
+def stats(db: Session = Depends(get_db)) -> Dict[str, Any]:
+    """Number of movies, average runtime and range of years."""
+    year = MovieYearCount.__table__.c
+    count = func.coalesce(func.sum(year.count), 0)
+    statement = select(
+        count.label("count"),
+        (func.sum(year.runtime_total) * 1.0 / func.sum(year.count)).label(
+            "runtime_avg"
+        ),
+        func.min(year.year).label("year_min"),
+        func.max(year.year).label("year_max"),
+    )
+    return dict(db.execute(statement).one()._mapping)
+
+
+def _counts(model, limit: int, db: Session) -> List[Any]:
+    table = model.__table__
+    statement = (
+        select(table.c.name, table.c.count)
+        .order_by(table.c.count.desc(), table.c.name)
+        .limit(limit)
+    )
+    return [dict(row._mapping) for row in db.execute(statement)]
+
+
+def stats_genres(
+    limit: int = Query(100, gt=0, le=1000),
+    db: Session = Depends(get_db),
+) -> List[Any]:
+    """Number of movies per genre, most frequent first."""
+    return _counts(MovieGenreCount, limit, db)
+
+
+def stats_directors(
+    limit: int = Query(100, gt=0, le=1000),
+    db: Session = Depends(get_db),
+) -> List[Any]:
+    """Number of movies per director, most frequent first."""
+    return _counts(MovieDirectorCount, limit, db)
+
+
+def stats_years(db: Session = Depends(get_db)) -> List[Any]:
+    """Number of movies and average runtime per year."""
+    year = MovieYearCount.__table__.c
+    statement = select(
+        year.year,
+        year.count,
+        (year.runtime_total * 1.0 / year.count).label("runtime_avg"),
+    ).order_by(year.year)
+    return [dict(row._mapping) for row in db.execute(statement)]
+
+
+def recompute(engine=ENGINE) -> None:
+    """Create (if missing) the triggers and recompute the count tables
+    from scratch."""
+    with engine.begin() as connection:
+        for statement in MOVIE_STATS_DDL:
+            connection.execute(text(statement))
+
+
+if __name__ == "__main__":
+    recompute()
@@ -0,0 +1,28 @@
+"""Add indexes on item complete
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 12:00:00.000000
+
+SQLite builds an index in a single statement, holding the write lock
+meanwhile (readers go on in WAL mode), so every index is built in a
+transaction of its own, rather than all in the transaction of the revision.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index("ix_item_complete", "item", ["complete"], if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_item_complete", table_name="item")
@@ -1,19 +1,68 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi_crudrouter import SQLAlchemyCRUDRouter as CRUDRouter
-from sqlmodel import create_engine
-from starlette_admin.contrib.sqla import Admin, ModelView
+from fastapi.responses import PlainTextResponse
 
-from db import DATABASE_URL, get_db
-from models import Item, ItemCreate, ItemUpdate
+from admin import LazyAdmin
+from batching import WriteBatcher
+from cache import LRUCache
+from crud import NEXT_CURSOR_HEADER, AsyncCRUDRouter, CRUDRouter
+from db import ENGINE, dispose_engines, get_async_db, get_db
+from filters import item_filters
+from metrics import (
+    PROMETHEUS_MEDIA_TYPE,
+    InstrumentedRoute,
+    Metrics,
+    MetricsMiddleware,
+    instrument_engines,
+)
+from middleware import CompressionMiddleware, ConditionalGetMiddleware
+from models import Item, ItemChange, ItemCreate, ItemPatch, ItemUpdate
+from settings import (
+    ADMIN,
+    ASYNC,
+    BATCH_INTERVAL,
+    BATCH_MAX_SIZE,
+    BATCH_SYNCHRONOUS,
+    BATCH_WRITES,
+    BROTLI_LEVEL,
+    CACHE,
+    CACHE_CONTROL,
+    CACHE_MAX_SIZE,
+    CACHE_TTL,
+    CHANGES_POLL_INTERVAL,
+    CHANGES_STREAM_TIMEOUT,
+    COMPRESSION,
+    COMPRESSION_MIN_SIZE,
+    DEBUG,
+    DOCS,
+    FAST_JSON,
+    GZIP_LEVEL,
+    METRICS,
+    N_PLUS_ONE_THRESHOLD,
+)
 
 __all__ = ("app",)
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Write queued rows and close pooled connections on (graceful)
+    shutdown."""
+    yield
+    if BATCHER is not None:
+        await run_in_threadpool(BATCHER.close)
+    await dispose_engines()
+
+
 app = FastAPI(
-    docs_url="/api/docs",
-    redoc_url="/api/redoc",
-    debug=True,
+    docs_url="/api/docs" if DOCS else None,
+    redoc_url="/api/redoc" if DOCS else None,
+    openapi_url="/openapi.json" if DOCS else None,
+    debug=DEBUG,
+    lifespan=lifespan,
 )
 app.add_middleware(
     CORSMiddleware,
@@ -21,32 +70,94 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    # Expose 'Content-Disposition' header
-    expose_headers=["Content-Disposition"],
+    # Expose 'Content-Disposition', pagination cursor, cache and timing headers
+    expose_headers=[
+        "Content-Disposition",
+        NEXT_CURSOR_HEADER,
+        "ETag",
+        "Server-Timing",
+    ],
+)
+app.add_middleware(ConditionalGetMiddleware)
+if COMPRESSION:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=COMPRESSION_MIN_SIZE,
+        gzip_level=GZIP_LEVEL,
+        brotli_level=BROTLI_LEVEL,
+    )
+
+# Per request query count and timings
+METRICS_REGISTRY = Metrics(N_PLUS_ONE_THRESHOLD) if METRICS else None
+if METRICS_REGISTRY is not None:
+    instrument_engines()
+    app.router.route_class = InstrumentedRoute
+    app.add_middleware(MetricsMiddleware, metrics=METRICS_REGISTRY)
+
+# Group commit of creates
+BATCHER = (
+    WriteBatcher(
+        ENGINE,
+        Item.__table__,
+        max_size=BATCH_MAX_SIZE,
+        interval=BATCH_INTERVAL / 1000,
+        synchronous=BATCH_SYNCHRONOUS,
+    )
+    if BATCH_WRITES
+    else None
 )
 
+CACHE_BACKEND = LRUCache(max_size=CACHE_MAX_SIZE, ttl=CACHE_TTL) if CACHE else None
+
+# CRUD routes run on the async engine when the async mode is on
+router_class, router_db = (
+    (AsyncCRUDRouter, get_async_db) if ASYNC else (CRUDRouter, get_db)
+)
 app.include_router(
-    CRUDRouter(
+    router_class(
         schema=Item,
         create_schema=ItemCreate,
         update_schema=ItemUpdate,
         db_model=Item,
-        db=get_db,
+        db=router_db,
+        filters=item_filters,
+        upsert_key="title",
+        patch_schema=ItemPatch,
+        version_key="version",
+        modified_key="updated_at",
+        cache_control=CACHE_CONTROL,
+        cache=CACHE_BACKEND,
+        batcher=BATCHER,
+        change_model=ItemChange,
+        changes_poll_interval=CHANGES_POLL_INTERVAL,
+        changes_stream_timeout=CHANGES_STREAM_TIMEOUT,
+        fast_json=FAST_JSON,
+        route_class=app.router.route_class,
     ),
     prefix="/api",
 )
 
-# Create admin
-ENGINE = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-admin = Admin(ENGINE, title="Admin")
-
-# Add view
-admin.add_view(ModelView(Item))
-
-# Mount admin to your app
-admin.mount_to(app)
+# Admin, built on its first request
+if ADMIN:
+    app.mount("/admin", LazyAdmin(), name="admin")
 
 
 @app.get("/")
 def read_root():
     return {"status": "OK"}
+
+
+@app.get("/api/cache")
+def read_cache_stats():
+    if CACHE_BACKEND is None:
+        raise HTTPException(404, "Cache is disabled")
+    return CACHE_BACKEND.stats
+
+
+@app.get("/metrics", include_in_schema=False)
+def read_metrics():
+    if METRICS_REGISTRY is None:
+        raise HTTPException(404, "Metrics are disabled")
+    return PlainTextResponse(
+        METRICS_REGISTRY.render(), media_type=PROMETHEUS_MEDIA_TYPE
+    )
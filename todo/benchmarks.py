@@ -0,0 +1,861 @@
+"""
+Benchmarks. To run all benchmarks run python benchmarks.py.
+
+Results are printed (and with ``--output``, saved) as JSON. Two saved runs
+can be compared with ``--compare BASELINE CURRENT``, which fails if any
+metric regressed by more than ``--threshold`` percent.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+import httpx
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import SQLModel, create_engine
+
+from api import app
+from batching import WriteBatcher
+from crud import AsyncCRUDRouter, CRUDRouter, encode_cursor
+from db import get_async_db, get_db, make_async_engine, make_engine
+from middleware import CompressionMiddleware
+from models import Item, ItemCreate, ItemUpdate
+from server import worker_count
+
+__all__ = (
+    "bench_batching",
+    "bench_compression",
+    "bench_concurrency",
+    "bench_crud",
+    "bench_mixed",
+    "bench_pagination",
+    "bench_serialization",
+    "bench_server",
+    "compare",
+    "make_client",
+    "seed",
+)
+
+BATCH_SIZE = 10_000
+BENCHMARKS = [
+    "batching",
+    "compression",
+    "concurrency",
+    "crud",
+    "mixed",
+    "pagination",
+    "serialization",
+    "server",
+]
+# Compression levels of the compression benchmark
+COMPRESSION_LEVELS = {"gzip": (1, 6, 9), "br": (1, 4, 11)}
+
+
+def make_rows(start: int, stop: int) -> List[Dict[str, Any]]:
+    """Make cheap, deterministic item rows."""
+    return [{"title": f"Item {i}", "complete": bool(i % 2)} for i in range(start, stop)]
+
+
+def seed(engine, size: int, offset: int = 0) -> None:
+    """Seed the database with items ``offset`` to ``size``."""
+    SQLModel.metadata.create_all(engine)
+    table = Item.__table__
+    with engine.begin() as connection:
+        for start in range(offset, size, BATCH_SIZE):
+            stop = min(start + BATCH_SIZE, size)
+            connection.execute(table.insert(), make_rows(start, stop))
+
+
+@contextmanager
+def temporary_database() -> Iterator[str]:
+    """Temporary database URL."""
+    with tempfile.TemporaryDirectory() as directory:
+        yield f"sqlite:///{os.path.join(directory, 'bench.db')}"
+
+
+def make_client(database_url: str) -> TestClient:
+    """Make a test client bound to the given database."""
+    engine = create_engine(database_url, connect_args={"check_same_thread": False})
+    session_local = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def override_get_db():
+        session = session_local()
+        try:
+            yield session
+            session.commit()
+        finally:
+            session.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    return TestClient(app)
+
+
+def percentiles(timings: List[float]) -> Dict[str, float]:
+    """Latency stats of ``timings`` (in ms)."""
+    timings = sorted(timings)
+
+    def percentile(n: int) -> float:
+        return round(timings[min(len(timings) - 1, len(timings) * n // 100)], 3)
+
+    return {
+        "p50_ms": round(statistics.median(timings), 3),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+        "max_ms": round(timings[-1], 3),
+    }
+
+
+async def run_requests(
+    client: httpx.AsyncClient,
+    requests: List[Tuple[str, str, Dict[str, Any]]],
+    concurrency: int,
+) -> Dict[str, Any]:
+    """Send ``(method, url, kwargs)`` requests, ``concurrency`` at a time.
+
+    Return throughput, latency stats and the number of error responses.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    timings: List[float] = []
+    errors = 0
+
+    async def send(method: str, url: str, kwargs: Dict[str, Any]) -> None:
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            timings.append((time.perf_counter() - start) * 1000)
+            errors += response.is_error
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send(*request) for request in requests))
+    seconds = time.perf_counter() - start
+    return {
+        "requests": len(requests),
+        "errors": errors,
+        "requests_per_second": round(len(requests) / seconds, 1),
+        **percentiles(timings),
+    }
+
+
+def timeit(func: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    """Call ``func`` ``repeat`` times and return latency stats in ms."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return percentiles(timings)
+
+
+def bench_pagination(
+    client: TestClient,
+    limit: int,
+    pages: List[int],
+    repeat: int,
+) -> Dict[str, Any]:
+    """Compare offset and cursor pagination latency at given pages."""
+    results = {}
+    for page in pages:
+        skip = (page - 1) * limit
+        # Seeded ids are contiguous and start at 1
+        cursor = encode_cursor(skip)
+        results[page] = {
+            "offset": timeit(
+                lambda: client.get("/api/item", params={"skip": skip, "limit": limit}),
+                repeat,
+            ),
+            "cursor": timeit(
+                lambda: client.get(
+                    "/api/item", params={"cursor": cursor, "limit": limit}
+                ),
+                repeat,
+            ),
+        }
+    return results
+
+
+def bench_concurrency(
+    database_url: str,
+    size: int,
+    concurrency: int,
+    requests: int,
+) -> Dict[str, Any]:
+    """Compare throughput and tail latency of the sync and async modes.
+
+    ``requests`` detail requests are sent, ``concurrency`` at a time, to
+    the sync and to the async CRUD router.
+    """
+    engine = create_engine(database_url, connect_args={"check_same_thread": False})
+    session_local = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    async_session_local = sessionmaker(
+        create_async_engine(
+            database_url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+        ),
+        class_=AsyncSession,
+        expire_on_commit=False,
+    )
+
+    def get_bench_db():
+        session = session_local()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    async def get_bench_async_db():
+        async with async_session_local() as session:
+            yield session
+
+    bench_app = FastAPI()
+    for prefix, router_class, db in (
+        ("/sync", CRUDRouter, get_bench_db),
+        ("/async", AsyncCRUDRouter, get_bench_async_db),
+    ):
+        bench_app.include_router(
+            router_class(
+                schema=Item,
+                create_schema=ItemCreate,
+                update_schema=ItemUpdate,
+                db_model=Item,
+                db=db,
+            ),
+            prefix=prefix,
+        )
+
+    async def run(prefix: str) -> Dict[str, Any]:
+        transport = httpx.ASGITransport(app=bench_app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench"
+        ) as client:
+            return await run_requests(
+                client,
+                [("GET", f"{prefix}/item/{i % size + 1}", {}) for i in range(requests)],
+                concurrency,
+            )
+
+    return {
+        "concurrency": concurrency,
+        "sync": asyncio.run(run("/sync")),
+        "async": asyncio.run(run("/async")),
+    }
+
+
+def bench_batching(concurrency: int, requests: int) -> Dict[str, Any]:
+    """Compare create throughput and latency without and with write-behind
+    batching.
+
+    ``requests`` creates are sent, ``concurrency`` at a time, to a router
+    committing every row and to a router batching them, each with the
+    ``synchronous`` pragma ``NORMAL`` and ``FULL`` (an fsync per commit).
+    """
+    results = {}
+    for name, batched, synchronous in (
+        ("unbatched", False, "NORMAL"),
+        ("unbatched_full", False, "FULL"),
+        ("batched", True, "NORMAL"),
+        ("batched_full", True, "FULL"),
+    ):
+        with temporary_database() as database_url:
+            # A connection per concurrent request
+            engine = make_engine(database_url, pool_size=concurrency)
+            event.listen(
+                engine,
+                "connect",
+                lambda connection, record, synchronous=synchronous: (
+                    connection.execute(f"PRAGMA synchronous={synchronous}")
+                ),
+            )
+            SQLModel.metadata.create_all(engine)
+            session_local = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+            batcher = (
+                WriteBatcher(engine, Item.__table__, synchronous=synchronous)
+                if batched
+                else None
+            )
+
+            def get_bench_db():
+                session = session_local()
+                try:
+                    yield session
+                finally:
+                    session.close()
+
+            bench_app = FastAPI()
+            bench_app.include_router(
+                CRUDRouter(
+                    schema=Item,
+                    create_schema=ItemCreate,
+                    update_schema=ItemUpdate,
+                    db_model=Item,
+                    db=get_bench_db,
+                    batcher=batcher,
+                )
+            )
+
+            async def run() -> Dict[str, Any]:
+                # Failed writes ("database is locked") count as errors
+                transport = httpx.ASGITransport(
+                    app=bench_app, raise_app_exceptions=False
+                )
+                async with httpx.AsyncClient(
+                    transport=transport, base_url="http://bench"
+                ) as client:
+                    return await run_requests(
+                        client,
+                        [
+                            ("POST", "/item", {"json": record})
+                            for record in make_rows(0, requests)
+                        ],
+                        concurrency,
+                    )
+
+            results[name] = asyncio.run(run())
+            if batcher is not None:
+                batcher.close()
+                results[name]["batches"] = batcher.batches
+            engine.dispose()
+    return {"concurrency": concurrency, **results}
+
+
+def bench_mixed(
+    size: int,
+    threads: int,
+    seconds: float,
+    write_ratio: float,
+) -> Dict[str, Any]:
+    """Compare mixed read/write throughput of a default and a tuned engine.
+
+    Each engine gets its own freshly seeded database (the journal mode is
+    persistent) and is hammered by ``threads`` threads for ``seconds``
+    seconds, each doing primary key reads and, with ``write_ratio``
+    probability, single row inserts.
+    """
+    results = {}
+    for name, engine_factory in (
+        (
+            "default",
+            lambda url: create_engine(url, connect_args={"check_same_thread": False}),
+        ),
+        ("tuned", make_engine),
+    ):
+        with temporary_database() as database_url:
+            seed(create_engine(database_url), size)
+            engine = engine_factory(database_url)
+            table = Item.__table__
+            counts = {"reads": 0, "writes": 0, "locked": 0}
+            lock = threading.Lock()
+            deadline = time.perf_counter() + seconds
+
+            def work(worker: int) -> None:
+                rng = random.Random(worker)
+                reads = writes = locked = 0
+                while time.perf_counter() < deadline:
+                    try:
+                        if rng.random() < write_ratio:
+                            with engine.begin() as connection:
+                                connection.execute(
+                                    table.insert(), make_rows(size, size + 1)
+                                )
+                            writes += 1
+                        else:
+                            with engine.connect() as connection:
+                                connection.execute(
+                                    table.select().where(
+                                        table.c.id == rng.randint(1, size)
+                                    )
+                                ).one()
+                            reads += 1
+                    except OperationalError:
+                        # "database is locked"
+                        locked += 1
+                with lock:
+                    counts["reads"] += reads
+                    counts["writes"] += writes
+                    counts["locked"] += locked
+
+            workers = [threading.Thread(target=work, args=(i,)) for i in range(threads)]
+            start = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - start
+            engine.dispose()
+        results[name] = {
+            **counts,
+            "ops_per_second": round((counts["reads"] + counts["writes"]) / elapsed, 1),
+        }
+    return results
+
+
+def bench_serialization(
+    database_url: str,
+    page_sizes: List[int],
+    repeat: int,
+) -> Dict[str, Any]:
+    """Compare CPU time and size of list responses at given page sizes.
+
+    Pages are serialized through the response model (``model``), straight
+    from rows (``fast``) and with only a few fields (``sparse``).
+    """
+    engine = make_engine(database_url)
+    session_local = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def get_bench_db():
+        session = session_local()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    bench_app = FastAPI()
+    for prefix, fast_json in (("/model", False), ("/fast", True)):
+        bench_app.include_router(
+            CRUDRouter(
+                schema=Item,
+                create_schema=ItemCreate,
+                update_schema=ItemUpdate,
+                db_model=Item,
+                db=get_bench_db,
+                fast_json=fast_json,
+            ),
+            prefix=prefix,
+        )
+    client = TestClient(bench_app)
+
+    results = {}
+    for limit in page_sizes:
+        results[limit] = {}
+        for name, prefix, params in (
+            ("model", "/model", {"limit": limit}),
+            ("fast", "/fast", {"limit": limit}),
+            ("sparse", "/model", {"limit": limit, "fields": "id,title"}),
+        ):
+            url = f"{prefix}/item"
+            size = len(client.get(url, params=params).content)
+            cpu_start = time.process_time()
+            latency = timeit(lambda: client.get(url, params=params), repeat)
+            cpu_ms = (time.process_time() - cpu_start) * 1000 / repeat
+            results[limit][name] = {
+                "cpu_ms_per_request": round(cpu_ms, 3),
+                "response_bytes": size,
+                **latency,
+            }
+    engine.dispose()
+    return results
+
+
+def bench_compression(
+    database_url: str,
+    page_sizes: List[int],
+    repeat: int,
+) -> Dict[str, Any]:
+    """Compare size on the wire and CPU time of list responses at given
+    page sizes, uncompressed (``identity``) and compressed with gzip and
+    brotli (if installed) at several levels.
+
+    Bodies are read as sent, so decompression is not accounted for.
+    """
+    engine = make_engine(database_url)
+    session_local = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def get_bench_db():
+        session = session_local()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    bench_app = FastAPI()
+    bench_app.include_router(
+        CRUDRouter(
+            schema=Item,
+            create_schema=ItemCreate,
+            update_schema=ItemUpdate,
+            db_model=Item,
+            db=get_bench_db,
+        )
+    )
+    configs = [("identity", "identity", 0)]
+    for encoding, levels in COMPRESSION_LEVELS.items():
+        if encoding in CompressionMiddleware(bench_app).compressors:
+            configs.extend((f"{encoding}-{level}", encoding, level) for level in levels)
+
+    results = {}
+    for limit in page_sizes:
+        results[limit] = {}
+        for name, encoding, level in configs:
+            client = TestClient(
+                CompressionMiddleware(
+                    bench_app, minimum_size=0, gzip_level=level, brotli_level=level
+                )
+            )
+
+            def get() -> int:
+                with client.stream(
+                    "GET",
+                    "/item",
+                    params={"limit": limit},
+                    headers={"Accept-Encoding": encoding},
+                ) as response:
+                    return sum(len(chunk) for chunk in response.iter_raw())
+
+            size = get()
+            cpu_start = time.process_time()
+            latency = timeit(get, repeat)
+            cpu_ms = (time.process_time() - cpu_start) * 1000 / repeat
+            identity = results[limit].get("identity", {})
+            results[limit][name] = {
+                "cpu_ms_per_request": round(cpu_ms, 3),
+                "added_cpu_ms_per_request": round(
+                    cpu_ms - identity.get("cpu_ms_per_request", cpu_ms), 3
+                ),
+                "response_bytes": size,
+                "ratio": round(size / identity.get("response_bytes", size), 3),
+                **latency,
+            }
+    engine.dispose()
+    return results
+
+
+async def drive_crud(
+    client: httpx.AsyncClient,
+    size: int,
+    limit: int,
+    concurrency: int,
+    requests: int,
+) -> Dict[str, Any]:
+    """Drive every CRUD route of a database seeded with ``size`` rows.
+
+    Each route gets ``requests`` requests (bulk and export fewer, as each
+    of them handles many rows), ``concurrency`` at a time. Rows created
+    along the way are deleted by the delete benchmark; the whole table is
+    deleted last.
+    """
+    url = "/api/item"
+    rng = random.Random(0)
+    bulk_size = 100
+    new = make_rows(size, size + requests)
+    bulk = make_rows(size + requests, size + requests + requests // 10 * bulk_size)
+    routes = {
+        "get_all": [
+            ("GET", url, {"params": {"skip": rng.randrange(size), "limit": limit}})
+            for _ in range(requests)
+        ],
+        "get_one": [
+            ("GET", f"{url}/{rng.randint(1, size)}", {}) for _ in range(requests)
+        ],
+        "create": [("POST", url, {"json": row}) for row in new],
+        "update": [
+            ("PUT", f"{url}/{rng.randint(1, size)}", {"json": row}) for row in new
+        ],
+        # Deletes the created rows
+        "delete_one": [
+            ("DELETE", f"{url}/{pk}", {}) for pk in range(size + 1, size + requests + 1)
+        ],
+        "bulk": [
+            ("POST", f"{url}/bulk", {"json": bulk[start : start + bulk_size]})
+            for start in range(0, len(bulk), bulk_size)
+        ],
+        "export": [("GET", f"{url}/export.ndjson", {})] * max(1, requests // 1000),
+        "delete_all": [("DELETE", url, {})],
+    }
+    return {
+        name: await run_requests(client, route_requests, concurrency)
+        for name, route_requests in routes.items()
+        if route_requests
+    }
+
+
+def max_rss_kib(who: int = resource.RUSAGE_SELF) -> int:
+    """Memory high-water mark (max RSS) of this process or its children."""
+    max_rss = resource.getrusage(who).ru_maxrss
+    # Bytes on macOS, KiB elsewhere
+    return max_rss // 1024 if sys.platform == "darwin" else max_rss
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def run_server(database_url: str, mode: str = "uvicorn") -> Iterator[str]:
+    """Run the API on the given database; yield its base URL.
+
+    The ``mode`` is ``uvicorn`` (a single process), ``dev`` (as ``make
+    run``: auto reload and debug on) or ``prod`` (``server.py``).
+    """
+    port = free_port()
+    env = {**os.environ, "FORANA_DATABASE_URL": database_url}
+    if mode == "prod":
+        command = ["server.py", "--port", str(port)]
+        env["FORANA_LOG_LEVEL"] = "warning"
+    else:
+        command = ["-m", "uvicorn", "api:app", "--port", str(port)]
+        command += ["--log-level", "warning"]
+        if mode == "dev":
+            command.append("--reload")
+            env["FORANA_DEBUG"] = "1"
+    server = subprocess.Popen(
+        [sys.executable, *command],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        for _ in range(100):
+            try:
+                httpx.get(base_url)
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        else:
+            raise RuntimeError("Server did not start")
+        yield base_url
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def bench_crud(
+    database_url: str,
+    size: int,
+    limit: int,
+    concurrency: int,
+    requests: int,
+    server: bool = False,
+) -> Dict[str, Any]:
+    """Measure throughput, latency and memory of every CRUD route.
+
+    Requests go to the in-process app (through ASGI) or, if ``server`` is
+    set, over HTTP to a real uvicorn process. The memory high-water mark
+    is that of the process serving the requests.
+    """
+    seed(create_engine(database_url), size)
+
+    async def run(**kwargs: Any) -> Dict[str, Any]:
+        async with httpx.AsyncClient(timeout=60, **kwargs) as client:
+            return await drive_crud(client, size, limit, concurrency, requests)
+
+    if server:
+        with run_server(database_url) as base_url:
+            routes = asyncio.run(run(base_url=base_url))
+        # The server has exited, so it is accounted for in the children usage
+        return {"routes": routes, "max_rss_kib": max_rss_kib(resource.RUSAGE_CHILDREN)}
+
+    engine = make_engine(database_url)
+    session_local = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    async_session_local = sessionmaker(
+        make_async_engine(database_url), class_=AsyncSession, expire_on_commit=False
+    )
+
+    def get_bench_db():
+        session = session_local()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    async def get_bench_async_db():
+        async with async_session_local() as session:
+            yield session
+
+    overrides = dict(app.dependency_overrides)
+    app.dependency_overrides[get_db] = get_bench_db
+    app.dependency_overrides[get_async_db] = get_bench_async_db
+    try:
+        routes = asyncio.run(
+            run(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+        )
+    finally:
+        app.dependency_overrides = overrides
+        engine.dispose()
+    return {"routes": routes, "max_rss_kib": max_rss_kib()}
+
+
+def bench_server(
+    size: int,
+    limit: int,
+    concurrency: int,
+    requests: int,
+) -> Dict[str, Any]:
+    """Compare throughput and latency of every CRUD route, served as by
+    ``make run`` (``dev``) and by ``server.py`` (``prod``).
+
+    Each mode gets a fresh database of ``size`` rows.
+    """
+    results: Dict[str, Any] = {"prod_workers": worker_count()}
+    for mode in ("dev", "prod"):
+        with temporary_database() as database_url:
+            seed(create_engine(database_url), size)
+            with run_server(database_url, mode) as base_url:
+
+                async def run() -> Dict[str, Any]:
+                    async with httpx.AsyncClient(
+                        base_url=base_url, timeout=60
+                    ) as client:
+                        return await drive_crud(
+                            client, size, limit, concurrency, requests
+                        )
+
+                results[mode] = asyncio.run(run())
+    return results
+
+
+# Suffixes of metrics that regress when they grow or when they shrink
+LOWER_IS_BETTER = ("_ms", "_kib", "errors", "locked")
+HIGHER_IS_BETTER = ("_per_second",)
+
+
+def compare(
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    threshold: float,
+    path: str = "",
+) -> List[str]:
+    """List the metrics of ``current`` that are more than ``threshold``
+    percent worse than in ``baseline``.
+
+    Metrics missing from either run are skipped.
+    """
+    regressions = []
+    for key, value in current.items():
+        name = f"{path}.{key}" if path else key
+        base = baseline.get(key)
+        if isinstance(value, dict) and isinstance(base, dict):
+            regressions.extend(compare(base, value, threshold, name))
+            continue
+        if not isinstance(value, (int, float)) or not isinstance(base, (int, float)):
+            continue
+        if key.endswith(HIGHER_IS_BETTER):
+            change = (base - value) / base * 100 if base else 0.0
+        elif key.endswith(LOWER_IS_BETTER):
+            if not base:
+                change = float("inf") if value > base else 0.0
+            else:
+                change = (value - base) / base * 100
+        else:
+            continue
+        if change > threshold:
+            regressions.append(f"{name}: {base} -> {value} ({change:.1f}% worse)")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "benchmarks", nargs="*", help=f"any of {', '.join(BENCHMARKS)} (default: all)"
+    )
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--page-sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument(
+        "--server", action="store_true", help="run crud against a uvicorn process"
+    )
+    parser.add_argument("--output", help="also save results to this file")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASELINE", "CURRENT"),
+        help="compare two saved runs instead of running benchmarks",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=20.0,
+        help="regression threshold of --compare, in percent",
+    )
+    args = parser.parse_args()
+    if args.compare:
+        runs = []
+        for filename in args.compare:
+            with open(filename) as file:
+                runs.append(json.load(file))
+        regressions = compare(*runs, args.threshold)
+        for regression in regressions:
+            print(regression)
+        parser.exit(1 if regressions else 0)
+    benchmarks = args.benchmarks or BENCHMARKS
+    for name in set(benchmarks) - set(BENCHMARKS):
+        parser.error(f"unknown benchmark: {name}")
+
+    results: Dict[str, Any] = {}
+    if "concurrency" in benchmarks:
+        with temporary_database() as database_url:
+            seed(create_engine(database_url), args.size)
+            results["concurrency"] = bench_concurrency(
+                database_url, args.size, args.concurrency, args.requests
+            )
+    if "crud" in benchmarks:
+        with temporary_database() as database_url:
+            results["crud"] = bench_crud(
+                database_url,
+                args.size,
+                args.limit,
+                args.concurrency,
+                args.requests,
+                server=args.server,
+            )
+    if "serialization" in benchmarks:
+        with temporary_database() as database_url:
+            seed(create_engine(database_url), max(args.page_sizes))
+            results["serialization"] = bench_serialization(
+                database_url, args.page_sizes, args.repeat * 5
+            )
+    if "batching" in benchmarks:
+        results["batching"] = bench_batching(args.concurrency, args.requests)
+    if "compression" in benchmarks:
+        with temporary_database() as database_url:
+            seed(create_engine(database_url), max(args.page_sizes))
+            results["compression"] = bench_compression(
+                database_url, args.page_sizes, args.repeat * 5
+            )
+    if "server" in benchmarks:
+        results["server"] = bench_server(
+            args.size, args.limit, args.concurrency, args.requests
+        )
+    if "mixed" in benchmarks:
+        results["mixed"] = bench_mixed(
+            args.size, args.threads, args.seconds, args.write_ratio
+        )
+    if "pagination" in benchmarks:
+        with temporary_database() as database_url:
+            seed(create_engine(database_url), args.size)
+            client = make_client(database_url)
+            results["pagination"] = {
+                "size": args.size,
+                "pages": bench_pagination(client, args.limit, args.pages, args.repeat),
+            }
+    print(json.dumps(results, indent=4))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
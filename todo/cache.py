@@ -0,0 +1,218 @@
+"""
+Response cache. See ``LRUCache`` for the in-process cache and
+``CacheBackend`` for plugging in a shared one.
+"""
+import hashlib
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+__all__ = (
+    "CacheBackend",
+    "CacheEntry",
+    "LRUCache",
+    "ResourceCache",
+    "etag_matches",
+    "http_date",
+    "make_etag",
+    "parse_http_date",
+)
+
+
+class CacheEntry(NamedTuple):
+    """Serialized response."""
+
+    body: bytes
+    etag: str
+    headers: Dict[str, str]
+
+
+def make_etag(body: bytes) -> str:
+    """Make a strong ETag for the given response body."""
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    """Check the value of an ``If-None-Match`` header against an ETag."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        value.strip().removeprefix("W/") == etag for value in if_none_match.split(",")
+    )
+
+
+def http_date(value: datetime) -> str:
+    """Format a datetime (naive ones are taken as UTC) as an HTTP date."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def parse_http_date(value: Optional[str]) -> Optional[datetime]:
+    """Parse an HTTP date, ``None`` if missing or invalid."""
+    if not value:
+        return None
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+class CacheBackend(ABC):
+    """Cache backend interface.
+
+    Implement it to share the cache between processes (for instance on top
+    of Redis). Counters are used to invalidate groups of keys at once and,
+    unlike values, must not be evicted.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        """Get value, ``None`` if missing or expired."""
+
+    @abstractmethod
+    def set(self, key: str, value: Any) -> None:
+        """Set value."""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Delete value, if present."""
+
+    @abstractmethod
+    def counter(self, key: str) -> int:
+        """Get counter value (0 if never incremented)."""
+
+    @abstractmethod
+    def incr(self, key: str) -> int:
+        """Increment counter and return the new value."""
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Cache statistics (hits, misses, evictions, ...)."""
+        return {}
+
+
+class LRUCache(CacheBackend):
+    """In-process, thread safe LRU cache with TTL and size bounds."""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def counter(self, key: str) -> int:
+        return self._counters.get(key, 0)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "size": len(self._data),
+            "max_size": self.max_size,
+        }
+
+
+class ResourceCache:
+    """Responses of a single CRUD resource, stored in a ``CacheBackend``.
+
+    Any write may change any list page (a new row, a row moving in or out
+    of a filter, offsets shifting), so list pages are invalidated together
+    by bumping a counter, which is part of their keys. Detail responses are
+    invalidated by bumping a counter of the item, shared by the items of
+    one of ``stripes`` stripes, so that counters stay bounded.
+
+    Keys are taken before reading the database: a response read before a
+    write, and set after it, is set under a key no longer used rather than
+    served until it expires.
+    """
+
+    stripes = 4096
+
+    def __init__(self, backend: CacheBackend, namespace: str = ""):
+        self.backend = backend
+        self.namespace = namespace
+
+    def _generation(self, name: str) -> int:
+        return self.backend.counter(f"{self.namespace}:{name}")
+
+    def _stripe(self, pk: Any) -> str:
+        # Stable across processes, for shared backends
+        return f"one.{zlib.crc32(str(pk).encode()) % self.stripes}"
+
+    def one_key(self, pk: Any) -> str:
+        generation = f"{self._generation('all')}.{self._generation(self._stripe(pk))}"
+        return f"{self.namespace}:{generation}:one:{pk}"
+
+    def list_key(self, query: str) -> str:
+        generation = f"{self._generation('all')}.{self._generation('list')}"
+        return f"{self.namespace}:{generation}:list:{query}"
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        return self.backend.get(key)
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        self.backend.set(key, entry)
+
+    def invalidate(self, *pks: Any) -> None:
+        """Invalidate the given details and all list pages."""
+        for pk in pks:
+            key = self.one_key(pk)
+            self.backend.incr(f"{self.namespace}:{self._stripe(pk)}")
+            self.backend.delete(key)
+        self.backend.incr(f"{self.namespace}:list")
+
+    def invalidate_all(self) -> None:
+        """Invalidate everything."""
+        self.backend.incr(f"{self.namespace}:all")
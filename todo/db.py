@@ -1,23 +1,106 @@
 """
 Database module. To create database run python db.py.
 """
+from functools import lru_cache
+from typing import Any
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from sqlmodel import SQLModel, create_engine
 
 from models import Item  # noqa
+from settings import (
+    DATABASE_URL,
+    POOL_MAX_OVERFLOW,
+    POOL_SIZE,
+    POOL_TIMEOUT,
+    SQLITE_BUSY_TIMEOUT,
+    SQLITE_CACHE_SIZE,
+    SQLITE_JOURNAL_MODE,
+    SQLITE_MMAP_SIZE,
+    SQLITE_SYNCHRONOUS,
+)
 
 __all__ = (
     "DATABASE_URL",
     "ENGINE",
+    "SQLITE_PRAGMAS",
     "SessionLocal",
     "create_tables",
+    "dispose_engines",
+    "get_async_db",
+    "get_async_sessionmaker",
     "get_db",
+    "make_async_engine",
+    "make_engine",
+)
+
+SQLITE_PRAGMAS = (
+    f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}",
+    f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}",
+    f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}",
+    f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+    f"PRAGMA cache_size={SQLITE_CACHE_SIZE}",
+    "PRAGMA temp_store=MEMORY",
 )
 
 
+def set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """Apply ``SQLITE_PRAGMAS`` to a new connection."""
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+def _is_file_database(url) -> bool:
+    return url.database not in (None, "", ":memory:")
+
+
+def make_engine(url: str = DATABASE_URL, **kwargs: Any) -> Engine:
+    """Make a database engine, tuned for SQLite.
+
+    Connections get ``SQLITE_PRAGMAS`` applied and can be shared between
+    threads. File databases get a connection pool sized by the ``POOL_*``
+    settings. Keyword arguments are passed on to ``create_engine``.
+    """
+    url = make_url(url)
+    if url.get_backend_name() != "sqlite":
+        return create_engine(url, **kwargs)
+
+    kwargs.setdefault("connect_args", {"check_same_thread": False})
+    if _is_file_database(url):
+        kwargs.setdefault("poolclass", QueuePool)
+        kwargs.setdefault("pool_size", POOL_SIZE)
+        kwargs.setdefault("max_overflow", POOL_MAX_OVERFLOW)
+        kwargs.setdefault("pool_timeout", POOL_TIMEOUT)
+    engine = create_engine(url, **kwargs)
+    event.listen(engine, "connect", set_sqlite_pragmas)
+    return engine
+
+
+def make_async_engine(url: str = DATABASE_URL, **kwargs: Any) -> AsyncEngine:
+    """Make an async (``aiosqlite``) database engine, tuned like ``make_engine``."""
+    url = make_url(url)
+    if url.get_backend_name() != "sqlite":
+        return create_async_engine(url, **kwargs)
+
+    url = url.set(drivername="sqlite+aiosqlite")
+    if _is_file_database(url):
+        kwargs.setdefault("poolclass", AsyncAdaptedQueuePool)
+        kwargs.setdefault("pool_size", POOL_SIZE)
+        kwargs.setdefault("max_overflow", POOL_MAX_OVERFLOW)
+        kwargs.setdefault("pool_timeout", POOL_TIMEOUT)
+    engine = create_async_engine(url, **kwargs)
+    event.listen(engine.sync_engine, "connect", set_sqlite_pragmas)
+    return engine
+
+
 # Initialize SQLite database
-DATABASE_URL = "sqlite:///./test.db"
-ENGINE = create_engine(DATABASE_URL)
+ENGINE = make_engine()
 
 # Session to work with
 SessionLocal = sessionmaker(
@@ -42,5 +125,41 @@ def get_db():
         session.close()
 
 
+@lru_cache()
+def get_async_sessionmaker():
+    """Get async session factory.
+
+    The async engine is created on first use, so that ``aiosqlite`` is
+    only required when the async mode is on.
+    """
+    return sessionmaker(
+        make_async_engine(),
+        class_=AsyncSession,
+        autocommit=False,
+        autoflush=False,
+        expire_on_commit=False,
+    )
+
+
+async def get_async_db():
+    """Get async database connection."""
+    session = get_async_sessionmaker()()
+    try:
+        yield session
+        await session.commit()
+    finally:
+        await session.close()
+
+
+async def dispose_engines() -> None:
+    """Close the pooled connections of the engines (on shutdown).
+
+    The last connection to a WAL database to close checkpoints it.
+    """
+    ENGINE.dispose()
+    if get_async_sessionmaker.cache_info().currsize:
+        await get_async_sessionmaker().kw["bind"].dispose()
+
+
 if __name__ == "__main__":
     create_tables()
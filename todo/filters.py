@@ -0,0 +1,16 @@
+"""
+List filters.
+"""
+from typing import Any, List, Optional
+
+from models import Item
+
+__all__ = ("item_filters",)
+
+
+def item_filters(complete: Optional[bool] = None) -> List[Any]:
+    """Item filters."""
+    clauses = []
+    if complete is not None:
+        clauses.append(Item.complete == complete)
+    return clauses
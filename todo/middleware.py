@@ -0,0 +1,230 @@
+"""
+HTTP middleware. See ``CompressionMiddleware`` for response compression and
+``ConditionalGetMiddleware`` for ``If-Modified-Since`` handling.
+"""
+import zlib
+from typing import Dict, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from cache import parse_http_date
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+__all__ = (
+    "COMPRESSIBLE_MEDIA_TYPES",
+    "CompressionMiddleware",
+    "ConditionalGetMiddleware",
+    "parse_accept_encoding",
+)
+
+COMPRESSIBLE_MEDIA_TYPES = (
+    "application/javascript",
+    "application/json",
+    "application/x-ndjson",
+    "application/xml",
+    "image/svg+xml",
+    "text/",
+)
+
+
+def parse_accept_encoding(value: str) -> Dict[str, float]:
+    """Parse an ``Accept-Encoding`` header into quality values per coding."""
+    encodings = {}
+    for item in value.split(","):
+        name, *params = item.split(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, number = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        encodings[name] = quality
+    return encodings
+
+
+class GzipCompressor:
+    """Streaming gzip compressor."""
+
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes, finish: bool) -> bytes:
+        flush = zlib.Z_FINISH if finish else zlib.Z_SYNC_FLUSH
+        return self._compressor.compress(data) + self._compressor.flush(flush)
+
+
+class BrotliCompressor:
+    """Streaming brotli compressor."""
+
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes, finish: bool) -> bytes:
+        compressed = self._compressor.process(data)
+        if finish:
+            return compressed + self._compressor.finish()
+        return compressed + self._compressor.flush()
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing responses, with brotli (if installed) or
+    gzip, whichever the client accepts (brotli preferred on a tie).
+
+    Only bodies of ``minimum_size`` bytes or more, of text-like media types
+    (see ``COMPRESSIBLE_MEDIA_TYPES``) are compressed. Streamed bodies are
+    compressed and flushed chunk by chunk. Strong ETags are made weak, as
+    the compressed body is no longer byte for byte the same.
+    """
+
+    def __init__(
+        self,
+        app,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_level: int = 4,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compressors = {"gzip": lambda: GzipCompressor(gzip_level)}
+        if brotli is not None:
+            self.compressors["br"] = lambda: BrotliCompressor(brotli_level)
+
+    def select_encoding(self, accept_encoding: str) -> Optional[str]:
+        """Content coding to use for an ``Accept-Encoding`` header value."""
+        accepted = parse_accept_encoding(accept_encoding)
+        quality, _, name = max(
+            (accepted.get(name, accepted.get("*", 0.0)), name == "br", name)
+            for name in self.compressors
+        )
+        return name if quality > 0 else None
+
+    @staticmethod
+    def compressible(message) -> bool:
+        headers = Headers(raw=message["headers"])
+        media_type = headers.get("content-type", "")
+        return (
+            message["status"] not in (204, 304)
+            and "content-encoding" not in headers
+            and media_type.startswith(COMPRESSIBLE_MEDIA_TYPES)
+        )
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = self.select_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor = None
+
+        async def send_compressed(message) -> None:
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                # Held back until the size of the body is known
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is not None:
+                response_start, start = start, None
+                if not self.compressible(response_start) or (
+                    not more_body and len(body) < self.minimum_size
+                ):
+                    await send(response_start)
+                    await send(message)
+                    return
+                compressor = self.compressors[encoding]()
+                headers = MutableHeaders(scope=response_start)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = f"W/{etag}"
+                body = compressor.compress(body, finish=not more_body)
+                if more_body:
+                    del headers["Content-Length"]
+                else:
+                    headers["Content-Length"] = str(len(body))
+                await send(response_start)
+            elif compressor is not None:
+                body = compressor.compress(body, finish=not more_body)
+            else:
+                await send(message)
+                return
+            await send(
+                {"type": "http.response.body", "body": body, "more_body": more_body}
+            )
+
+        await self.app(scope, receive, send_compressed)
+
+
+class ConditionalGetMiddleware:
+    """ASGI middleware answering ``GET`` and ``HEAD`` requests with a 304
+    when the ``Last-Modified`` date of the response is not after the
+    ``If-Modified-Since`` date of the request.
+
+    As ``If-None-Match`` takes precedence, requests with it are left alone
+    (see ``crud.CRUDRouter`` for ETags).
+    """
+
+    # Headers a 304 must not carry
+    STRIPPED_HEADERS = (b"content-length", b"content-type")
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        since = parse_http_date(headers.get("if-modified-since"))
+        if since is None or "if-none-match" in headers:
+            await self.app(scope, receive, send)
+            return
+
+        not_modified = False
+
+        async def send_conditional(message) -> None:
+            nonlocal not_modified
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                last_modified = parse_http_date(
+                    Headers(raw=message["headers"]).get("last-modified")
+                )
+                if last_modified is not None and last_modified <= since:
+                    not_modified = True
+                    await send(
+                        {
+                            "type": "http.response.start",
+                            "status": 304,
+                            "headers": [
+                                (name, value)
+                                for name, value in message["headers"]
+                                if name.lower() not in self.STRIPPED_HEADERS
+                            ],
+                        }
+                    )
+                    return
+            if not_modified and message["type"] == "http.response.body":
+                if not message.get("more_body", False):
+                    await send({"type": "http.response.body", "body": b""})
+                return
+            await send(message)
+
+        await self.app(scope, receive, send_conditional)
@@ -1,20 +1,46 @@
-from typing import Optional
+from datetime import datetime
+from typing import Any, Optional, Tuple
 
+from pydantic import validator
+from sqlalchemy import DDL, event, func
 from sqlmodel import Field, SQLModel
 
 __all__ = (
     "Item",
+    "ItemChange",
     "ItemCreate",
+    "ItemPatch",
     "ItemUpdate",
+    "ITEM_CHANGES_DDL",
 )
 
 
+def check_not_null(cls, value: Any) -> Any:
+    """Validator of fields optional in a patch, but not nullable."""
+    if value is None:
+        raise ValueError("none is not an allowed value")
+    return value
+
+
 class Item(SQLModel, table=True):
     """This is the model connected to the database."""
 
     id: Optional[int] = Field(default=None, primary_key=True)
     title: str
-    complete: bool = True
+    complete: bool = Field(default=True, index=True)
+    # Incremented by every update, for optimistic concurrency control
+    version: int = Field(default=1, sa_column_kwargs={"server_default": "1"})
+    # Last modification time (UTC), for Last-Modified headers
+    updated_at: Optional[datetime] = Field(
+        default=None,
+        sa_column_kwargs={
+            # Set by inserts too, as SQLite cannot add the column with this
+            # server default to existing tables (see the migrations)
+            "default": func.current_timestamp(),
+            "server_default": func.current_timestamp(),
+            "onupdate": func.current_timestamp(),
+        },
+    )
 
 
 class ItemCreate(SQLModel, table=False):
@@ -26,3 +52,72 @@ class ItemCreate(SQLModel, table=False):
 
 class ItemUpdate(ItemCreate):
     """This is the model, used mainly for serialization of inputs on update."""
+
+
+class ItemPatch(SQLModel, table=False):
+    """This is the model, used for serialization of inputs on partial update.
+
+    Only the given fields are updated; if ``version`` is given, only if it
+    is still the current version.
+    """
+
+    title: Optional[str] = None
+    complete: Optional[bool] = None
+    version: Optional[int] = None
+
+    # Only ``version`` may be null (no version check)
+    _check_not_null = validator("title", "complete", pre=True, allow_reuse=True)(
+        check_not_null
+    )
+
+
+class ItemChange(SQLModel, table=True):
+    """Change log of item: the last change of every item (including deleted
+    ones), by sequence number. Maintained by triggers, in the transaction
+    of the change. See ``crud.CRUDRouter``."""
+
+    __tablename__ = "item_change"
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq: Optional[int] = Field(default=None, primary_key=True)
+    # No foreign key: the entries of deleted items are kept (tombstones)
+    item_id: int = Field(unique=True)
+    op: str
+
+
+def sync_change_log(model) -> Tuple[str, ...]:
+    """Log every insert, update and delete of item in a change log table.
+
+    A change replaces the previous entry of the same item, with a new (ever
+    increasing) sequence number, so that the log holds one entry per item.
+    Triggers are created (and existing items logged as created) right after
+    the table is created. The statements are returned.
+    """
+    table = model.__tablename__
+
+    def log(op: str, row: str) -> str:
+        return f"REPLACE INTO {table} (item_id, op) VALUES ({row}.id, '{op}');"
+
+    statements = (
+        f"CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON item "
+        f"BEGIN {log('create', 'new')} END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_au AFTER UPDATE ON item "
+        f"BEGIN {log('update', 'new')} END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON item "
+        f"BEGIN {log('delete', 'old')} END",
+        f"INSERT INTO {table} (item_id, op) SELECT id, 'create' FROM item "
+        f"WHERE id NOT IN (SELECT item_id FROM {table}) ORDER BY id",
+    )
+    # The triggers are on item, which must be created first
+    model.__table__.add_is_dependent_on(Item.__table__)
+    for statement in statements:
+        event.listen(
+            model.__table__,
+            "after_create",
+            DDL(statement).execute_if(dialect="sqlite"),
+        )
+    return statements
+
+
+# Change log for incremental sync (``/changes`` routes of ``crud.py``)
+ITEM_CHANGES_DDL = sync_change_log(ItemChange)
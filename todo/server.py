@@ -0,0 +1,121 @@
+"""
+Production server. To run the API with several workers run python server.py.
+
+Unlike ``make run`` (a single process with auto reload and debug
+tracebacks), it runs ``WORKERS`` processes (default: one per CPU), with
+uvloop and httptools if installed and without access logs. Debug and docs
+follow ``FORANA_DEBUG`` (default off) and ``FORANA_DOCS``. On SIGTERM or
+SIGINT, workers stop accepting connections and finish the requests in
+flight for up to ``GRACEFUL_TIMEOUT`` seconds.
+"""
+import argparse
+import logging
+import os
+from typing import Any, Dict
+
+import uvicorn
+from sqlalchemy.engine import make_url
+
+from db import ENGINE, create_tables
+from settings import (
+    ACCESS_LOG,
+    BACKLOG,
+    CACHE,
+    DATABASE_URL,
+    GRACEFUL_TIMEOUT,
+    HOST,
+    KEEP_ALIVE,
+    LOG_LEVEL,
+    METRICS,
+    PORT,
+    SQLITE_JOURNAL_MODE,
+    WORKERS,
+)
+
+__all__ = (
+    "server_options",
+    "worker_count",
+)
+
+logger = logging.getLogger(__name__)
+
+
+def worker_count(
+    workers: int = WORKERS,
+    database_url: str = DATABASE_URL,
+    journal_mode: str = SQLITE_JOURNAL_MODE,
+) -> int:
+    """Number of worker processes: ``workers``, or one per CPU if 0.
+
+    SQLite allows a single writer at a time. In WAL mode readers are not
+    blocked by it and writers of other workers wait for it (up to
+    ``SQLITE_BUSY_TIMEOUT``), so any number of workers is fine. In other
+    journal modes writers block readers too, and in-memory databases are
+    not shared between processes, so a single worker is run.
+    """
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    url = make_url(database_url)
+    if url.get_backend_name() == "sqlite" and workers > 1:
+        if url.database in (None, "", ":memory:"):
+            logger.warning("In-memory SQLite database: running a single worker")
+            return 1
+        if journal_mode.upper() != "WAL":
+            logger.warning(
+                "SQLite journal mode %s is not WAL: running a single worker",
+                journal_mode,
+            )
+            return 1
+    return workers
+
+
+def server_options(
+    host: str = HOST, port: int = PORT, workers: int = 1
+) -> Dict[str, Any]:
+    """Keyword arguments of ``uvicorn.run``."""
+    return {
+        "host": host,
+        "port": port,
+        "workers": workers,
+        # uvloop and httptools if installed, asyncio and h11 otherwise
+        "loop": "auto",
+        "http": "auto",
+        "backlog": BACKLOG,
+        "timeout_keep_alive": KEEP_ALIVE,
+        "timeout_graceful_shutdown": GRACEFUL_TIMEOUT,
+        "access_log": ACCESS_LOG,
+        "log_level": LOG_LEVEL,
+        "proxy_headers": True,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the API in production mode.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument(
+        "--workers", type=int, default=WORKERS, help="0 for one per CPU"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=LOG_LEVEL.upper())
+
+    workers = worker_count(args.workers)
+    if workers > 1 and CACHE:
+        logger.warning(
+            "The response cache is per worker: a write invalidates the cache "
+            "of the worker handling it only, others may serve stale responses "
+            "for up to FORANA_CACHE_TTL seconds"
+        )
+    if workers > 1 and METRICS:
+        logger.info("Metrics on /metrics are per worker")
+
+    # Tables, triggers and the WAL journal mode are set up once, before the
+    # workers start, rather than concurrently by each of them
+    create_tables()
+    ENGINE.dispose()
+
+    uvicorn.run("api:app", **server_options(args.host, args.port, workers))
+
+
+if __name__ == "__main__":
+    main()
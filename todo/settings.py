@@ -0,0 +1,155 @@
+"""
+Settings. Every setting can be overridden by an environment variable of
+the same name, prefixed with ``FORANA_`` (for instance ``FORANA_ASYNC=1``).
+"""
+import os
+
+__all__ = (
+    "ACCESS_LOG",
+    "ADMIN",
+    "ASYNC",
+    "BACKLOG",
+    "BATCH_INTERVAL",
+    "BATCH_MAX_SIZE",
+    "BATCH_SYNCHRONOUS",
+    "BATCH_WRITES",
+    "BROTLI_LEVEL",
+    "CACHE",
+    "CACHE_CONTROL",
+    "CACHE_MAX_SIZE",
+    "CACHE_TTL",
+    "CHANGES_POLL_INTERVAL",
+    "CHANGES_STREAM_TIMEOUT",
+    "COMPRESSION",
+    "COMPRESSION_MIN_SIZE",
+    "DATABASE_URL",
+    "DEBUG",
+    "DOCS",
+    "FAST_JSON",
+    "GRACEFUL_TIMEOUT",
+    "GZIP_LEVEL",
+    "HOST",
+    "KEEP_ALIVE",
+    "LOG_LEVEL",
+    "METRICS",
+    "N_PLUS_ONE_THRESHOLD",
+    "PORT",
+    "POOL_MAX_OVERFLOW",
+    "POOL_SIZE",
+    "POOL_TIMEOUT",
+    "SQLITE_BUSY_TIMEOUT",
+    "SQLITE_CACHE_SIZE",
+    "SQLITE_JOURNAL_MODE",
+    "SQLITE_MMAP_SIZE",
+    "SQLITE_SYNCHRONOUS",
+    "WORKERS",
+    "env_bool",
+    "env_float",
+    "env_int",
+    "env_str",
+)
+
+
+def env_bool(name: str, default: bool = False) -> bool:
+    """Read a boolean setting from the environment."""
+    value = os.environ.get(f"FORANA_{name}")
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+def env_str(name: str, default: str) -> str:
+    """Read a string setting from the environment."""
+    return os.environ.get(f"FORANA_{name}", default)
+
+
+def env_int(name: str, default: int) -> int:
+    """Read an integer setting from the environment."""
+    return int(os.environ.get(f"FORANA_{name}", default))
+
+
+def env_float(name: str, default: float) -> float:
+    """Read a float setting from the environment."""
+    return float(os.environ.get(f"FORANA_{name}", default))
+
+
+DATABASE_URL = env_str("DATABASE_URL", "sqlite:///./test.db")
+
+# Connection pool of file databases
+POOL_SIZE = env_int("POOL_SIZE", 10)
+POOL_MAX_OVERFLOW = env_int("POOL_MAX_OVERFLOW", 20)
+POOL_TIMEOUT = env_float("POOL_TIMEOUT", 30.0)
+
+# SQLite pragmas applied to every new connection. WAL lets readers run
+# concurrently with the (single) writer and, with ``synchronous=NORMAL``,
+# only fsyncs on checkpoints. ``busy_timeout`` is in milliseconds,
+# ``mmap_size`` in bytes and a negative ``cache_size`` in KiB.
+SQLITE_JOURNAL_MODE = env_str("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = env_str("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT = env_int("SQLITE_BUSY_TIMEOUT", 5000)
+SQLITE_MMAP_SIZE = env_int("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)
+SQLITE_CACHE_SIZE = env_int("SQLITE_CACHE_SIZE", -64 * 1024)
+
+# Serve CRUD routes from an async engine (requires ``aiosqlite``)
+ASYNC = env_bool("ASYNC")
+
+
+# Serialize list and detail responses straight from rows (faster with
+# ``orjson``), skipping response model validation
+FAST_JSON = env_bool("FAST_JSON")
+
+# Write-behind batching: creates are queued and committed together, every
+# ``BATCH_INTERVAL`` milliseconds or ``BATCH_MAX_SIZE`` rows. Responses are
+# sent once the batch is committed, with the ``synchronous`` pragma
+# ``BATCH_SYNCHRONOUS`` (``FULL``: durable, ``NORMAL``: may lose the last
+# batches on a power loss).
+BATCH_WRITES = env_bool("BATCH_WRITES")
+BATCH_MAX_SIZE = env_int("BATCH_MAX_SIZE", 500)
+BATCH_INTERVAL = env_float("BATCH_INTERVAL", 5.0)
+BATCH_SYNCHRONOUS = env_str("BATCH_SYNCHRONOUS", "FULL")
+
+# Change feed (``/changes/stream``): the change log is polled every
+# ``CHANGES_POLL_INTERVAL`` seconds, and streams end (clients reconnect)
+# after ``CHANGES_STREAM_TIMEOUT`` seconds
+CHANGES_POLL_INTERVAL = env_float("CHANGES_POLL_INTERVAL", 1.0)
+CHANGES_STREAM_TIMEOUT = env_float("CHANGES_STREAM_TIMEOUT", 300.0)
+
+# In-process response cache of the list and detail routes
+CACHE = env_bool("CACHE")
+CACHE_MAX_SIZE = env_int("CACHE_MAX_SIZE", 1024)
+CACHE_TTL = env_float("CACHE_TTL", 60.0)
+
+# HTTP caching: ``Cache-Control`` header of the list and detail routes
+CACHE_CONTROL = env_str("CACHE_CONTROL", "no-cache")
+
+# Compression (brotli, if installed, or gzip) of responses of at least
+# ``COMPRESSION_MIN_SIZE`` bytes. Levels go from 1 (fastest) to 9 for gzip
+# and from 0 to 11 for brotli.
+COMPRESSION = env_bool("COMPRESSION", True)
+COMPRESSION_MIN_SIZE = env_int("COMPRESSION_MIN_SIZE", 1024)
+GZIP_LEVEL = env_int("GZIP_LEVEL", 6)
+BROTLI_LEVEL = env_int("BROTLI_LEVEL", 4)
+
+# Per request instrumentation (``Server-Timing`` headers and ``/metrics``).
+# Statements run at least ``N_PLUS_ONE_THRESHOLD`` times in a request are
+# reported as N+1 queries.
+METRICS = env_bool("METRICS", True)
+N_PLUS_ONE_THRESHOLD = env_int("N_PLUS_ONE_THRESHOLD", 10)
+
+# Admin interface on ``/admin``
+ADMIN = env_bool("ADMIN", True)
+
+# FastAPI debug mode (tracebacks in error responses) and OpenAPI docs
+DEBUG = env_bool("DEBUG")
+DOCS = env_bool("DOCS", True)
+
+# Production server (``server.py``). ``WORKERS=0`` runs a worker per CPU.
+# ``KEEP_ALIVE`` and ``GRACEFUL_TIMEOUT`` are in seconds.
+HOST = env_str("HOST", "0.0.0.0")
+PORT = env_int("PORT", 8000)
+WORKERS = env_int("WORKERS", 0)
+BACKLOG = env_int("BACKLOG", 2048)
+KEEP_ALIVE = env_int("KEEP_ALIVE", 5)
+GRACEFUL_TIMEOUT = env_int("GRACEFUL_TIMEOUT", 30)
+ACCESS_LOG = env_bool("ACCESS_LOG")
+LOG_LEVEL = env_str("LOG_LEVEL", "info")
@@ -1,50 +1,155 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
 
+import httpx
 from fake import FAKER
+from fastapi import APIRouter, FastAPI
 from fastapi.testclient import TestClient
-from sqlalchemy.orm import sessionmaker
-from sqlmodel import Session, SQLModel, create_engine
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, SQLModel
 
+from admin import LazyAdmin, create_admin
+from alembic import command
+from alembic.config import Config
 from api import app  # noqa
-from db import get_db  # noqa
-from models import Item  # noqa
+from batching import WriteBatcher
+from benchmarks import bench_crud, compare, make_rows
+from cache import CacheEntry, LRUCache, ResourceCache
+from crud import AsyncCRUDRouter, CRUDRouter, encode_cursor
+from db import get_db, make_async_engine, make_engine  # noqa
+from metrics import InstrumentedRoute, Metrics, MetricsMiddleware
+from middleware import CompressionMiddleware
+from models import Item, ItemChange, ItemCreate, ItemPatch, ItemUpdate  # noqa
+from server import server_options, worker_count
+from testing import TEST_DATABASE, CommitTestCase, DatabaseTestCase
 
-__all__ = ("ApiTestCase",)
+__all__ = (
+    "ApiTestCase",
+    "AsyncApiTestCase",
+    "BatchingTestCase",
+    "BenchmarksTestCase",
+    "CacheTestCase",
+    "EngineTestCase",
+    "FastJsonTestCase",
+    "HttpTestCase",
+    "MetricsTestCase",
+    "ServerTestCase",
+)
+
+# Budget of a cold start (import of the app to the response of the first
+# request) of a worker, in CPU time so that it holds on a loaded machine
+# (tests running in parallel)
+STARTUP_TIME_BUDGET = 2.0  # seconds
+STARTUP_RSS_BUDGET = 80  # MiB
+STARTUP_SCRIPT = """
+import json, resource, sys, time
+from fastapi.testclient import TestClient
+start = time.process_time()
+from api import app
+TestClient(app).get("/")
+end = time.process_time()
+try:
+    # Peak RSS of this process (ru_maxrss may be the one of the parent)
+    with open("/proc/self/status") as status:
+        rss = next(int(line.split()[1]) for line in status if line.startswith("VmHWM"))
+except OSError:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss //= 1024 if sys.platform == "darwin" else 1
+print(json.dumps({
+    "time": end - start,
+    "rss": rss / 1024,
+    "admin": any(name.startswith("starlette_admin") for name in sys.modules),
+}))
+"""
 
-# Database connection config
-TEST_DATABASE_URL = "sqlite:///./test_test.db"
-TEST_ENGINE = create_engine(
-    TEST_DATABASE_URL, connect_args={"check_same_thread": False}
+# Size of the database the migrations are timed on. Run with
+# ``FORANA_TEST_MIGRATION_ROWS=1000000`` (``make test-migrations``) for the
+# full size check.
+MIGRATION_ROWS = int(os.environ.get("FORANA_TEST_MIGRATION_ROWS", 10_000))
+MIGRATION_TIME_BUDGET = 30.0  # seconds
+# Item table as created before migrations
+LEGACY_ITEM_TABLE = """
+CREATE TABLE item (
+    id INTEGER NOT NULL PRIMARY KEY,
+    title VARCHAR NOT NULL,
+    complete BOOLEAN NOT NULL
 )
-SessionLocalTest = sessionmaker(autocommit=False, autoflush=False, bind=TEST_ENGINE)
+"""
 
+# Test database, see ``testing``
+# Apply the patch for tests
+app.dependency_overrides[get_db] = TEST_DATABASE.get_db
 
-# Override the get_db dependency to use the test database
-def override_get_db():
-    db = None
-    try:
-        db = SessionLocalTest()
-        yield db
-    finally:
-        if db:
-            db.close()
+# Async mode app, running on the same test database
+async_app = FastAPI()
+async_app.include_router(
+    AsyncCRUDRouter(
+        schema=Item,
+        create_schema=ItemCreate,
+        update_schema=ItemUpdate,
+        db_model=Item,
+        db=TEST_DATABASE.get_async_db,
+        upsert_key="title",
+        patch_schema=ItemPatch,
+        version_key="version",
+        change_model=ItemChange,
+        changes_poll_interval=0.05,
+        changes_stream_timeout=0.2,
+    ),
+    prefix="/api",
+)
 
+# Cached app, running on the same test database
+TEST_CACHE = LRUCache(max_size=16, ttl=60)
+cached_app = FastAPI()
+cached_app.include_router(
+    CRUDRouter(
+        schema=Item,
+        create_schema=ItemCreate,
+        update_schema=ItemUpdate,
+        db_model=Item,
+        db=TEST_DATABASE.get_db,
+        cache=TEST_CACHE,
+        patch_schema=ItemPatch,
+    ),
+    prefix="/api",
+)
 
-# Apply the patch for tests
-app.dependency_overrides[get_db] = override_get_db
+# Fast JSON app, running on the same test database
+fast_app = FastAPI()
+for prefix, router_class, db in (
+    ("/api", CRUDRouter, TEST_DATABASE.get_db),
+    ("/async", AsyncCRUDRouter, TEST_DATABASE.get_async_db),
+):
+    fast_app.include_router(
+        router_class(
+            schema=Item,
+            create_schema=ItemCreate,
+            update_schema=ItemUpdate,
+            db_model=Item,
+            db=db,
+            cache=LRUCache(max_size=16, ttl=60),
+            fast_json=True,
+        ),
+        prefix=prefix,
+    )
 
 
-class ApiTestCase(unittest.TestCase):
+class ApiTestCase(DatabaseTestCase):
     """API test cases."""
 
-    def setUp(self):
-        """Set up test environment. Runs before each test."""
-        self.client = TestClient(app)
-        SQLModel.metadata.create_all(TEST_ENGINE)
-
-    def tearDown(self):
-        """Tear down test environment. Runs after each test."""
-        SQLModel.metadata.drop_all(TEST_ENGINE)
+    @classmethod
+    def setUpClass(cls):
+        """Set up test environment. Runs once, before the tests."""
+        super().setUpClass()
+        cls.client = TestClient(app)
 
     def test_post(self) -> None:
         """Test HTTP POST method."""
@@ -64,7 +169,7 @@ class ApiTestCase(unittest.TestCase):
             "published": FAKER.pybool(),
         }
         item = Item(**data)
-        with Session(TEST_ENGINE) as session:
+        with TEST_DATABASE.session() as session:
             session.add(item)
             session.commit()
             session.refresh(item)
@@ -80,7 +185,7 @@ class ApiTestCase(unittest.TestCase):
             "published": FAKER.pybool(),
         }
         item = Item(**data)
-        with Session(TEST_ENGINE) as session:
+        with TEST_DATABASE.session() as session:
             session.add(item)
             session.commit()
             session.refresh(item)
@@ -99,7 +204,7 @@ class ApiTestCase(unittest.TestCase):
             "published": FAKER.pybool(),
         }
         item = Item(**data)
-        with Session(TEST_ENGINE) as session:
+        with TEST_DATABASE.session() as session:
             session.add(item)
             session.commit()
             session.refresh(item)
@@ -107,7 +212,7 @@ class ApiTestCase(unittest.TestCase):
         response = self.client.delete(f"/api/item/{item.id}")
         self.assertEqual(response.status_code, 200)
 
-        with Session(TEST_ENGINE) as session:
+        with TEST_DATABASE.session() as session:
             deleted_item = session.get(Item, item.id)
             self.assertIsNone(deleted_item)
 
@@ -118,7 +223,7 @@ class ApiTestCase(unittest.TestCase):
             "published": FAKER.pybool(),
         }
         item = Item(**data)
-        with Session(TEST_ENGINE) as session:
+        with TEST_DATABASE.session() as session:
             session.add(item)
             session.commit()
             session.refresh(item)
@@ -133,6 +238,1037 @@ class ApiTestCase(unittest.TestCase):
         )
         self.assertEqual(response.status_code, 200)
 
-        with Session(TEST_ENGINE) as session:
+        with TEST_DATABASE.session() as session:
             updated_post = session.get(Item, item.id)
             self.assertEqual(updated_post.title, new_data["title"])
+
+    def test_patch(self) -> None:
+        """Test HTTP PATCH method (partial and conditional updates)."""
+        item = Item(title=FAKER.sentence(), complete=False)
+        with TEST_DATABASE.session() as session:
+            session.add(item)
+            session.commit()
+            session.refresh(item)
+        self.assertEqual(item.version, 1)
+
+        response = self.client.patch(f"/api/item/{item.id}", json={"complete": True})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["title"], item.title)
+        self.assertTrue(response.json()["complete"])
+        self.assertEqual(response.json()["version"], 2)
+
+        # Only updated if still at the given version
+        response = self.client.patch(
+            f"/api/item/{item.id}", json={"complete": False, "version": 1}
+        )
+        self.assertEqual(response.status_code, 412)
+        response = self.client.patch(
+            f"/api/item/{item.id}", json={"complete": False, "version": 2}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json()["complete"])
+        self.assertEqual(response.json()["version"], 3)
+
+        # Full updates increment the version too
+        response = self.client.put(
+            f"/api/item/{item.id}", json={"title": FAKER.sentence(), "complete": True}
+        )
+        self.assertEqual(response.json()["version"], 4)
+
+        response = self.client.patch("/api/item/0", json={"complete": True})
+        self.assertEqual(response.status_code, 404)
+
+        # Fields cannot be nulled, and a patch must change some
+        response = self.client.patch(f"/api/item/{item.id}", json={"title": None})
+        self.assertEqual(response.status_code, 422)
+        self.assertNotIn("IntegrityError", response.text)
+        for body in ({}, {"version": 4}):
+            response = self.client.patch(f"/api/item/{item.id}", json=body)
+            self.assertEqual(response.status_code, 400)
+        response = self.client.get(f"/api/item/{item.id}")
+        self.assertEqual(response.json()["version"], 4)
+
+    def test_get_all_cursor(self) -> None:
+        """Test HTTP GET method (retrieve all records, cursor pagination)."""
+        with TEST_DATABASE.session() as session:
+            for _ in range(5):
+                session.add(Item(title=FAKER.sentence()))
+            session.commit()
+
+        ids = []
+        response = self.client.get("/api/item", params={"limit": 2})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids.extend(item["id"] for item in response.json())
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+            response = self.client.get(
+                "/api/item", params={"limit": 2, "cursor": cursor}
+            )
+
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(ids), 5)
+
+        response = self.client.get("/api/item", params={"cursor": "invalid"})
+        self.assertEqual(response.status_code, 400)
+        # Well-formed, but not a primary key
+        for pk in ([1], {"a": 1}, None, True, 1.5, "1", 2**64):
+            response = self.client.get(
+                "/api/item", params={"cursor": encode_cursor(pk)}
+            )
+            self.assertEqual(response.status_code, 400, pk)
+            self.assertEqual(response.json()["detail"], "Invalid cursor")
+
+    def test_export(self) -> None:
+        """Test HTTP GET method (NDJSON export option)."""
+        with TEST_DATABASE.session() as session:
+            for _ in range(3):
+                session.add(Item(title=FAKER.sentence()))
+            session.commit()
+
+        response = self.client.get("/api/item/export.ndjson")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(
+            response.headers["content-type"].startswith("application/x-ndjson")
+        )
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual(len(rows), 3)
+        self.assertIn("complete", rows[0])
+
+    def test_bulk_create(self) -> None:
+        """Test HTTP POST method (bulk create option)."""
+        data = [
+            {"title": FAKER.sentence(), "complete": FAKER.pybool()} for _ in range(5)
+        ]
+        response = self.client.post(
+            "/api/item/bulk", params={"chunk_size": 2}, json=data
+        )
+        self.assertEqual(response.status_code, 200)
+        response_data = response.json()
+        self.assertEqual(response_data["created"], 5)
+        self.assertEqual(len(response_data["chunks"]), 3)
+
+        # Upsert on title, sent as NDJSON
+        data[0]["complete"] = not data[0]["complete"]
+        data.append({"title": FAKER.sentence(), "complete": False})
+        response = self.client.post(
+            "/api/item/bulk",
+            params={"upsert": True},
+            content="\n".join(json.dumps(item) for item in data[:1] + data[5:]),
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+        self.assertEqual(response.status_code, 200)
+        response_data = response.json()
+        self.assertEqual(response_data["created"], 1)
+        self.assertEqual(response_data["updated"], 1)
+
+        with TEST_DATABASE.session() as session:
+            self.assertEqual(session.query(Item).count(), 6)
+            item = session.query(Item).filter_by(title=data[0]["title"]).one()
+            self.assertEqual(item.complete, data[0]["complete"])
+
+        response = self.client.post("/api/item/bulk", json={"title": "Title"})
+        self.assertEqual(response.status_code, 400)
+
+        # The chunks before an invalid record are committed
+        response = self.client.post(
+            "/api/item/bulk",
+            params={"chunk_size": 2},
+            json=make_rows(10, 15) + [{"complete": True}],
+        )
+        self.assertEqual(response.status_code, 422)
+        error = response.json()["detail"][0]
+        self.assertEqual((error["index"], error["committed"]), (5, 4))
+        with TEST_DATABASE.session() as session:
+            self.assertEqual(session.query(Item).count(), 10)
+
+    def test_get_all_filters(self) -> None:
+        """Test HTTP GET method (retrieve all records, filters option)."""
+        self.client.post("/api/item/bulk", json=make_rows(0, 5))
+        for complete, titles in (
+            (True, ["Item 1", "Item 3"]),
+            (False, ["Item 0", "Item 2", "Item 4"]),
+        ):
+            response = self.client.get("/api/item", params={"complete": complete})
+            self.assertEqual([item["title"] for item in response.json()], titles)
+
+    def test_bulk_delete(self) -> None:
+        """Test HTTP DELETE method (bulk delete by filter option)."""
+        self.client.post("/api/item/bulk", json=make_rows(0, 10))
+        response = self.client.delete(
+            "/api/item/bulk", params={"complete": True, "chunk_size": 2}
+        )
+        self.assertEqual(response.status_code, 200)
+        response_data = response.json()
+        self.assertEqual(response_data["deleted"], 5)
+        self.assertEqual(
+            [chunk["deleted"] for chunk in response_data["chunks"]], [2, 2, 1]
+        )
+
+        response = self.client.get("/api/item")
+        self.assertEqual({item["complete"] for item in response.json()}, {False})
+        self.assertEqual(len(response.json()), 5)
+
+        # Deleting everything takes DELETE /api/item
+        response = self.client.delete("/api/item/bulk")
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_patch(self) -> None:
+        """Test HTTP PATCH method (bulk update by filter option)."""
+        self.client.post("/api/item/bulk", json=make_rows(0, 10))
+        response = self.client.patch(
+            "/api/item/bulk",
+            params={"complete": False, "chunk_size": 3},
+            json={"complete": True},
+        )
+        self.assertEqual(response.status_code, 200)
+        response_data = response.json()
+        self.assertEqual(response_data["updated"], 5)
+        self.assertEqual(len(response_data["chunks"]), 2)
+
+        items = self.client.get("/api/item").json()
+        self.assertEqual({item["complete"] for item in items}, {True})
+        self.assertEqual([item["version"] for item in items], [2, 1] * 5)
+
+        response = self.client.patch(
+            "/api/item/bulk", params={"complete": True}, json={}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_batch(self) -> None:
+        """Test HTTP GET and POST methods (batch of ids option)."""
+        self.client.post("/api/item/bulk", json=make_rows(0, 5))
+
+        response = self.client.get("/api/item/batch", params={"ids": "3, 1,404,3"})
+        self.assertEqual(response.status_code, 200)
+        response_data = response.json()
+        self.assertEqual(
+            response_data["records"],
+            [self.client.get(f"/api/item/{pk}").json() for pk in (3, 1)],
+        )
+        self.assertEqual(response_data["missing"], [404])
+
+        response = self.client.post("/api/item/batch", json={"ids": [5, 4, 6]})
+        self.assertEqual(response.status_code, 200)
+        response_data = response.json()
+        self.assertEqual([item["id"] for item in response_data["records"]], [5, 4])
+        self.assertEqual(response_data["missing"], [6])
+
+        response = self.client.get("/api/item/batch", params={"ids": "1,x"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get("/api/item/batch", params={"ids": ","})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            "/api/item/batch", json={"ids": list(range(1, 1002))}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_changes(self) -> None:
+        """Test HTTP GET method (change feed option)."""
+        self.client.post("/api/item/bulk", json=make_rows(0, 3))
+        self.client.put("/api/item/1", json={"title": "Updated", "complete": True})
+        self.client.delete("/api/item/2")
+
+        response = self.client.get("/api/item/changes")
+        self.assertEqual(response.status_code, 200)
+        changes = response.json()
+        # One entry per item, its last change
+        self.assertEqual(
+            [(change["op"], change["id"]) for change in changes],
+            [("create", 3), ("update", 1), ("delete", 2)],
+        )
+        self.assertEqual(changes[1]["record"]["title"], "Updated")
+        self.assertIsNone(changes[2]["record"])
+
+        # Delta sync from the last change seen
+        response = self.client.get(
+            "/api/item/changes", params={"since": changes[1]["seq"]}
+        )
+        self.assertEqual(response.json(), changes[2:])
+        response = self.client.get(
+            "/api/item/changes", params={"since": changes[-1]["seq"]}
+        )
+        self.assertEqual(response.json(), [])
+
+
+class AsyncApiTestCase(CommitTestCase):
+    """API test cases (async mode)."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Set up test environment. Runs once, before the tests."""
+        super().setUpClass()
+        cls.client = TestClient(async_app)
+
+    def test_crud(self) -> None:
+        """Test HTTP POST, GET, PUT and DELETE methods."""
+        response = self.client.post(
+            "/api/item", json={"title": FAKER.sentence(), "complete": FAKER.pybool()}
+        )
+        self.assertEqual(response.status_code, 200)
+        item_id = response.json()["id"]
+
+        response = self.client.get(f"/api/item/{item_id}")
+        self.assertEqual(response.status_code, 200)
+
+        new_data = {"title": FAKER.sentence(), "complete": FAKER.pybool()}
+        response = self.client.put(f"/api/item/{item_id}", json=new_data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["title"], new_data["title"])
+        self.assertEqual(response.json()["version"], 2)
+
+        response = self.client.patch(
+            f"/api/item/{item_id}", json={"complete": True, "version": 1}
+        )
+        self.assertEqual(response.status_code, 412)
+        response = self.client.patch(
+            f"/api/item/{item_id}", json={"complete": True, "version": 2}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["version"], 3)
+
+        response = self.client.delete(f"/api/item/{item_id}")
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(f"/api/item/{item_id}")
+        self.assertEqual(response.status_code, 404)
+
+    def test_changes_stream(self) -> None:
+        """Test the change feed stream (server-sent events)."""
+        self.client.post("/api/item/bulk", json=make_rows(0, 2))
+
+        response = self.client.get("/api/item/changes/stream")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(
+            response.headers["content-type"].startswith("text/event-stream")
+        )
+        events = [
+            dict(line.split(": ", 1) for line in event.splitlines())
+            for event in response.text.split("\n\n")
+            if event.startswith("id: ")
+        ]
+        self.assertEqual([event["event"] for event in events], ["create", "create"])
+        self.assertEqual(json.loads(events[1]["data"])["record"]["title"], "Item 1")
+
+        # Resumed after the last event seen
+        response = self.client.get(
+            "/api/item/changes/stream", headers={"Last-Event-ID": events[0]["id"]}
+        )
+        self.assertEqual(response.text.count("event: create"), 1)
+        response = self.client.get(
+            "/api/item/changes/stream", headers={"Last-Event-ID": "last"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_fields(self) -> None:
+        """Test HTTP GET method with sparse fields."""
+        with TEST_DATABASE.session() as session:
+            for _ in range(5):
+                session.add(Item(title=FAKER.sentence(), complete=FAKER.pybool()))
+            session.commit()
+
+        for client in (TestClient(app), self.client, TestClient(cached_app)):
+            response = client.get(
+                "/api/item", params={"limit": 2, "fields": "complete,title"}
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()), 2)
+            for item in response.json():
+                self.assertEqual(list(item), ["title", "complete"])
+            # Pagination still works without the primary key
+            cursor = response.headers["X-Next-Cursor"]
+            response = client.get(
+                "/api/item", params={"cursor": cursor, "fields": "title, id ,complete"}
+            )
+            self.assertEqual(
+                [list(item) for item in response.json()],
+                [["id", "title", "complete"]] * 3,
+            )
+            self.assertEqual(response.json()[0]["id"], 3)
+
+            full = client.get("/api/item/3").json()
+            response = client.get("/api/item/3", params={"fields": "title"})
+            self.assertEqual(response.json(), {"title": full["title"]})
+            # Sparse details are not cached in place of full ones
+            self.assertEqual(client.get("/api/item/3").json(), full)
+
+            response = client.get("/api/item/404", params={"fields": "title"})
+            self.assertEqual(response.status_code, 404)
+            response = client.get("/api/item", params={"fields": "title,secret"})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {"detail": "Unknown fields: secret"})
+            response = client.get("/api/item/3", params={"fields": ","})
+            self.assertEqual(response.status_code, 400)
+        TEST_CACHE.incr("/item:all")
+
+    def test_get_all_cursor(self) -> None:
+        """Test HTTP GET method (cursor pagination), bulk create and export."""
+        response = self.client.post(
+            "/api/item/bulk",
+            json=[
+                {"title": FAKER.sentence(), "complete": FAKER.pybool()}
+                for _ in range(5)
+            ],
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["created"], 5)
+
+        response = self.client.get("/api/item", params={"limit": 3})
+        self.assertEqual(len(response.json()), 3)
+        response = self.client.get(
+            "/api/item",
+            params={"limit": 3, "cursor": response.headers["X-Next-Cursor"]},
+        )
+        self.assertEqual(len(response.json()), 2)
+        self.assertNotIn("X-Next-Cursor", response.headers)
+
+        response = self.client.get("/api/item/export.ndjson")
+        self.assertEqual(len(response.text.splitlines()), 5)
+
+        response = self.client.delete("/api/item")
+        self.assertEqual(response.json(), [])
+
+
+class BatchingTestCase(CommitTestCase):
+    """Write-behind batching test cases."""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.batcher = WriteBatcher(
+            TEST_DATABASE.engine, Item.__table__, max_size=50, interval=0.05
+        )
+        self.addCleanup(self.batcher.close)
+        self.app = FastAPI()
+        self.app.include_router(
+            CRUDRouter(
+                schema=Item,
+                create_schema=ItemCreate,
+                update_schema=ItemUpdate,
+                db_model=Item,
+                db=TEST_DATABASE.get_db,
+                batcher=self.batcher,
+            ),
+            prefix="/api",
+        )
+
+    def test_create(self) -> None:
+        """Test that concurrent creates are committed together."""
+        records = make_rows(0, 120)
+
+        async def create_all():
+            transport = httpx.ASGITransport(app=self.app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://test"
+            ) as client:
+                return await asyncio.gather(
+                    *(client.post("/api/item", json=record) for record in records)
+                )
+
+        responses = asyncio.run(create_all())
+        self.assertEqual({response.status_code for response in responses}, {200})
+        self.assertEqual(len({response.json()["id"] for response in responses}), 120)
+        self.assertEqual(self.batcher.rows, 120)
+        self.assertLessEqual(self.batcher.batches, 10)
+
+        client = TestClient(self.app)
+        for record, response in zip(records, responses):
+            item = response.json()
+            self.assertEqual(item["title"], record["title"])
+            self.assertEqual(item["version"], 1)
+            self.assertEqual(client.get(f"/api/item/{item['id']}").json(), item)
+
+        # Queued rows are written on close
+        futures = [self.batcher.submit(record) for record in make_rows(120, 125)]
+        self.batcher.close()
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertEqual(len(client.get("/api/item").json()), 125)
+
+    def test_integrity_error(self) -> None:
+        """Test that only the offending rows of a batch fail."""
+        records = make_rows(0, 3)
+        records[1]["title"] = None
+        futures = [self.batcher.submit(record) for record in records]
+        self.assertEqual(futures[0].result()["title"], "Item 0")
+        self.assertRaises(IntegrityError, futures[1].result)
+        self.assertEqual(futures[2].result()["title"], "Item 2")
+
+        client = TestClient(self.app)
+        response = client.post("/api/item", json=make_rows(3, 4)[0])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["title"], "Item 3")
+
+
+class CacheTestCase(DatabaseTestCase):
+    """Response cache test cases."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Set up test environment. Runs once, before the tests."""
+        super().setUpClass()
+        cls.client = TestClient(cached_app)
+
+    def tearDown(self):
+        """Tear down test environment. Runs after each test."""
+        TEST_CACHE.incr("/item:all")
+
+    def test_get(self) -> None:
+        """Test cached detail responses, ETag and invalidation."""
+        response = self.client.post(
+            "/api/item", json={"title": FAKER.sentence(), "complete": FAKER.pybool()}
+        )
+        item_id = response.json()["id"]
+
+        response = self.client.get(f"/api/item/{item_id}")
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers["ETag"]
+
+        hits = TEST_CACHE.hits
+        response = self.client.get(
+            f"/api/item/{item_id}", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(TEST_CACHE.hits, hits + 1)
+
+        new_data = {"title": FAKER.sentence(), "complete": FAKER.pybool()}
+        self.client.put(f"/api/item/{item_id}", json=new_data)
+        response = self.client.get(
+            f"/api/item/{item_id}", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["title"], new_data["title"])
+
+        self.client.patch(f"/api/item/{item_id}", json={"title": "Patched"})
+        response = self.client.get(f"/api/item/{item_id}")
+        self.assertEqual(response.json()["title"], "Patched")
+
+        self.client.delete(f"/api/item/{item_id}")
+        response = self.client.get(f"/api/item/{item_id}")
+        self.assertEqual(response.status_code, 404)
+
+    def test_get_all(self) -> None:
+        """Test cached list responses and invalidation."""
+        self.client.post(
+            "/api/item", json={"title": FAKER.sentence(), "complete": FAKER.pybool()}
+        )
+        response = self.client.get("/api/item", params={"limit": 1})
+        self.assertEqual(len(response.json()), 1)
+        self.assertIn("X-Next-Cursor", response.headers)
+
+        # Cached pages keep their headers
+        response = self.client.get("/api/item", params={"limit": 1})
+        self.assertIn("X-Next-Cursor", response.headers)
+
+        self.client.post(
+            "/api/item", json={"title": FAKER.sentence(), "complete": FAKER.pybool()}
+        )
+        response = self.client.get("/api/item")
+        self.assertEqual(len(response.json()), 2)
+
+        self.client.delete("/api/item")
+        response = self.client.get("/api/item")
+        self.assertEqual(response.json(), [])
+
+    def test_get_batch(self) -> None:
+        """Test batches of ids served from cached detail responses."""
+        self.client.post("/api/item/bulk", json=make_rows(0, 3))
+        expected = self.client.get("/api/item/1").json()
+
+        hits = TEST_CACHE.hits
+        response = self.client.get("/api/item/batch", params={"ids": "1,2"})
+        self.assertEqual(response.json()["records"][0], expected)
+        self.assertEqual(TEST_CACHE.hits, hits + 1)
+
+        # Cached ids do not touch the database
+        with TEST_DATABASE.session() as session:
+            session.execute(text("DELETE FROM item WHERE id IN (1, 2)"))
+            session.commit()
+        response = self.client.get("/api/item/batch", params={"ids": "2,1,3"})
+        self.assertEqual([item["id"] for item in response.json()["records"]], [2, 1, 3])
+
+        # Writes through the API invalidate them
+        self.client.delete("/api/item/3")
+        response = self.client.post("/api/item/batch", json={"ids": [3, 1]})
+        self.assertEqual(response.json()["missing"], [3])
+
+    def test_stale_read(self) -> None:
+        """Test that a response read before a write is not served after it."""
+        cache = ResourceCache(LRUCache(), "/test")
+        stale = CacheEntry(body=b"{}", etag='"stale"', headers={})
+        # A read takes its keys, then a write lands before it sets them
+        one_key, list_key = cache.one_key(1), cache.list_key("")
+        cache.invalidate(1)
+        cache.set(one_key, stale)
+        cache.set(list_key, stale)
+        self.assertIsNone(cache.get(cache.one_key(1)))
+        self.assertIsNone(cache.get(cache.list_key("")))
+        # Other items are left cached
+        cache.set(cache.one_key(2), stale)
+        cache.invalidate(1)
+        self.assertEqual(cache.get(cache.one_key(2)), stale)
+
+    def test_lru_cache(self) -> None:
+        """Test LRU eviction and TTL expiration."""
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.stats["evictions"], 1)
+
+        cache.ttl = -1
+        cache.set("d", 4)
+        self.assertIsNone(cache.get("d"))
+        self.assertEqual(cache.stats["expirations"], 1)
+
+
+class EngineTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.database_url = f"sqlite:///{os.path.join(self.directory.name, 'e.db')}"
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_pragmas(self) -> None:
+        """Test that connections get the tuning pragmas."""
+        query = text(
+            "SELECT journal_mode, synchronous, timeout "
+            "FROM pragma_journal_mode, pragma_synchronous, pragma_busy_timeout"
+        )
+        engine = make_engine(self.database_url)
+        with engine.connect() as connection:
+            self.assertEqual(tuple(connection.execute(query).one()), ("wal", 1, 5000))
+        self.assertEqual(engine.pool.size(), 10)
+        engine.dispose()
+
+        async def run():
+            async_engine = make_async_engine(self.database_url)
+            async with async_engine.connect() as connection:
+                row = (await connection.execute(query)).one()
+            await async_engine.dispose()
+            return tuple(row)
+
+        self.assertEqual(asyncio.run(run()), ("wal", 1, 5000))
+
+
+class BenchmarksTestCase(unittest.TestCase):
+    def test_bench_crud(self) -> None:
+        """Test that the CRUD benchmark drives every route without errors."""
+        overrides = dict(app.dependency_overrides)
+        with tempfile.TemporaryDirectory() as directory:
+            results = bench_crud(
+                f"sqlite:///{os.path.join(directory, 'b.db')}",
+                size=20,
+                limit=5,
+                concurrency=2,
+                requests=10,
+            )
+        self.assertEqual(app.dependency_overrides, overrides)
+        self.assertEqual(
+            set(results["routes"]),
+            {
+                "get_all",
+                "get_one",
+                "create",
+                "update",
+                "delete_one",
+                "bulk",
+                "export",
+                "delete_all",
+            },
+        )
+        for name, route in results["routes"].items():
+            self.assertEqual(route["errors"], 0, name)
+            self.assertLessEqual(route["p50_ms"], route["p95_ms"])
+            self.assertLessEqual(route["p95_ms"], route["p99_ms"])
+        self.assertGreater(results["max_rss_kib"], 0)
+
+    def test_compare(self) -> None:
+        """Test regression detection between two runs."""
+        baseline = {
+            "crud": {
+                "get_one": {"requests_per_second": 100.0, "p99_ms": 10.0},
+                "create": {"errors": 0, "p99_ms": 10.0},
+            },
+            "size": 1000,
+        }
+        current = {
+            "crud": {
+                "get_one": {"requests_per_second": 70.0, "p99_ms": 11.0},
+                "create": {"errors": 2, "p99_ms": 5.0},
+                "update": {"p99_ms": 50.0},
+            },
+            "size": 5000,
+        }
+        self.assertEqual(
+            compare(baseline, current, 20),
+            [
+                "crud.get_one.requests_per_second: 100.0 -> 70.0 (30.0% worse)",
+                "crud.create.errors: 0 -> 2 (inf% worse)",
+            ],
+        )
+        self.assertEqual(compare(baseline, baseline, 0), [])
+        self.assertEqual(len(compare(baseline, current, 5)), 3)
+
+
+class MetricsTestCase(CommitTestCase):
+    # Query counts are checked: no savepoints around the queries of a test
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        cls.client = TestClient(app)
+
+    def test_server_timing(self) -> None:
+        """Test Server-Timing headers and Prometheus metrics."""
+        response = self.client.get("/api/item")
+        self.assertEqual(response.status_code, 200)
+        timing = response.headers["Server-Timing"]
+        # The last change (for the ETag) and the page
+        self.assertRegex(
+            timing,
+            r'^db;dur=[\d.]+;desc="2 queries", handler;dur=[\d.]+, '
+            r"serialize;dur=[\d.]+, total;dur=[\d.]+$",
+        )
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain"))
+        labels = 'method="GET",route="/api/item"'
+        self.assertIn(f"http_request_duration_seconds_count{{{labels}}}", response.text)
+        self.assertIn(f'http_request_queries_bucket{{{labels},le="1"}}', response.text)
+        self.assertIn(f"http_request_db_seconds_sum{{{labels}}}", response.text)
+
+    def test_chunked_bulk(self) -> None:
+        """Test that statements repeated per chunk of a bulk write are not
+        flagged as N+1 queries."""
+        response = self.client.post(
+            "/api/item/bulk",
+            params={"chunk_size": 10},
+            json=[{"title": FAKER.sentence()} for _ in range(150)],
+        )
+        self.assertEqual(len(response.json()["chunks"]), 15)
+        self.assertNotIn("n-plus-one", response.headers["Server-Timing"])
+        response = self.client.delete(
+            "/api/item/bulk", params={"chunk_size": 10, "complete": True}
+        )
+        self.assertEqual(response.json()["deleted"], 150)
+        self.assertNotIn("n-plus-one", response.headers["Server-Timing"])
+        response = self.client.get("/metrics")
+        for method in ("POST", "DELETE"):
+            labels = f'method="{method}",route="/api/item/bulk"'
+            self.assertNotIn(
+                f"http_request_n_plus_one_total{{{labels}}}", response.text
+            )
+
+    def test_n_plus_one(self) -> None:
+        """Test that repeated statements are flagged."""
+        metrics = Metrics(n_plus_one_threshold=5)
+        n_plus_one_app = FastAPI()
+        n_plus_one_app.add_middleware(MetricsMiddleware, metrics=metrics)
+        router = APIRouter(route_class=InstrumentedRoute)
+
+        @router.get("/n-plus-one")
+        def n_plus_one(n: int):
+            with TEST_DATABASE.engine.connect() as connection:
+                for i in range(n):
+                    connection.execute(text("SELECT :i"), {"i": i})
+            return {}
+
+        n_plus_one_app.include_router(router)
+        client = TestClient(n_plus_one_app)
+        with self.assertLogs("metrics", "WARNING") as logs:
+            response = client.get("/n-plus-one", params={"n": 6})
+        self.assertIn("db;dur=", response.headers["Server-Timing"])
+        self.assertIn('desc="6 queries"', response.headers["Server-Timing"])
+        self.assertIn("n-plus-one", response.headers["Server-Timing"])
+        self.assertIn("repeated 6 times: SELECT ?", logs.output[0])
+
+        response = client.get("/n-plus-one", params={"n": 4})
+        self.assertNotIn("n-plus-one", response.headers["Server-Timing"])
+        self.assertEqual(metrics.n_plus_one.values, {("GET", "/n-plus-one"): 1})
+
+
+class FastJsonTestCase(CommitTestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        cls.client = TestClient(app)
+        cls.fast_client = TestClient(fast_app)
+
+    def test_same_responses(self) -> None:
+        """Test that fast JSON responses match the response model ones."""
+        records = [{"title": f"Item {i}", "complete": bool(i % 2)} for i in range(5)]
+        response = self.client.post("/api/item/bulk", json=records)
+        self.assertEqual(response.status_code, 200)
+
+        for prefix in ("/api", "/async"):
+            for url, params in (
+                ("/item", {"limit": 3}),
+                ("/item", {"limit": 3, "skip": 3}),
+                ("/item/2", {}),
+                ("/item/batch", {"ids": "4,2,404"}),
+            ):
+                expected = self.client.get(f"/api{url}", params=params)
+                # Twice, the second time from the cache
+                for _ in range(2):
+                    response = self.fast_client.get(f"{prefix}{url}", params=params)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(response.json(), expected.json())
+                    self.assertEqual(
+                        response.headers.get("X-Next-Cursor"),
+                        expected.headers.get("X-Next-Cursor"),
+                    )
+                    self.assertEqual(
+                        response.headers["content-type"], "application/json"
+                    )
+            response = self.fast_client.get(f"{prefix}/item/404")
+            self.assertEqual(response.status_code, 404)
+
+    def test_same_openapi(self) -> None:
+        """Test that the fast JSON mode keeps the OpenAPI contract."""
+
+        schemas = []
+        for fast_json in (False, True):
+            schema_app = FastAPI()
+            schema_app.include_router(
+                CRUDRouter(
+                    schema=Item,
+                    create_schema=ItemCreate,
+                    update_schema=ItemUpdate,
+                    db_model=Item,
+                    db=TEST_DATABASE.get_db,
+                    fast_json=fast_json,
+                ),
+                prefix="/api",
+            )
+            schemas.append(schema_app.openapi())
+        self.assertEqual(schemas[0], schemas[1])
+
+
+class HttpTestCase(DatabaseTestCase):
+    """Compression and HTTP caching headers test cases."""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        """Set up test environment. Runs once, before the tests."""
+        super().setUpClass()
+        cls.client = TestClient(app)
+
+    def test_compression(self) -> None:
+        """Test gzip and brotli compression of large responses."""
+        records = [{"title": f"Item {i}", "complete": bool(i % 2)} for i in range(50)]
+        self.client.post("/api/item/bulk", json=records)
+        expected = self.client.get(
+            "/api/item", params={"limit": 50}, headers={"Accept-Encoding": "identity"}
+        )
+        self.assertNotIn("content-encoding", expected.headers)
+
+        for accept_encoding, encoding in (
+            ("gzip", "gzip"),
+            ("br", "br"),
+            ("gzip, br", "br"),
+            ("gzip;q=1, br;q=0.5", "gzip"),
+            ("*", "br"),
+        ):
+            response = self.client.get(
+                "/api/item",
+                params={"limit": 50},
+                headers={"Accept-Encoding": accept_encoding},
+            )
+            self.assertEqual(response.headers["content-encoding"], encoding)
+            self.assertIn("Accept-Encoding", response.headers["vary"])
+            self.assertEqual(response.json(), expected.json())
+
+        # Small responses are sent as they are
+        response = self.client.get("/api/item/1", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("content-encoding", response.headers)
+
+        # Streamed responses are compressed chunk by chunk
+        response = self.client.get(
+            "/api/item/export.ndjson", headers={"Accept-Encoding": "gzip"}
+        )
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        self.assertEqual(len(response.text.splitlines()), 50)
+
+        middleware = CompressionMiddleware(app)
+        self.assertIsNone(middleware.select_encoding("gzip;q=0, br;q=0"))
+        self.assertIsNone(middleware.select_encoding("identity"))
+
+    def test_last_modified(self) -> None:
+        """Test Cache-Control, Last-Modified and If-Modified-Since."""
+        response = self.client.post("/api/item", json={"title": FAKER.sentence()})
+        item_id = response.json()["id"]
+        with TEST_DATABASE.begin() as connection:
+            connection.execute(
+                text("UPDATE item SET updated_at = '2020-01-01 10:00:00'")
+            )
+
+        for params in ({}, {"fields": "title"}):
+            response = self.client.get(f"/api/item/{item_id}", params=params)
+            self.assertEqual(response.headers["cache-control"], "no-cache")
+            self.assertEqual(
+                response.headers["last-modified"], "Wed, 01 Jan 2020 10:00:00 GMT"
+            )
+        response = self.client.get("/api/item")
+        self.assertEqual(response.headers["cache-control"], "no-cache")
+
+        response = self.client.get(
+            f"/api/item/{item_id}",
+            headers={"If-Modified-Since": "Wed, 01 Jan 2020 10:00:00 GMT"},
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        response = self.client.get(
+            f"/api/item/{item_id}",
+            headers={"If-Modified-Since": "Wed, 01 Jan 2020 09:59:59 GMT"},
+        )
+        self.assertEqual(response.status_code, 200)
+
+        # Updates set the modification time
+        self.client.patch(f"/api/item/{item_id}", json={"complete": False})
+        response = self.client.get(
+            f"/api/item/{item_id}",
+            headers={"If-Modified-Since": "Wed, 01 Jan 2020 10:00:00 GMT"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(response.json()["updated_at"], "2020-01-01T10:00:00")
+
+    def test_list_etag(self) -> None:
+        """Test the ETag of list pages, moved by any write."""
+        response = self.client.post("/api/item", json={"title": FAKER.sentence()})
+        item_id = response.json()["id"]
+        response = self.client.get("/api/item")
+        self.assertNotIn("last-modified", response.headers)
+        etag = response.headers["etag"]
+
+        for params in ({}, {"fields": "title"}):
+            response = self.client.get(
+                "/api/item", params=params, headers={"If-None-Match": etag}
+            )
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b"")
+            self.assertEqual(response.headers["cache-control"], "no-cache")
+
+        # Deletes move it too
+        self.client.delete(f"/api/item/{item_id}")
+        response = self.client.get("/api/item", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["etag"], etag)
+
+        client = TestClient(async_app)
+        etag = client.get("/api/item").headers["etag"]
+        response = client.get("/api/item", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+
+class ServerTestCase(CommitTestCase):
+    def test_worker_count(self) -> None:
+        """Test that SQLite databases only get several workers in WAL mode."""
+        database_url = "sqlite:///./test.db"
+        self.assertEqual(worker_count(4, database_url, "WAL"), 4)
+        self.assertEqual(worker_count(0, database_url, "wal"), os.cpu_count())
+        self.assertEqual(worker_count(4, database_url, "DELETE"), 1)
+        self.assertEqual(worker_count(4, "sqlite://", "WAL"), 1)
+        self.assertEqual(worker_count(4, "postgresql://db/forana", "DELETE"), 4)
+
+        options = server_options(port=8080, workers=4)
+        self.assertEqual(options["workers"], 4)
+        self.assertEqual(options["loop"], "auto")
+        self.assertFalse(options["access_log"])
+
+    def test_startup(self) -> None:
+        """Test the time and memory budget of a cold start."""
+        output = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env={**os.environ, "FORANA_DATABASE_URL": TEST_DATABASE.url},
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+        startup = json.loads(output)
+        self.assertLess(startup["time"], STARTUP_TIME_BUDGET)
+        self.assertLess(startup["rss"], STARTUP_RSS_BUDGET)
+        # The admin is only built on its first request
+        self.assertFalse(startup["admin"])
+
+    def test_admin(self) -> None:
+        """Test the lazily built admin."""
+        admin_app = FastAPI()
+        admin = LazyAdmin(lambda: create_admin(TEST_DATABASE.engine))
+        admin_app.mount("/admin", admin, name="admin")
+        self.assertIsNone(admin._app)
+
+        with TEST_DATABASE.session() as session:
+            session.add(Item(title=FAKER.sentence()))
+            session.commit()
+        client = TestClient(admin_app)
+        response = client.get("/admin/item/list")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('href="http://testserver/admin/', response.text)
+        response = client.get("/admin/api/item", params={"skip": 0, "limit": 10})
+        self.assertEqual(response.json()["total"], 1)
+
+
+class MigrationTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.database_url = (
+            f"sqlite:///{os.path.join(self.directory.name, 'migrate.db')}"
+        )
+        self.engine = make_engine(self.database_url)
+        self.config = Config()
+        self.config.set_main_option("script_location", "alembic")
+        self.config.set_main_option("sqlalchemy.url", self.database_url)
+
+    def tearDown(self) -> None:
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def test_upgrade(self) -> None:
+        """Test the migrations of a legacy database, and their time budget."""
+        insert = text("INSERT INTO item (title, complete) VALUES (:title, :complete)")
+        with self.engine.begin() as connection:
+            connection.execute(text(LEGACY_ITEM_TABLE))
+            for start in range(0, MIGRATION_ROWS, 10_000):
+                connection.execute(
+                    insert, make_rows(start, min(start + 10_000, MIGRATION_ROWS))
+                )
+
+        start = time.perf_counter()
+        command.upgrade(self.config, "head")
+        self.assertLess(time.perf_counter() - start, MIGRATION_TIME_BUDGET)
+
+        inspector = inspect(self.engine)
+        columns = {column["name"] for column in inspector.get_columns("item")}
+        self.assertLessEqual({"version", "updated_at"}, columns)
+        indexes = {index["name"] for index in inspector.get_indexes("item")}
+        self.assertIn("ix_item_complete", indexes)
+
+        # New tables come from ``create_tables()``, then the schema matches
+        # the models
+        SQLModel.metadata.create_all(self.engine)
+        command.check(self.config)
+        with Session(self.engine) as session:
+            self.assertEqual(session.get(Item, 1).version, 1)
+            item = Item(title="New")
+            session.add(item)
+            session.commit()
+            session.refresh(item)
+            self.assertIsNotNone(item.updated_at)
+
+    def test_create_tables(self) -> None:
+        """Test the migrations of a database made by ``create_tables()``."""
+        SQLModel.metadata.create_all(self.engine)
+        command.upgrade(self.config, "head")
+        command.check(self.config)
+        command.downgrade(self.config, "base")
+        self.assertNotIn(
+            "ix_item_complete",
+            {index["name"] for index in inspect(self.engine).get_indexes("item")},
+        )
+        command.upgrade(self.config, "head")
+        command.check(self.config)
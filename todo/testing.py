@@ -0,0 +1,202 @@
+"""
+Test database fixtures, shared by the test modules. See ``TestDatabase``.
+
+Every test process (pytest-xdist worker) gets a SQLite database file of its
+own, on tmpfs if available, and the schema is created once. Tests of
+``DatabaseTestCase`` run in a transaction rolled back after the test, so
+that setting up a test costs the same however many tests and tables there
+are. Tests of ``CommitTestCase`` are for code committing on connections of
+its own: the rows they leave are deleted after the test instead.
+"""
+import atexit
+import os
+import tempfile
+import unittest
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Iterator, Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Connection, Transaction
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import Session, SQLModel, create_engine
+
+import models  # noqa
+
+__all__ = (
+    "CommitTestCase",
+    "DatabaseTestCase",
+    "TEST_DATABASE",
+    "TestDatabase",
+    "worker_database_url",
+)
+
+
+def worker_database_url(name: str) -> str:
+    """URL of a SQLite database file of the current test process, on tmpfs
+    (``/dev/shm``) if available."""
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    worker = os.environ.get("PYTEST_XDIST_WORKER", "main")
+    filename = f"forana-{name}-{worker}-{os.getpid()}.db"
+    return f"sqlite:///{os.path.join(directory, filename)}"
+
+
+def _disable_pysqlite_transactions(dbapi_connection, connection_record) -> None:
+    # pysqlite begins transactions on its own, only before DML statements,
+    # which breaks savepoints: let SQLAlchemy emit BEGIN instead
+    dbapi_connection.isolation_level = None
+
+
+def _begin(connection: Connection) -> None:
+    connection.exec_driver_sql("BEGIN")
+
+
+class TestDatabase:
+    """SQLite test database.
+
+    ``begin_test`` begins a transaction on a connection of its own, which
+    sessions (``session``, ``get_db``) join: their commits and rollbacks
+    end a savepoint, which is started again, and ``rollback_test`` rolls it
+    all back. The async engine and ``engine`` do not see the transaction.
+
+    ``begin()`` works like ``Engine.begin()`` (within the transaction of
+    the test, if any), so that the database can be passed for an engine
+    where one is only used that way.
+    """
+
+    __test__ = False
+
+    def __init__(self, url: str):
+        self.url = url
+        self.engine = create_engine(url, connect_args={"check_same_thread": False})
+        self.async_engine = create_async_engine(
+            url.replace("sqlite://", "sqlite+aiosqlite://", 1), poolclass=NullPool
+        )
+        self._transaction_engine = create_engine(
+            url, connect_args={"check_same_thread": False}, poolclass=NullPool
+        )
+        event.listen(
+            self._transaction_engine, "connect", _disable_pysqlite_transactions
+        )
+        event.listen(self._transaction_engine, "begin", _begin)
+        self.connection: Optional[Connection] = None
+        self._transaction: Optional[Transaction] = None
+        self._savepoint: Optional[Transaction] = None
+        self._created = False
+
+    @property
+    def path(self) -> str:
+        return self.engine.url.database
+
+    def create(self) -> None:
+        """Create the database and its schema, once per process."""
+        if self._created:
+            return
+        self.remove()
+        SQLModel.metadata.create_all(self.engine)
+        self._created = True
+        atexit.register(self.remove)
+
+    def remove(self) -> None:
+        """Delete the database files."""
+        self.engine.dispose()
+        for suffix in ("", "-journal", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+        self._created = False
+
+    def begin_test(self) -> None:
+        """Begin the transaction of a test."""
+        self.connection = self._transaction_engine.connect()
+        self._transaction = self.connection.begin()
+        self._savepoint = self.connection.begin_nested()
+
+    def rollback_test(self) -> None:
+        """Roll back the transaction of a test."""
+        self._transaction.rollback()
+        self.connection.close()
+        self.connection = self._transaction = self._savepoint = None
+
+    def _restart_savepoint(self, session: Session, transaction: Any) -> None:
+        if self.connection is not None and not self._savepoint.is_active:
+            self._savepoint = self.connection.begin_nested()
+
+    def session(self) -> Session:
+        """New session, in the transaction of the test, if any."""
+        if self.connection is None:
+            return Session(self.engine, autoflush=False)
+        session = Session(bind=self.connection, autoflush=False)
+        event.listen(session, "after_transaction_end", self._restart_savepoint)
+        return session
+
+    @contextmanager
+    def begin(self) -> Iterator[Connection]:
+        """Connection in a transaction committed on exit."""
+        if self.connection is None:
+            with self.engine.begin() as connection:
+                yield connection
+        else:
+            with self.connection.begin_nested():
+                yield self.connection
+            # Committed: not rolled back by the next session rollback
+            self._savepoint.commit()
+            self._savepoint = self.connection.begin_nested()
+
+    def delete_all(self) -> None:
+        """Delete all rows and reset autoincrement counters.
+
+        Tables are emptied parents first, so that rows written by triggers
+        on delete go too.
+        """
+        with self.engine.begin() as connection:
+            for table in SQLModel.metadata.sorted_tables:
+                connection.execute(table.delete())
+            sequences = text(
+                "SELECT count(*) FROM sqlite_master WHERE name = 'sqlite_sequence'"
+            )
+            if connection.execute(sequences).scalar():
+                connection.execute(text("DELETE FROM sqlite_sequence"))
+
+    def get_db(self) -> Iterator[Session]:
+        """Session dependency, in place of ``db.get_db``."""
+        with self.session() as db:
+            yield db
+
+    async def get_async_db(self) -> AsyncIterator[AsyncSession]:
+        """Async session dependency, in place of ``db.get_async_db``."""
+        async with AsyncSession(self.async_engine, expire_on_commit=False) as db:
+            yield db
+
+
+TEST_DATABASE = TestDatabase(
+    worker_database_url(os.path.basename(os.path.dirname(os.path.abspath(__file__))))
+)
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """Test case on ``TEST_DATABASE``, running in a transaction rolled back
+    after every test."""
+
+    database = TEST_DATABASE
+    rollback = True
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        cls.database.create()
+
+    def setUp(self) -> None:
+        super().setUp()
+        if self.rollback:
+            self.database.begin_test()
+            self.addCleanup(self.database.rollback_test)
+        else:
+            self.addCleanup(self.database.delete_all)
+
+
+class CommitTestCase(DatabaseTestCase):
+    """Test case on ``TEST_DATABASE`` for code committing on connections of
+    its own (the async engine, background threads), which cannot join the
+    transaction of a test: rows are deleted after every test instead."""
+
+    rollback = False